@@ -0,0 +1,397 @@
+# Benchmark retrieval quality and speed over the retriever evaluation set, e.g.:
+#   python benchmark_retriever_002.py .ragatouille/colbert/indexes/Experiment_002 --modes hybrid dense bm25 --batch_sizes 1 32
+# Offline run on a small generated corpus (BM25 only, no model download):
+#   python benchmark_retriever_002.py --synthetic
+# Flag regressions against an earlier run (exits with status 1 if there are any):
+#   python benchmark_retriever_002.py .ragatouille/colbert/indexes/Experiment_002 --compare previous_benchmark.json
+
+import sys
+import json
+import math
+import time
+import random
+import logging
+import argparse
+import platform
+import resource
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, List, Optional, Set, Tuple
+from bm25_index import BM25Index, BM25SearchModel
+from rag_client import RAGServiceClient
+from tracing import stage_percentiles
+
+K_VALUES = [1, 5, 10, 20]  # Cutoffs for recall@k and nDCG@k; retrieval depth is the largest
+BATCH_SIZES = [1, 32]  # Single-query latency and the default batched search size
+MODES = ['hybrid', 'dense', 'bm25', 'quantized', 'quantized_hybrid', 'sharded', 'sharded_hybrid']
+QUALITY_TOLERANCE = 0.01  # Absolute drop in a quality metric reported as a regression
+PERFORMANCE_TOLERANCE = 0.10  # Relative p95 latency/peak RSS increase or QPS drop reported as a regression
+MIN_SEARCH_SECONDS = 2.0  # Passes over the evaluation set are repeated until timed searches add up to this
+LATENCY_NOISE_MS = 1.0  # p95 or per-query time (1000 / QPS) increases smaller than this are ignored, sub-millisecond timings are mostly noise
+SYNTHETIC_DOCUMENTS = 20
+SYNTHETIC_CHUNKS_PER_DOCUMENT = 50
+SYNTHETIC_QUESTIONS = 200
+SYNTHETIC_CHUNK_LENGTH = 80  # Tokens per synthetic chunk
+SYNTHETIC_QUESTION_LENGTH = 4  # Tokens sampled from the target chunk per synthetic question
+
+def setup_logger() -> logging.Logger:
+    """Configure and return a logger instance"""
+    logger = logging.getLogger(__name__)
+    logger.setLevel(logging.INFO)
+
+    if not logger.handlers:
+        console_handler = logging.StreamHandler()
+        formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+        console_handler.setFormatter(formatter)
+        logger.addHandler(console_handler)
+
+    return logger
+
+def recall_at_k(retrieved: List[str], relevant: Set[str], k: int) -> float:
+    """Fraction of the relevant chunks found in the top k"""
+    return len(relevant.intersection(retrieved[:k])) / len(relevant)
+
+def reciprocal_rank(retrieved: List[str], relevant: Set[str]) -> float:
+    """1 / rank of the first relevant chunk, 0 if none was retrieved"""
+    for rank, chunk_id in enumerate(retrieved, 1):
+        if chunk_id in relevant:
+            return 1.0 / rank
+    return 0.0
+
+def ndcg_at_k(retrieved: List[str], relevant: Set[str], k: int) -> float:
+    """Normalized discounted cumulative gain of the top k with binary relevance"""
+    dcg = sum(1.0 / math.log2(rank + 1) for rank, chunk_id in enumerate(retrieved[:k], 1) if chunk_id in relevant)
+    ideal = sum(1.0 / math.log2(rank + 1) for rank in range(1, min(len(relevant), k) + 1))
+    return dcg / ideal
+
+def quality_metrics(rankings: List[List[str]], ground_truths: List[List[str]],
+                    k_values: List[int] = K_VALUES) -> Dict[str, float]:
+    """
+    Mean recall@k, MRR and nDCG@k over a set of questions
+
+    Args:
+        rankings: Retrieved chunk ids per question, best first
+        ground_truths: Relevant chunk ids per question; questions without any are skipped
+        k_values: Cutoffs for recall and nDCG
+
+    Returns:
+        Metric name -> mean value, plus the number of questions scored
+    """
+    totals: Dict[str, float] = {}
+    scored = 0
+    for retrieved, ground_truth in zip(rankings, ground_truths):
+        relevant = set(ground_truth)
+        if not relevant:
+            continue
+        scored += 1
+        for k in k_values:
+            totals[f"recall@{k}"] = totals.get(f"recall@{k}", 0.0) + recall_at_k(retrieved, relevant, k)
+        totals["mrr"] = totals.get("mrr", 0.0) + reciprocal_rank(retrieved, relevant)
+        for k in k_values:
+            totals[f"ndcg@{k}"] = totals.get(f"ndcg@{k}", 0.0) + ndcg_at_k(retrieved, relevant, k)
+
+    metrics = {name: round(total / scored, 4) for name, total in totals.items()}
+    metrics["questions"] = scored
+    return metrics
+
+def peak_rss_mb() -> float:
+    """Peak resident set size of this process so far"""
+    # Linux carries ru_maxrss over from the parent into a spawned process, VmHWM starts afresh
+    try:
+        with open('/proc/self/status', 'r') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+def build_synthetic_benchmark(num_documents: int = SYNTHETIC_DOCUMENTS,
+                              chunks_per_document: int = SYNTHETIC_CHUNKS_PER_DOCUMENT,
+                              num_questions: int = SYNTHETIC_QUESTIONS,
+                              seed: int = 0) -> Tuple[BM25Index, List[Dict]]:
+    """
+    Generate a small corpus, its BM25 index and an evaluation set, for benchmarking without a real index
+
+    Each document draws most of its words from its own topic vocabulary and
+    the rest from a shared one, and each question is a handful of words
+    sampled from one chunk, which is its ground truth.
+
+    Returns:
+        (bm25_index, eval_set) with eval set items in the retriever_evaluation_set.json layout
+    """
+    rng = random.Random(seed)
+    shared_vocabulary = [f"common{i}" for i in range(200)]
+    bm25_index = BM25Index()
+    chunks = []
+
+    for doc in range(num_documents):
+        topic_vocabulary = [f"doc{doc}term{i}" for i in range(150)]
+        for chunk in range(chunks_per_document):
+            words = [
+                rng.choice(topic_vocabulary) if rng.random() < 0.5 else rng.choice(shared_vocabulary)
+                for _ in range(SYNTHETIC_CHUNK_LENGTH)
+            ]
+            chunk_id = f"SYNTHETIC_DOC_{doc}_chunk_{chunk}"
+            content = ' '.join(words)
+            bm25_index.add(chunk_id, content, {"Header 1": f"Synthetic document {doc}"})
+            chunks.append((chunk_id, words))
+
+    eval_set = []
+    for _ in range(num_questions):
+        chunk_id, words = rng.choice(chunks)
+        eval_set.append({
+            "question": ' '.join(rng.sample(words, SYNTHETIC_QUESTION_LENGTH)),
+            "chunk_ids": [chunk_id],
+        })
+
+    return bm25_index, eval_set
+
+def search_batch(rag_model, queries: List[str], k: int) -> List[List[Dict]]:
+    """One search() call for a batch of queries, always returning one result list per query"""
+    results = rag_model.search(queries, k=k)
+    # RAGatouille unwraps the result list when given a single query
+    if len(queries) == 1 and (not results or isinstance(results[0], dict)):
+        results = [results]
+    return results
+
+def load_variant(mode: str, index_path: Path, logger: logging.Logger):
+    """Load an index for benchmarking, without the query cache so repeated runs measure real searches"""
+    if mode == 'bm25':
+        bm25_index = BM25Index.load(index_path)
+        if bm25_index is None:
+            raise FileNotFoundError(f"No BM25 index found in {index_path}, rebuild the index to create one")
+        return BM25SearchModel(bm25_index)
+
+    # Imported here so BM25-only and synthetic runs work without ragatouille
+    from rag_utils import load_search_model
+    return load_search_model(
+        index_path, hybrid=mode.endswith('hybrid'), quantized=mode.startswith('quantized'),
+        sharded=mode.startswith('sharded'), logger=logger
+    ).rag_model
+
+def benchmark_variant(settings: Dict, mode: str, index_path: Path,
+                      eval_set: List[Dict], eval_set_name: str) -> List[Dict]:
+    """Load and benchmark one index variant, run in a fresh process by RetrieverBenchmark.run_isolated"""
+    benchmark = RetrieverBenchmark(**settings)
+    load_start = time.perf_counter()
+    rag_model = load_variant(mode, index_path, benchmark.logger)
+    benchmark.run(f"{index_path.name}:{mode}", rag_model, eval_set, eval_set_name, time.perf_counter() - load_start)
+    return benchmark.runs
+
+class RetrieverBenchmark:
+    def __init__(self, k_values: List[int] = K_VALUES, batch_sizes: List[int] = BATCH_SIZES,
+                 repeats: int = 1, warmup_batches: int = 1):
+        """
+        Args:
+            k_values: Cutoffs for recall@k and nDCG@k
+            batch_sizes: Number of questions per search() call, one run each
+            repeats: Minimum number of passes over the evaluation set per run, more are made until
+                the timed searches add up to MIN_SEARCH_SECONDS
+            warmup_batches: Untimed batches searched before each run
+        """
+        self.logger = setup_logger()
+        self.k_values = sorted(set(k_values))
+        self.batch_sizes = batch_sizes
+        self.repeats = repeats
+        self.warmup_batches = warmup_batches
+        self.runs: List[Dict] = []
+
+    def run(self, variant: str, rag_model, eval_set: List[Dict], eval_set_name: str,
+            load_seconds: Optional[float] = None):
+        """Benchmark one loaded index at every configured batch size"""
+        questions = [item['question'] for item in eval_set]
+        ground_truths = [item['chunk_ids'] for item in eval_set]
+        depth = self.k_values[-1]
+
+        for batch_size in self.batch_sizes:
+            for start in range(0, min(self.warmup_batches * batch_size, len(questions)), batch_size):
+                search_batch(rag_model, questions[start:start + batch_size], depth)
+
+            # Every question in a batch waits for the whole batch, so it is charged the batch latency
+            latencies_ms = []
+            search_seconds = 0.0
+            passes = 0
+            while passes < self.repeats or (questions and search_seconds < MIN_SEARCH_SECONDS):
+                passes += 1
+                rankings = []
+                for start in range(0, len(questions), batch_size):
+                    batch = questions[start:start + batch_size]
+                    batch_start = time.perf_counter()
+                    results = search_batch(rag_model, batch, depth)
+                    elapsed = time.perf_counter() - batch_start
+                    search_seconds += elapsed
+                    latencies_ms.extend([elapsed * 1000] * len(batch))
+                    rankings.extend([result['document_id'] for result in question_results] for question_results in results)
+
+            run = {
+                "variant": variant,
+                "batch_size": batch_size,
+                "eval_set": eval_set_name,
+                "load_seconds": round(load_seconds, 2) if load_seconds is not None else None,
+                "metrics": quality_metrics(rankings, ground_truths, self.k_values),
+                "latency_ms": {
+                    "mean_ms": round(sum(latencies_ms) / len(latencies_ms), 1) if latencies_ms else None,
+                    **stage_percentiles(latencies_ms),
+                },
+                "qps": round(len(latencies_ms) / search_seconds, 1) if search_seconds else None,
+                "passes": passes,
+                "peak_rss_mb": peak_rss_mb(),
+            }
+            self.runs.append(run)
+            self.logger.info(
+                f"{variant} batch_size={batch_size}: "
+                + ', '.join(f"{name}={value}" for name, value in run['metrics'].items() if name != 'questions')
+                + f", p50={run['latency_ms'].get('p50_ms')}ms p95={run['latency_ms'].get('p95_ms')}ms"
+                + f", qps={run['qps']}, peak_rss={run['peak_rss_mb']}MB"
+            )
+
+    def run_isolated(self, mode: str, index_path: Path, eval_set: List[Dict], eval_set_name: str):
+        """
+        Benchmark one index variant in its own spawned process
+
+        ru_maxrss only ever grows, so variants loaded one after another in one
+        process would all report the largest index loaded so far. A fresh
+        process per variant makes peak_rss_mb cover just that variant's index
+        and searches.
+        """
+        settings = {
+            "k_values": self.k_values,
+            "batch_sizes": self.batch_sizes,
+            "repeats": self.repeats,
+            "warmup_batches": self.warmup_batches,
+        }
+        with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as executor:
+            self.runs.extend(executor.submit(
+                benchmark_variant, settings, mode, index_path, eval_set, eval_set_name
+            ).result())
+
+    def report(self) -> Dict:
+        """All runs so far, with the settings needed to compare them with another report"""
+        return {
+            "created_at": datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            "k_values": self.k_values,
+            "repeats": self.repeats,
+            "environment": {"python": platform.python_version(), "platform": platform.platform()},
+            "runs": self.runs,
+        }
+
+def compare_reports(current: Dict, baseline: Dict, quality_tolerance: float = QUALITY_TOLERANCE,
+                    performance_tolerance: float = PERFORMANCE_TOLERANCE) -> List[Dict]:
+    """
+    Find runs that got worse than the matching run (same variant and batch size) of a baseline report
+
+    Returns:
+        One entry per regressed metric with its baseline and current value
+    """
+    baseline_runs = {(run['variant'], run['batch_size']): run for run in baseline.get('runs', [])}
+    regressions = []
+
+    def flag(run, metric, baseline_value, current_value):
+        regressions.append({
+            "variant": run['variant'],
+            "batch_size": run['batch_size'],
+            "metric": metric,
+            "baseline": baseline_value,
+            "current": current_value,
+        })
+
+    for run in current['runs']:
+        base = baseline_runs.get((run['variant'], run['batch_size']))
+        if base is None:
+            continue
+
+        for metric, value in run['metrics'].items():
+            base_value = base['metrics'].get(metric)
+            if metric != 'questions' and base_value is not None and value < base_value - quality_tolerance:
+                flag(run, metric, base_value, value)
+
+        base_p95 = base['latency_ms'].get('p95_ms')
+        p95 = run['latency_ms'].get('p95_ms')
+        if (base_p95 and p95 is not None and p95 > base_p95 * (1 + performance_tolerance)
+                and p95 - base_p95 >= LATENCY_NOISE_MS):
+            flag(run, 'p95_ms', base_p95, p95)
+        if (base.get('qps') and run['qps'] and run['qps'] < base['qps'] * (1 - performance_tolerance)
+                and 1000 / run['qps'] - 1000 / base['qps'] >= LATENCY_NOISE_MS):
+            flag(run, 'qps', base['qps'], run['qps'])
+        if base.get('peak_rss_mb') and run['peak_rss_mb'] > base['peak_rss_mb'] * (1 + performance_tolerance):
+            flag(run, 'peak_rss_mb', base['peak_rss_mb'], run['peak_rss_mb'])
+
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark retrieval quality (recall@k, MRR, nDCG) and speed (latency, QPS, memory)')
+    parser.add_argument('index_paths', nargs='*', help='Index directories to benchmark, each one a set of variants')
+    parser.add_argument('--modes', nargs='+', choices=MODES, default=['hybrid'],
+                      help='Retrieval modes benchmarked per index (default: hybrid)')
+    parser.add_argument('--server', default=None,
+                      help='Also benchmark a running rag_server.py (its result cache is shared across runs)')
+    parser.add_argument('--synthetic', action='store_true',
+                      help='Benchmark BM25 over a generated corpus and evaluation set, no index or model needed')
+    parser.add_argument('--eval_set', default='Experiments/002/retriever_evaluation_set.json',
+                      help='Path to evaluation set JSON file')
+    parser.add_argument('--k_values', type=int, nargs='+', default=K_VALUES,
+                      help=f'Cutoffs for recall@k and nDCG@k (default: {" ".join(map(str, K_VALUES))})')
+    parser.add_argument('--batch_sizes', type=int, nargs='+', default=BATCH_SIZES,
+                      help=f'Questions per search call, one run each (default: {" ".join(map(str, BATCH_SIZES))})')
+    parser.add_argument('--repeats', type=int, default=1, help='Minimum passes over the evaluation set per run (default: 1)')
+    parser.add_argument('--limit', type=int, default=None, help='Only use the first N questions')
+    parser.add_argument('--output', default='Experiments/002/retriever_benchmark.json',
+                      help='Path to save the benchmark report')
+    parser.add_argument('--compare', default=None, help='Earlier benchmark report to check for regressions')
+    parser.add_argument('--quality_tolerance', type=float, default=QUALITY_TOLERANCE,
+                      help=f'Absolute quality drop counted as a regression (default: {QUALITY_TOLERANCE})')
+    parser.add_argument('--performance_tolerance', type=float, default=PERFORMANCE_TOLERANCE,
+                      help=f'Relative latency/QPS/memory change counted as a regression (default: {PERFORMANCE_TOLERANCE})')
+
+    args = parser.parse_args()
+    if not args.index_paths and not args.server and not args.synthetic:
+        parser.error('give at least one index path, --server or --synthetic')
+
+    benchmark = RetrieverBenchmark(args.k_values, args.batch_sizes, repeats=args.repeats)
+    logger = benchmark.logger
+
+    if args.synthetic:
+        bm25_index, eval_set = build_synthetic_benchmark()
+        benchmark.run('synthetic:bm25', BM25SearchModel(bm25_index), eval_set[:args.limit], 'synthetic')
+    if args.index_paths or args.server:
+        with open(args.eval_set, 'r') as f:
+            eval_set = json.load(f)[:args.limit]
+
+    for index_path in args.index_paths:
+        index_path = Path(index_path).resolve()
+        for mode in args.modes:
+            logger.info(f"Loading {mode} retriever from {index_path}")
+            benchmark.run_isolated(mode, index_path, eval_set, args.eval_set)
+
+    if args.server:
+        benchmark.run('server', RAGServiceClient(args.server), eval_set, args.eval_set)
+
+    report = benchmark.report()
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            baseline = json.load(f)
+        report['compared_with'] = args.compare
+        report['regressions'] = compare_reports(report, baseline, args.quality_tolerance, args.performance_tolerance)
+        for regression in report['regressions']:
+            logger.warning(
+                f"Regression in {regression['variant']} batch_size={regression['batch_size']}: "
+                f"{regression['metric']} {regression['baseline']} -> {regression['current']}"
+            )
+        if not report['regressions']:
+            logger.info(f"No regressions against {args.compare}")
+
+    Path(args.output).parent.mkdir(parents=True, exist_ok=True)
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    logger.info(f"Benchmark report saved to {args.output}")
+
+    if report.get('regressions'):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
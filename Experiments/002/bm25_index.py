@@ -0,0 +1,168 @@
+import json
+import math
+import re
+from collections import Counter
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple, Union
+import numpy as np
+
+BM25_INDEX_FILE = "bm25_index.json"  # Sparse index stored in the index directory next to the ColBERT index
+BM25_K1 = 1.5
+BM25_B = 0.75
+TOKEN_PATTERN = re.compile(r"\w+")
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase word tokens; numbers are kept so references like "Article 35" match exactly"""
+    return TOKEN_PATTERN.findall(text.lower())
+
+class BM25Index:
+    """
+    Okapi BM25 index over the indexed chunks
+
+    Stores each chunk's content and metadata so hits found only by BM25 can be
+    returned in the same shape as RAGatouille results. Per-term BM25 weights
+    are precomputed on load, so scoring a query is a handful of numpy
+    scatter-adds.
+    """
+
+    def __init__(self, k1: float = BM25_K1, b: float = BM25_B):
+        self.k1 = k1
+        self.b = b
+        self.chunk_ids: List[str] = []
+        self.contents: List[str] = []
+        self.metadata: List[Dict] = []
+        self.doc_lengths: List[int] = []
+        self.postings: Dict[str, List[List[int]]] = {}  # term -> [[row, term frequency], ...]
+        self.row_by_id: Dict[str, int] = {}
+        self._weights: Optional[Dict[str, Tuple[np.ndarray, np.ndarray]]] = None
+
+    def add(self, chunk_id: str, content: str, metadata: Dict):
+        """Add a chunk to the index"""
+        row = len(self.chunk_ids)
+        tokens = tokenize(content)
+        self.chunk_ids.append(chunk_id)
+        self.contents.append(content)
+        self.metadata.append(metadata)
+        self.doc_lengths.append(len(tokens))
+        self.row_by_id[chunk_id] = row
+        for term, frequency in Counter(tokens).items():
+            self.postings.setdefault(term, []).append([row, frequency])
+        self._weights = None
+
+    def _term_weights(self) -> Dict[str, Tuple[np.ndarray, np.ndarray]]:
+        """term -> (rows, BM25 weights), computed once per index state"""
+        term_weights = self._weights
+        if term_weights is None:
+            num_docs = len(self.chunk_ids)
+            doc_lengths = np.asarray(self.doc_lengths, dtype=np.float32)
+            avg_length = float(doc_lengths.mean()) if num_docs else 0.0
+            length_norm = self.k1 * (1 - self.b + self.b * doc_lengths / (avg_length or 1.0))
+
+            # Built aside and published whole, concurrent searches must never see a partial table
+            term_weights = {}
+            for term, postings in self.postings.items():
+                rows = np.fromiter((row for row, _ in postings), dtype=np.int64, count=len(postings))
+                frequencies = np.fromiter((tf for _, tf in postings), dtype=np.float32, count=len(postings))
+                idf = math.log(1 + (num_docs - len(postings) + 0.5) / (len(postings) + 0.5))
+                weights = idf * frequencies * (self.k1 + 1) / (frequencies + length_norm[rows])
+                term_weights[term] = (rows, weights.astype(np.float32))
+            self._weights = term_weights
+        return term_weights
+
+    def search(self, query: str, k: int = 10, candidate_ids: Optional[List[str]] = None) -> List[Tuple[str, float]]:
+        """
+        Score chunks against a query
+
+        Args:
+            query: Search query
+            k: Number of hits to return
+            candidate_ids: Restrict scoring to these chunk ids
+
+        Returns:
+            Up to k (chunk_id, score) pairs with a positive score, best first
+        """
+        if not self.chunk_ids or k <= 0:
+            return []
+
+        term_weights = self._term_weights()
+        scores = np.zeros(len(self.chunk_ids), dtype=np.float32)
+        for term in set(tokenize(query)):
+            if term in term_weights:
+                rows, weights = term_weights[term]
+                scores[rows] += weights
+
+        if candidate_ids is not None:
+            allowed = np.zeros(len(self.chunk_ids), dtype=bool)
+            allowed[[self.row_by_id[chunk_id] for chunk_id in candidate_ids if chunk_id in self.row_by_id]] = True
+            scores[~allowed] = 0.0
+
+        matching = np.flatnonzero(scores > 0)
+        if len(matching) > k:
+            matching = matching[np.argpartition(-scores[matching], k - 1)[:k]]
+        ranked = matching[np.lexsort((matching, -scores[matching]))]
+        return [(self.chunk_ids[row], float(scores[row])) for row in ranked]
+
+    def result(self, chunk_id: str, score: float, rank: int) -> Dict:
+        """Build a search result for a chunk in the RAGatouille result layout"""
+        row = self.row_by_id[chunk_id]
+        result = {
+            'content': self.contents[row],
+            'score': score,
+            'rank': rank,
+            'document_id': chunk_id,
+        }
+        if self.metadata[row]:
+            result['document_metadata'] = self.metadata[row]
+        return result
+
+    def __len__(self) -> int:
+        return len(self.chunk_ids)
+
+    def save(self, path: Path):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({
+                'k1': self.k1,
+                'b': self.b,
+                'chunk_ids': self.chunk_ids,
+                'contents': self.contents,
+                'metadata': self.metadata,
+                'doc_lengths': self.doc_lengths,
+                'postings': self.postings,
+            }, f, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, index_path: Path) -> Optional["BM25Index"]:
+        """Load the BM25 index stored in an index directory, if it has one"""
+        bm25_path = Path(index_path) / BM25_INDEX_FILE
+        if not bm25_path.exists():
+            return None
+        with open(bm25_path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+
+        index = cls(data['k1'], data['b'])
+        index.chunk_ids = data['chunk_ids']
+        index.contents = data['contents']
+        index.metadata = data['metadata']
+        index.doc_lengths = data['doc_lengths']
+        index.postings = data['postings']
+        index.row_by_id = {chunk_id: row for row, chunk_id in enumerate(index.chunk_ids)}
+        return index
+
+class BM25SearchModel:
+    """Exposes a BM25Index through the RAGatouille search() call, e.g. as a sparse-only baseline"""
+
+    def __init__(self, bm25_index: BM25Index):
+        self.bm25_index = bm25_index
+
+    def search(self, query: Union[str, List[str]], k: int = 10,
+               doc_ids: Optional[List[str]] = None) -> Union[List[Dict], List[List[Dict]]]:
+        queries = query if isinstance(query, list) else [query]
+        results = [
+            [
+                self.bm25_index.result(chunk_id, score, rank)
+                for rank, (chunk_id, score) in enumerate(self.bm25_index.search(q, k, doc_ids), 1)
+            ]
+            for q in queries
+        ]
+        # Mirror RAGatouille, which unwraps the result list when given a single query
+        return results if len(queries) > 1 else results[0]
@@ -0,0 +1,307 @@
+import bisect
+import json
+import logging
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+CHUNKS_FILE = "document_chunks.json"
+CHUNKS_JSONL_FILE = "document_chunks.jsonl"
+CHUNK_STORE_FILE = "document_chunks.parquet"  # Columnar copy of the chunks file, rebuilt when the JSON changes
+CONTENT_FIELDS = ['text', 'content', 'body', 'chunk_content']  # Same precedence as DocumentIndexer.validate_chunk
+JSON_READ_SIZE = 1 << 16  # Characters read per step when streaming a JSON array
+STORE_READ_BATCH_SIZE = 4096  # Rows decoded at a time when streaming the chunk store
+
+SCHEMA = pa.schema([
+    ('chunk_id', pa.string()),
+    ('document_name', pa.string()),
+    ('chunk_content', pa.string()),
+    ('chunk_metadata', pa.string()),  # JSON encoded, null when the chunk has none
+    ('extra_fields', pa.string()),  # JSON encoded remaining top-level fields
+])
+
+def iter_json_records(path: Path) -> Iterator[Dict]:
+    """
+    Yield records one at a time from a JSON array or JSONL file
+
+    The file is read in fixed-size pieces, so memory use depends on the size of
+    a single record rather than the size of the file.
+
+    Args:
+        path: Path to a file holding either a JSON array or one JSON value per line
+
+    Returns:
+        Iterator over the decoded records, in file order
+    """
+    decoder = json.JSONDecoder()
+
+    with open(path, 'r', encoding='utf-8') as f:
+        buffer = ''
+        while not buffer.lstrip():
+            piece = f.read(JSON_READ_SIZE)
+            if not piece:
+                return
+            buffer += piece
+        buffer = buffer.lstrip()
+
+        # Anything that is not a JSON array is treated as JSONL
+        if not buffer.startswith('['):
+            # The buffer holds many lines; the last one may continue past the read boundary
+            *lines, partial = buffer.split('\n')
+            for line in [*lines, partial + f.readline(), *f]:
+                if line.strip():
+                    yield json.loads(line)
+            return
+
+        pos = 1
+        eof = False
+        while True:
+            # Skip separators between records
+            while pos < len(buffer) and buffer[pos] in ' \t\r\n,':
+                pos += 1
+
+            if pos < len(buffer) and buffer[pos] == ']':
+                return
+
+            end = None
+            if pos < len(buffer):
+                try:
+                    record, end = decoder.raw_decode(buffer, pos)
+                except json.JSONDecodeError:
+                    if eof:
+                        raise
+
+            # The record straddles the read boundary, pull in more text
+            if end is None or (end == len(buffer) and not eof):
+                if eof:
+                    raise json.JSONDecodeError("Unterminated JSON array", buffer, pos)
+                piece = f.read(JSON_READ_SIZE)
+                buffer = buffer[pos:] + piece
+                pos = 0
+                eof = not piece
+                continue
+
+            yield record
+            pos = end
+
+            # Drop consumed text so the buffer stays bounded
+            if pos > JSON_READ_SIZE:
+                buffer = buffer[pos:]
+                pos = 0
+
+def resolve_chunks_path(experiment_dir: Path) -> Path:
+    """Pick document_chunks.json, falling back to document_chunks.jsonl if only that exists"""
+    json_path = Path(experiment_dir) / CHUNKS_FILE
+    jsonl_path = Path(experiment_dir) / CHUNKS_JSONL_FILE
+    if not json_path.exists() and jsonl_path.exists():
+        return jsonl_path
+    return json_path
+
+def document_name(chunk_id: str) -> str:
+    """Extract the document name from a chunk id of the form DOC_NAME_chunk_N"""
+    return "_".join(chunk_id.split("_")[:-2])
+
+def store_is_fresh(store_path: Path, chunks_path: Path) -> bool:
+    """Whether the chunk store exists and is at least as new as the chunks file it was built from"""
+    if not store_path.exists():
+        return False
+    return not chunks_path.exists() or store_path.stat().st_mtime_ns >= chunks_path.stat().st_mtime_ns
+
+def _record_from_row(chunk_id: str, content: str, metadata_json: Optional[str], extra_json: Optional[str]) -> Dict:
+    """Rebuild a chunk record in the document_chunks.json layout"""
+    record = json.loads(extra_json) if extra_json else {}
+    record['chunk_id'] = chunk_id
+    record['chunk_content'] = content
+    if metadata_json is not None:
+        record['chunk_metadata'] = json.loads(metadata_json)
+    return record
+
+def iter_chunk_records(chunks_path: Path) -> Iterator[Dict]:
+    """
+    Stream chunk records, from the chunk store when it is up to date and from the JSON file otherwise
+
+    Args:
+        chunks_path: Path to document_chunks.json or document_chunks.jsonl
+
+    Returns:
+        Iterator over chunk records in the document_chunks.json layout
+    """
+    chunks_path = Path(chunks_path)
+    store_path = chunks_path.with_name(CHUNK_STORE_FILE)
+    if not store_is_fresh(store_path, chunks_path):
+        yield from iter_json_records(chunks_path)
+        return
+
+    for batch in pq.ParquetFile(store_path).iter_batches(batch_size=STORE_READ_BATCH_SIZE):
+        columns = [
+            batch.column(name).to_pylist()
+            for name in ('chunk_id', 'chunk_content', 'chunk_metadata', 'extra_fields')
+        ]
+        for row in zip(*columns):
+            yield _record_from_row(*row)
+
+class ChunkStore:
+    """
+    Columnar, in-memory view of the document chunks
+
+    Chunks are grouped by document; rows doc_offsets[i]:doc_offsets[i + 1]
+    hold the chunks of documents[i] in file order. Lookups by chunk id and by
+    document are dictionary hits. Metadata is kept JSON encoded and decoded
+    on access.
+    """
+
+    def __init__(self, chunk_ids: List[str], documents: List[str], doc_offsets: List[int],
+                 contents: List[str], metadata: List[Optional[str]], extra_fields: List[Optional[str]]):
+        self.chunk_ids = chunk_ids
+        self.documents = documents
+        self.doc_offsets = doc_offsets
+        self.contents = contents
+        self.metadata = metadata
+        self.extra_fields = extra_fields
+        self.row_by_id = {chunk_id: row for row, chunk_id in enumerate(chunk_ids)}
+        self.slot_by_document = {doc_name: slot for slot, doc_name in enumerate(documents)}
+
+    @classmethod
+    def from_records(cls, records: Iterator[Dict]) -> "ChunkStore":
+        """Build a store from chunk records, keeping documents in order of first appearance"""
+        grouped: Dict[str, List[Tuple[str, str, Optional[str], Optional[str]]]] = {}
+        for idx, chunk in enumerate(records):
+            chunk_id = str(chunk.get('chunk_id', f'chunk_{idx}'))
+            content_field = next((field for field in CONTENT_FIELDS if field in chunk), None)
+            if content_field is None:
+                raise ValueError(f"Chunk {idx} is missing text content (tried fields: {', '.join(CONTENT_FIELDS)})")
+
+            doc_name = chunk.get('document_name') or document_name(chunk_id)
+            metadata = chunk.get('chunk_metadata')
+            extra = {
+                key: value for key, value in chunk.items()
+                if key not in ('chunk_id', 'chunk_metadata', content_field)
+            }
+            grouped.setdefault(doc_name, []).append((
+                chunk_id,
+                chunk[content_field],
+                json.dumps(metadata, ensure_ascii=False) if metadata is not None else None,
+                json.dumps(extra, ensure_ascii=False) if extra else None
+            ))
+
+        chunk_ids, contents, metadata, extra_fields, doc_offsets = [], [], [], [], [0]
+        for rows in grouped.values():
+            for chunk_id, content, metadata_json, extra_json in rows:
+                chunk_ids.append(chunk_id)
+                contents.append(content)
+                metadata.append(metadata_json)
+                extra_fields.append(extra_json)
+            doc_offsets.append(len(chunk_ids))
+
+        return cls(chunk_ids, list(grouped), doc_offsets, contents, metadata, extra_fields)
+
+    @classmethod
+    def load(cls, store_path: Path) -> "ChunkStore":
+        """Read a store written by save()"""
+        table = pq.read_table(store_path)
+        schema_metadata = table.schema.metadata or {}
+        documents = json.loads(schema_metadata[b'documents'])
+        doc_offsets = json.loads(schema_metadata[b'doc_offsets'])
+        return cls(
+            table.column('chunk_id').to_pylist(),
+            documents,
+            doc_offsets,
+            table.column('chunk_content').to_pylist(),
+            table.column('chunk_metadata').to_pylist(),
+            table.column('extra_fields').to_pylist()
+        )
+
+    def save(self, store_path: Path):
+        """Write the store as a Parquet file, with the document offsets in the schema metadata"""
+        document_names = [
+            doc_name
+            for slot, doc_name in enumerate(self.documents)
+            for _ in range(self.doc_offsets[slot + 1] - self.doc_offsets[slot])
+        ]
+        table = pa.table(
+            [self.chunk_ids, document_names, self.contents, self.metadata, self.extra_fields],
+            schema=SCHEMA.with_metadata({
+                'documents': json.dumps(self.documents, ensure_ascii=False),
+                'doc_offsets': json.dumps(self.doc_offsets),
+            })
+        )
+        # Write beside the target first so readers never see a half-written store
+        tmp_path = Path(store_path).with_suffix('.parquet.tmp')
+        pq.write_table(table, tmp_path)
+        tmp_path.replace(store_path)
+
+    @classmethod
+    def open(cls, experiment_dir: Path, logger: Optional[logging.Logger] = None) -> "ChunkStore":
+        """
+        Load an experiment's chunk store, (re)building it from the chunks file when missing or stale
+
+        Args:
+            experiment_dir: Directory holding document_chunks.json (or .jsonl)
+            logger: Logger for build messages
+
+        Returns:
+            ChunkStore for the experiment
+        """
+        logger = logger or logging.getLogger(__name__)
+        chunks_path = resolve_chunks_path(experiment_dir)
+        store_path = Path(experiment_dir) / CHUNK_STORE_FILE
+
+        if store_is_fresh(store_path, chunks_path):
+            return cls.load(store_path)
+
+        if not chunks_path.exists():
+            raise FileNotFoundError(f"Document chunks file not found at {chunks_path}")
+
+        logger.info(f"Building chunk store from {chunks_path}")
+        store = cls.from_records(iter_json_records(chunks_path))
+        store.save(store_path)
+        logger.info(f"Saved {len(store)} chunks from {len(store.documents)} documents to {store_path}")
+        return store
+
+    def __len__(self) -> int:
+        return len(self.chunk_ids)
+
+    def __contains__(self, chunk_id: str) -> bool:
+        return chunk_id in self.row_by_id
+
+    def __getitem__(self, chunk_id: str) -> Dict:
+        """Return the chunk record for chunk_id, in the document_chunks.json layout"""
+        return self.record(self.row_by_id[chunk_id])
+
+    def get(self, chunk_id: str, default: Optional[Dict] = None) -> Optional[Dict]:
+        row = self.row_by_id.get(chunk_id)
+        return default if row is None else self.record(row)
+
+    def record(self, row: int) -> Dict:
+        return _record_from_row(
+            self.chunk_ids[row],
+            self.contents[row],
+            self.metadata[row],
+            self.extra_fields[row]
+        )
+
+    def document_slot(self, row: int) -> int:
+        """Index into self.documents of the document holding a row"""
+        return bisect.bisect_right(self.doc_offsets, row) - 1
+
+    def document_of(self, chunk_id: str) -> str:
+        """Name of the document a chunk belongs to"""
+        return self.documents[self.document_slot(self.row_by_id[chunk_id])]
+
+    def document_rows(self, doc_name: str) -> range:
+        """Rows holding the chunks of a document"""
+        slot = self.slot_by_document[doc_name]
+        return range(self.doc_offsets[slot], self.doc_offsets[slot + 1])
+
+    def chunk_metadata(self, chunk_id: str) -> Dict:
+        """Metadata of a chunk, empty if it has none"""
+        metadata_json = self.metadata[self.row_by_id[chunk_id]]
+        return json.loads(metadata_json) if metadata_json else {}
+
+    def content(self, chunk_id: str) -> str:
+        return self.contents[self.row_by_id[chunk_id]]
+
+    def __iter__(self) -> Iterator[Dict]:
+        for row in range(len(self)):
+            yield self.record(row)
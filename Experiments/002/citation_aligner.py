@@ -0,0 +1,137 @@
+import re
+import functools
+from collections import Counter
+from difflib import SequenceMatcher
+from typing import Dict, List, Tuple
+
+MIN_CONFIDENCE = 0.6  # Fuzzy matches scoring below this keep the LLM's citation text without a span
+CANDIDATE_ALIGNMENTS = 3  # Best word-offset candidates scored in full per citation
+ALIGNMENT_SLACK = 8  # Extra chunk words considered on each side of a candidate alignment
+NORMALIZED_CACHE_SIZE = 4096  # Normalized chunks kept across queries, keyed by chunk text
+WORD_PATTERN = re.compile(r"\w+")
+CHARACTER_MAP = str.maketrans({
+    '‘': "'", '’': "'", '“': '"', '”': '"',
+    '–': '-', '—': '-', ' ': ' ',
+})
+
+class NormalizedText:
+    """
+    Lowercased, whitespace-collapsed view of a chunk with offsets back into the original
+
+    text[i] came from original[offsets[i]]. Words are indexed with their
+    original character spans so fuzzy matches map straight back to the chunk.
+    """
+
+    def __init__(self, original: str):
+        self.original = original
+        characters: List[str] = []
+        offsets: List[int] = []
+        for position, char in enumerate(original.translate(CHARACTER_MAP)):
+            if char.isspace():
+                if characters and characters[-1] != ' ':
+                    characters.append(' ')
+                    offsets.append(position)
+                continue
+            # Some characters lowercase to more than one, they all map to the same position
+            for lowered in char.lower():
+                characters.append(lowered)
+                offsets.append(position)
+        self.text = ''.join(characters)
+        self.offsets = offsets
+
+        self.words: List[str] = []
+        self.word_spans: List[Tuple[int, int]] = []
+        self.word_positions: Dict[str, List[int]] = {}
+        for match in WORD_PATTERN.finditer(original):
+            word = match.group().lower()
+            self.word_positions.setdefault(word, []).append(len(self.words))
+            self.words.append(word)
+            self.word_spans.append(match.span())
+
+    def original_span(self, start: int, end: int) -> Tuple[int, int]:
+        """Character span in the original text of text[start:end]"""
+        return self.offsets[start], self.offsets[end - 1] + 1
+
+@functools.lru_cache(maxsize=NORMALIZED_CACHE_SIZE)
+def normalize_text(text: str) -> NormalizedText:
+    return NormalizedText(text)
+
+def normalize_citation(citation: str) -> str:
+    """Apply the chunk normalization to a citation, dropping quotes and ellipses around it"""
+    citation = ' '.join(citation.translate(CHARACTER_MAP).lower().split())
+    return citation.strip(' "\'.…')
+
+def align_citation(chunk: str, citation: str, min_confidence: float = MIN_CONFIDENCE) -> Dict:
+    """
+    Locate a citation in its chunk
+
+    An exact match after normalizing case, quotes and whitespace is tried
+    first. Otherwise the citation's words vote for the chunk word offset
+    they would line up at, and the best few offsets are aligned word by
+    word, which tolerates paraphrased words, skipped text and ellipses.
+
+    Args:
+        chunk: Full chunk content
+        citation: Text the LLM cited from the chunk
+        min_confidence: Lowest fuzzy match score accepted as a span
+
+    Returns:
+        Dict with the matched chunk text (the citation itself when unmatched),
+        its start/end character offsets in the chunk (None when unmatched),
+        a confidence between 0 and 1 and the match type
+    """
+    normalized = normalize_text(chunk)
+    needle = normalize_citation(citation)
+    unmatched = {"text": citation.strip(), "start": None, "end": None, "confidence": 0.0, "match": "none"}
+    if not needle:
+        return unmatched
+
+    position = normalized.text.find(needle)
+    if position != -1:
+        start, end = normalized.original_span(position, position + len(needle))
+        return {"text": chunk[start:end], "start": start, "end": end, "confidence": 1.0, "match": "exact"}
+
+    citation_words = WORD_PATTERN.findall(needle)
+    if not citation_words:
+        return unmatched
+
+    votes = Counter()
+    for i, word in enumerate(citation_words):
+        for position in normalized.word_positions.get(word, ()):
+            votes[position - i] += 1
+
+    best = None
+    for offset, _ in votes.most_common(CANDIDATE_ALIGNMENTS):
+        window_start = max(offset - ALIGNMENT_SLACK, 0)
+        window_end = min(offset + len(citation_words) + ALIGNMENT_SLACK, len(normalized.words))
+        matcher = SequenceMatcher(None, normalized.words[window_start:window_end], citation_words, autojunk=False)
+        blocks = [block for block in matcher.get_matching_blocks() if block.size]
+        if not blocks:
+            continue
+        first_word = window_start + blocks[0].a
+        last_word = window_start + blocks[-1].a + blocks[-1].size - 1
+        matched = sum(block.size for block in blocks)
+        confidence = 2 * matched / (len(citation_words) + last_word - first_word + 1)
+        if best is None or confidence > best[0]:
+            best = (confidence, first_word, last_word)
+
+    if best is None or best[0] < min_confidence:
+        if best is not None:
+            unmatched["confidence"] = round(best[0], 3)
+        return unmatched
+
+    confidence, first_word, last_word = best
+    start = normalized.word_spans[first_word][0]
+    end = normalized.word_spans[last_word][1]
+    return {"text": chunk[start:end], "start": start, "end": end, "confidence": round(confidence, 3), "match": "fuzzy"}
+
+def align_citations(citations: Dict[str, str], chunks: Dict[str, str],
+                    min_confidence: float = MIN_CONFIDENCE) -> Dict[str, Dict]:
+    """Align every citation against its chunk; citations of unknown chunks are returned unmatched"""
+    aligned = {}
+    for chunk_id, citation in citations.items():
+        if chunk_id in chunks:
+            aligned[chunk_id] = align_citation(chunks[chunk_id], citation, min_confidence)
+        else:
+            aligned[chunk_id] = {"text": citation.strip(), "start": None, "end": None, "confidence": 0.0, "match": "none"}
+    return aligned
@@ -0,0 +1,135 @@
+from typing import Dict, List, Set, Tuple
+import tiktoken
+
+LLM_MODEL = "gpt-4o"  # Model the context is packed for; picks the tokenizer
+CONTEXT_TOKEN_BUDGET = 6000  # Tokens of retrieved context sent to the LLM per query
+MIN_TRUNCATED_TOKENS = 64  # Chunks that would be cut to fewer content tokens than this are dropped instead
+DUPLICATE_CONTAINMENT = 0.8  # Drop a chunk when this share of its shingles already appears in the packed context
+SHINGLE_SIZE = 8  # Tokens per shingle when comparing chunks for overlap
+TRUNCATION_MARKER = " [...]"
+
+def format_chunk(chunk_id: str, content: str) -> str:
+    """Context entry for one retrieved chunk"""
+    return (
+        f"Source: {chunk_id}\n"
+        f"Content: {content}\n"
+    )
+
+def shingles(tokens: List[int], size: int = SHINGLE_SIZE) -> Set[Tuple[int, ...]]:
+    """Overlapping token n-grams of a chunk; short chunks count as a single shingle"""
+    if len(tokens) <= size:
+        return {tuple(tokens)}
+    return {tuple(tokens[i:i + size]) for i in range(len(tokens) - size + 1)}
+
+def result_score(result: Dict) -> Tuple[bool, float]:
+    """Sort key putting cross-encoder scored results first, then the highest score"""
+    if 'rerank_score' in result:
+        return (False, -result['rerank_score'])
+    return (True, -result.get('score', 0.0))
+
+class ContextPacker:
+    """
+    Fits retrieved chunks into a token budget for the LLM prompt
+
+    Chunks are taken best score first. A chunk whose text mostly repeats
+    chunks already packed (overlapping windows, the same passage retrieved
+    twice) is skipped. The first chunk that does not fit is cut to the
+    remaining budget if enough of it survives, otherwise it is dropped and
+    smaller lower-ranked chunks may still fill the gap. The top chunk is never
+    dropped for being too long, it is cut to whatever the budget leaves so
+    there is always something to cite. Truncated chunks keep
+    a prefix of their content, so citations of the packed text remain
+    substrings of the original chunk.
+    """
+
+    def __init__(self, token_budget: int = CONTEXT_TOKEN_BUDGET, model: str = LLM_MODEL,
+                 min_truncated_tokens: int = MIN_TRUNCATED_TOKENS,
+                 duplicate_containment: float = DUPLICATE_CONTAINMENT, encoding=None):
+        """
+        Args:
+            token_budget: Maximum number of context tokens
+            model: LLM whose tokenizer measures the chunks
+            min_truncated_tokens: Smallest content length worth keeping from a truncated chunk,
+                except for the first chunk packed
+            duplicate_containment: Overlap share at which a chunk counts as a duplicate
+            encoding: Tokenizer with encode()/decode(), defaults to the tiktoken encoding of the model
+        """
+        self.token_budget = token_budget
+        self.min_truncated_tokens = min_truncated_tokens
+        self.duplicate_containment = duplicate_containment
+        self.encoding = encoding or tiktoken.encoding_for_model(model)
+
+    def count_tokens(self, text: str) -> int:
+        return len(self.encoding.encode(text))
+
+    def pack(self, results: List[Dict]) -> Tuple[str, Dict]:
+        """
+        Build the context string for a query's retrieved results
+
+        Args:
+            results: Search results with document_id, content and score (or rerank_score)
+
+        Returns:
+            (context, stats): the packed context and a dict with the packed chunk ids,
+            token counts before and after packing, and how many chunks were
+            truncated, dropped or skipped as duplicates
+        """
+        separator_tokens = self.count_tokens("\n")
+        remaining = self.token_budget
+        packed: List[str] = []
+        packed_ids: List[str] = []
+        seen_shingles: Set[Tuple[int, ...]] = set()
+        duplicates = dropped = truncated = 0
+        budget_spent = False
+
+        for result in sorted(results, key=result_score):
+            chunk_id = result['document_id']
+            content_tokens = self.encoding.encode(result['content'])
+            header_tokens = self.count_tokens(format_chunk(chunk_id, ''))
+            entry_tokens = header_tokens + len(content_tokens) + (separator_tokens if packed else 0)
+
+            chunk_shingles = shingles(content_tokens)
+            if chunk_id in packed_ids or (
+                seen_shingles
+                and len(chunk_shingles & seen_shingles) >= self.duplicate_containment * len(chunk_shingles)
+            ):
+                duplicates += 1
+                continue
+
+            if budget_spent:
+                dropped += 1
+                continue
+
+            if entry_tokens <= remaining:
+                packed.append(format_chunk(chunk_id, result['content']))
+                remaining -= entry_tokens
+            else:
+                available = remaining - (entry_tokens - len(content_tokens)) - self.count_tokens(TRUNCATION_MARKER)
+                if available <= 0 or (packed and available < self.min_truncated_tokens):
+                    dropped += 1
+                    continue
+                content = self.encoding.decode(content_tokens[:available]).rstrip() + TRUNCATION_MARKER
+                packed.append(format_chunk(chunk_id, content))
+                truncated += 1
+                budget_spent = True
+
+            packed_ids.append(chunk_id)
+            seen_shingles |= chunk_shingles
+
+        context = "\n".join(packed)
+        context_tokens = self.count_tokens(context)
+        original_tokens = self.count_tokens(
+            "\n".join(format_chunk(result['document_id'], result['content']) for result in results)
+        )
+        stats = {
+            "chunk_ids": packed_ids,
+            "chunks": len(results),
+            "packed": len(packed_ids),
+            "truncated": truncated,
+            "dropped": dropped,
+            "duplicates": duplicates,
+            "original_tokens": original_tokens,
+            "context_tokens": context_tokens,
+            "tokens_saved": max(original_tokens - context_tokens, 0),
+        }
+        return context, stats
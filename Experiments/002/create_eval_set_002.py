@@ -4,7 +4,8 @@ from dotenv import load_dotenv
 import json
 from pathlib import Path
 import logging
-from typing import Dict, List
+from typing import Dict, List, Tuple
+import numpy as np
 import vertexai
 from vertexai.preview.generative_models import (
     GenerativeModel,
@@ -12,9 +13,15 @@ from vertexai.preview.generative_models import (
 )
 from sentence_transformers.cross_encoder import CrossEncoder
 from prompts import system_prompt_QA_eval_bot
+from llm_cache import LLMResponseCache, DEFAULT_CACHE_PATH
+from chunk_store import ChunkStore
+
+QUESTION_MODEL = "gemini-1.5-pro-002"
+CROSS_ENCODER_BATCH_SIZE = 64  # (question, chunk) pairs scored per cross-encoder forward pass
 
 class EvalSetGenerator:
-    def __init__(self, experiment_dir: str, project_id: str = None, location: str = "australia-southeast1"):
+    def __init__(self, experiment_dir: str, project_id: str = None, location: str = "australia-southeast1",
+                 cache_path: str = DEFAULT_CACHE_PATH, cross_encoder_batch_size: int = CROSS_ENCODER_BATCH_SIZE):
         """
         Initialize the evaluation set generator.
         
@@ -22,11 +29,16 @@ class EvalSetGenerator:
             experiment_dir: Directory for experiment files
             project_id: Google Cloud project ID
             location: Google Cloud location
+            cache_path: SQLite file caching generated questions across runs (None disables caching)
+            cross_encoder_batch_size: Number of (question, chunk) pairs scored per cross-encoder batch
         """
         self.experiment_dir = Path(experiment_dir)
         self.logger = self._setup_logger()
+        self.cache = LLMResponseCache(cache_path) if cache_path else None
         self._init_vertex_ai(project_id, location)
         self.cross_encoder = CrossEncoder("cross-encoder/stsb-distilroberta-base")
+        self.cross_encoder_batch_size = cross_encoder_batch_size
+        self.chunk_store = None
         
         # Response schema for question generation
         self.response_schema = {
@@ -68,45 +80,42 @@ class EvalSetGenerator:
         if project_id:
             vertexai.init(project=project_id, location=location)
 
+    def load_chunk_store(self) -> ChunkStore:
+        """Load the experiment's chunk store, building it from document_chunks.json if needed"""
+        if self.chunk_store is None:
+            try:
+                self.chunk_store = ChunkStore.open(self.experiment_dir, self.logger)
+            except Exception as e:
+                self.logger.error(f"Error reading chunks file: {str(e)}")
+                raise
+        return self.chunk_store
+
     def format_document_chunks(self) -> Dict[str, str]:
         """
-        Read and format document chunks from JSON file.
+        Format the document chunks into one prompt context per document.
         
         Returns:
             Dictionary mapping document names to their formatted content
         """
-        chunks_path = self.experiment_dir / "document_chunks.json"
-        self.logger.info(f"Reading chunks from {chunks_path}")
-        
-        try:
-            with open(chunks_path, 'r', encoding='utf-8') as f:
-                chunks_data = json.load(f)
-        except Exception as e:
-            self.logger.error(f"Error reading chunks file: {str(e)}")
-            raise
-
+        store = self.load_chunk_store()
         formatted_docs = {}
         
-        # Group chunks by document name (extracted from chunk_id)
-        for chunk in chunks_data:
-            # Extract document name from chunk_id (assuming format: DOC_NAME_chunk_N)
-            doc_name = "_".join(chunk['chunk_id'].split("_")[:-2])
-            
-            if doc_name not in formatted_docs:
-                formatted_docs[doc_name] = f"{doc_name}:\n\n"
-            
-            # Format chunk with content and metadata
-            formatted_docs[doc_name] += "----x----\n"
-            formatted_docs[doc_name] += f"chunk_id: {chunk['chunk_id']}\n"
-            formatted_docs[doc_name] += f"chunk_content: {chunk['chunk_content']}\n"
-            
-            # Add metadata if present
-            if 'chunk_metadata' in chunk:
-                formatted_docs[doc_name] += "metadata:\n"
-                for header, value in chunk['chunk_metadata'].items():
-                    formatted_docs[doc_name] += f"  {header}: {value}\n"
-            
-            formatted_docs[doc_name] += "\n"
+        for doc_name in store.documents:
+            parts = [f"{doc_name}:\n\n"]
+            for row in store.document_rows(doc_name):
+                # Format chunk with content and metadata
+                parts.append("----x----\n")
+                parts.append(f"chunk_id: {store.chunk_ids[row]}\n")
+                parts.append(f"chunk_content: {store.contents[row]}\n")
+                
+                # Add metadata if present
+                if store.metadata[row] is not None:
+                    parts.append("metadata:\n")
+                    for header, value in json.loads(store.metadata[row]).items():
+                        parts.append(f"  {header}: {value}\n")
+                
+                parts.append("\n")
+            formatted_docs[doc_name] = "".join(parts)
 
         return formatted_docs
 
@@ -121,24 +130,74 @@ class EvalSetGenerator:
         Returns:
             JSON string containing generated questions
         """
-        model = GenerativeModel("gemini-1.5-pro-002")
-        
         # System prompt template
         system_prompt = system_prompt_QA_eval_bot
+        prompt = system_prompt.format(chunk_set=context, num_questions=num_questions)
+        
+        # Reuse questions generated for the same prompt by an earlier run
+        cache_key = None
+        if self.cache:
+            cache_key = self.cache.make_key(
+                QUESTION_MODEL, [{"role": "user", "content": prompt}], self.response_schema
+            )
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                self.logger.info("Using cached questions")
+                return cached
+        
+        model = GenerativeModel(QUESTION_MODEL)
         
         try:
             response = model.generate_content(
-                system_prompt.format(chunk_set=context, num_questions=num_questions),
+                prompt,
                 generation_config=GenerationConfig(
                     response_mime_type="application/json",
                     response_schema=self.response_schema
                 ),
             )
+            if cache_key:
+                self.cache.set(cache_key, response.text)
             return response.text
         except Exception as e:
             self.logger.error(f"Error generating questions: {str(e)}")
             raise
 
+    def rank_chunks(self, questions: List[str], chunks: List[Tuple[str, str]], top_k: int) -> List[List[str]]:
+        """
+        Score every question against every chunk of a document in one batched cross-encoder call.
+        
+        Args:
+            questions: Questions about the document
+            chunks: (chunk_id, chunk_content) pairs of the document
+            top_k: Number of chunk ids to return per question
+            
+        Returns:
+            For each question, the ids of its top_k highest scoring chunks, best first
+        """
+        if not questions or not chunks:
+            return [[] for _ in questions]
+        
+        pairs = [(question, chunk_content) for question in questions for _, chunk_content in chunks]
+        scores = np.asarray(
+            self.cross_encoder.predict(pairs, batch_size=self.cross_encoder_batch_size),
+            dtype=np.float32
+        ).reshape(len(questions), len(chunks))
+        
+        # Find each question's top_k-th best score without sorting every chunk
+        top_k = min(top_k, len(chunks))
+        kth = np.argpartition(-scores, top_k - 1, axis=1)[:, top_k - 1]
+        thresholds = scores[np.arange(len(questions)), kth]
+        
+        ranked = []
+        for row, threshold in zip(scores, thresholds):
+            # Ties keep document order, as the previous stable sort did
+            above = np.flatnonzero(row > threshold)
+            tied = np.flatnonzero(row == threshold)[:top_k - len(above)]
+            selected = np.concatenate([above, tied])
+            order = np.lexsort((selected, -row[selected]))
+            ranked.append([chunks[i][0] for i in selected[order]])
+        return ranked
+
     def create_final_eval_set(self, num_questions_per_doc: int = 10, max_chunks: int = 20):
         """
         Create and save the final evaluation set using both LLM and cross-encoder.
@@ -162,22 +221,23 @@ class EvalSetGenerator:
                     q['document'] = doc_name
                 all_questions.extend(questions)
 
-            # Process with cross-encoder and create final ground truth
-            final_eval_set = []
-            for question in all_questions:
-                # Get cross-encoder scores for all chunks
-                scores = []
-                for chunk in formatted_docs[question['document']].split('----x----'):
-                    if 'chunk_id:' in chunk:
-                        chunk_id = chunk.split('chunk_id:')[1].split('\n')[0].strip()
-                        chunk_content = chunk.split('chunk_content:')[1].split('\n')[0].strip()
-                        score = self.cross_encoder.predict([(question['question'], chunk_content)])
-                        scores.append((chunk_id, float(score)))
-
-                # Sort by score
-                scores.sort(key=lambda x: x[1], reverse=True)
-                top_chunks = [s[0] for s in scores[:max_chunks]]
+            # Score all questions of a document against its chunks in one batched pass
+            top_chunks_by_question = [None] * len(all_questions)
+            store = self.load_chunk_store()
+            for doc_name in formatted_docs:
+                question_indices = [i for i, q in enumerate(all_questions) if q['document'] == doc_name]
+                rows = store.document_rows(doc_name)
+                ranked = self.rank_chunks(
+                    [all_questions[i]['question'] for i in question_indices],
+                    list(zip(store.chunk_ids[rows.start:rows.stop], store.contents[rows.start:rows.stop])),
+                    max_chunks
+                )
+                for i, top_chunks in zip(question_indices, ranked):
+                    top_chunks_by_question[i] = top_chunks
 
+            # Create final ground truth
+            final_eval_set = []
+            for question, top_chunks in zip(all_questions, top_chunks_by_question):
                 # Find overlapping chunks
                 llm_chunks = set(question['chunk_ids'])
                 cross_encoder_chunks = set(top_chunks[:10])
@@ -1,4 +1,5 @@
 # Run using: python evaluate_rag_responses_002.py Experiments/002
+# Interrupted runs resume from rag_evaluation_checkpoint.jsonl; pass --restart to regrade everything
 
 from pydantic import BaseModel, Field, field_validator
 from typing import Dict, List, Optional, Any
@@ -9,11 +10,16 @@ from openai import OpenAI
 from pathlib import Path
 import argparse
 import sys
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from dotenv import load_dotenv
+from llm_utils import call_with_retry, reask_retrying
+from llm_cache import LLMResponseCache, CachedInstructorClient, DEFAULT_CACHE_PATH
+from chunk_store import ChunkStore
 
 # Load environment variables
 load_dotenv()
 OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
+CHECKPOINT_FILE = "rag_evaluation_checkpoint.jsonl"
 
 class EvaluationMetrics(BaseModel):
     """Validates and structures the evaluation metrics."""
@@ -53,20 +59,27 @@ class RAGEvaluator:
         self,
         openai_api_key: str,
         model: str = "gpt-4o",
-        max_retries: int = 3
+        max_retries: int = 3,
+        max_workers: int = 4,
+        request_timeout: float = 120.0,
+        base_url: Optional[str] = None,
+        cache_path: Optional[str] = DEFAULT_CACHE_PATH
     ):
-        self.client = instructor.patch(OpenAI(api_key=openai_api_key))
+        # The SDK's own retries are off, call_with_retry backs off on transient errors
+        self.client = instructor.patch(OpenAI(api_key=openai_api_key, base_url=base_url, max_retries=0))
+        self.cache = LLMResponseCache(cache_path) if cache_path else None
+        if self.cache:
+            self.client = CachedInstructorClient(self.client, self.cache)
         self.model = model
         self.max_retries = max_retries
+        self.max_workers = max_workers
+        self.request_timeout = request_timeout
 
-    def load_document_chunks(self, experiment_dir: str) -> Dict[str, Dict]:
-        """Load document chunks from JSON file"""
-        chunks_file = os.path.join(experiment_dir, "document_chunks.json")
-        with open(chunks_file, 'r') as f:
-            chunks_data = json.load(f)
-        return {chunk["chunk_id"]: chunk for chunk in chunks_data}
+    def load_document_chunks(self, experiment_dir: str) -> ChunkStore:
+        """Load document chunks from the experiment's chunk store, keyed by chunk id"""
+        return ChunkStore.open(Path(experiment_dir))
 
-    def format_retrieved_chunks(self, chunk_ids: List[str], chunks_lookup: Dict[str, Dict]) -> str:
+    def format_retrieved_chunks(self, chunk_ids: List[str], chunks_lookup: ChunkStore) -> str:
         """Format retrieved chunks into a single string"""
         formatted_chunks = []
         for chunk_id in chunk_ids:
@@ -105,7 +118,7 @@ class RAGEvaluator:
             formatted_citations.append(formatted_citation)
         return "\n".join(formatted_citations)
 
-    def evaluate_response(self, record: Dict[str, Any], chunks_lookup: Dict[str, Dict]) -> EvaluationMetrics:
+    def evaluate_response(self, record: Dict[str, Any], chunks_lookup: ChunkStore) -> EvaluationMetrics:
         """Evaluate a single response record"""
         
         # Format retrieved chunks
@@ -151,21 +164,44 @@ class RAGEvaluator:
         """
 
         try:
-            evaluation = self.client.chat.completions.create(
+            # Timeouts, rate limits and server errors are retried with backoff; instructor only re-asks on invalid output
+            evaluation = call_with_retry(
+                self.client.chat.completions.create,
                 model=self.model,
                 response_model=EvaluationMetrics,
                 messages=[
                     {"role": "system", "content": "You are an expert evaluator of RAG systems."},
                     {"role": "user", "content": evaluation_prompt}
                 ],
-                max_retries=self.max_retries
+                max_retries=reask_retrying(self.max_retries),
+                timeout=self.request_timeout
             )
             return evaluation
         except Exception as e:
             print(f"Error evaluating question '{record['question']}': {str(e)}")
             return None
 
-    def evaluate_experiment(self, experiment_dir: str) -> Dict[str, Any]:
+    def load_checkpoint(self, checkpoint_path: str, responses: List[Dict[str, Any]]) -> Dict[int, Dict]:
+        """Load evaluations completed by a previous run, keyed by record index"""
+        completed = {}
+        if not os.path.exists(checkpoint_path):
+            return completed
+
+        with open(checkpoint_path, 'r') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # A run killed mid-write can leave a partial last line
+                    continue
+                index = entry.get("index")
+                # Only reuse evaluations for records that are still the same question
+                if isinstance(index, int) and index < len(responses) \
+                        and responses[index]['question'] == entry.get("question"):
+                    completed[index] = entry["evaluation"]
+        return completed
+
+    def evaluate_experiment(self, experiment_dir: str, resume: bool = True) -> Dict[str, Any]:
         """Evaluate all responses in an experiment"""
         
         # Load the responses
@@ -176,13 +212,45 @@ class RAGEvaluator:
         # Load document chunks
         chunks_lookup = self.load_document_chunks(experiment_dir)
 
-        # Evaluate each record
-        evaluations = []
-        for record in responses:
-            print(f"Evaluating question: {record['question']}")
-            evaluation = self.evaluate_response(record, chunks_lookup)
-            if evaluation:
-                evaluations.append(evaluation.model_dump())
+        # Pick up where an interrupted run left off
+        checkpoint_path = os.path.join(experiment_dir, CHECKPOINT_FILE)
+        completed = self.load_checkpoint(checkpoint_path, responses) if resume else {}
+        if completed:
+            print(f"Resuming from checkpoint: {len(completed)}/{len(responses)} records already evaluated")
+        pending = [i for i in range(len(responses)) if i not in completed]
+
+        # Evaluate the remaining records in parallel, checkpointing each one as it finishes
+        failed = 0
+        with open(checkpoint_path, 'a' if resume else 'w') as checkpoint_file, \
+                ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            # Terminate a partial line left behind by an interrupted write
+            if checkpoint_file.tell() > 0:
+                with open(checkpoint_path, 'rb') as f:
+                    f.seek(-1, os.SEEK_END)
+                    if f.read(1) != b"\n":
+                        checkpoint_file.write("\n")
+
+            futures = {
+                executor.submit(self.evaluate_response, responses[i], chunks_lookup): i
+                for i in pending
+            }
+            for future in as_completed(futures):
+                i = futures[future]
+                evaluation = future.result()
+                if evaluation:
+                    completed[i] = evaluation.model_dump()
+                    checkpoint_file.write(json.dumps({
+                        "index": i,
+                        "question": responses[i]['question'],
+                        "evaluation": completed[i]
+                    }) + "\n")
+                    checkpoint_file.flush()
+                else:
+                    failed += 1
+                print(f"Progress: {len(completed)}/{len(responses)} evaluated, {failed} failed "
+                      f"- {responses[i]['question']}")
+
+        evaluations = [completed[i] for i in sorted(completed)]
 
         # Calculate average scores
         avg_scores = {
@@ -205,7 +273,13 @@ class RAGEvaluator:
         with open(output_file, 'w') as f:
             json.dump(final_output, f, indent=2)
 
+        # A complete run no longer needs its checkpoint
+        if not failed:
+            os.remove(checkpoint_path)
+
         print(f"\nEvaluation results saved to: {output_file}")
+        if self.cache:
+            print(f"LLM cache: {self.cache.stats()}")
         print("\nAverage Scores:")
         for metric, score in avg_scores.items():
             print(f"{metric}: {score:.3f}")
@@ -217,12 +291,31 @@ def main():
     parser.add_argument('experiment_dir', help='Path to experiment directory')
     parser.add_argument('--model', default='gpt-4o',
                       help='OpenAI model to use for evaluation')
+    parser.add_argument('--max_workers', type=int, default=4,
+                      help='Number of records graded in parallel (default: 4)')
+    parser.add_argument('--timeout', type=float, default=120.0,
+                      help='Timeout in seconds for each grading request (default: 120)')
+    parser.add_argument('--restart', action='store_true',
+                      help='Ignore any checkpoint and regrade every record')
+    parser.add_argument('--base_url', default=None,
+                      help='OpenAI-compatible API base URL (default: OpenAI)')
+    parser.add_argument('--cache_path', default=DEFAULT_CACHE_PATH,
+                      help=f'SQLite file caching LLM responses across runs (default: {DEFAULT_CACHE_PATH})')
+    parser.add_argument('--no_cache', action='store_true',
+                      help='Always call the LLM instead of reusing cached responses')
     
     args = parser.parse_args()
     
     try:
-        evaluator = RAGEvaluator(OPENAI_API_KEY, args.model)
-        results = evaluator.evaluate_experiment(args.experiment_dir)
+        evaluator = RAGEvaluator(
+            OPENAI_API_KEY,
+            args.model,
+            max_workers=args.max_workers,
+            request_timeout=args.timeout,
+            base_url=args.base_url,
+            cache_path=None if args.no_cache else args.cache_path
+        )
+        results = evaluator.evaluate_experiment(args.experiment_dir, resume=not args.restart)
     except Exception as e:
         print(f"Error: {str(e)}")
         sys.exit(1)
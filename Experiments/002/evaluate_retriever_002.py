@@ -1,15 +1,19 @@
 import json
 import argparse
 from pathlib import Path
-from typing import List, Dict
+from typing import List, Dict, Optional
 from ragatouille import RAGPretrainedModel
+from rag_client import RAGServiceClient
+from rag_utils import batched_search, SEARCH_BATCH_SIZE
+from benchmark_retriever_002 import quality_metrics, K_VALUES
 import logging
 
 class RetrieverEvaluator:
-    def __init__(self, index_path: str):
+    def __init__(self, index_path: Optional[str] = None, server_url: Optional[str] = None):
         """Initialize the evaluator with the index path"""
         self.logger = self._setup_logger()
-        self.index_path = Path(index_path).resolve()
+        self.index_path = Path(index_path).resolve() if index_path else None
+        self.server_url = server_url
         self.rag_model = None
         self._load_model()
 
@@ -28,6 +32,11 @@ class RetrieverEvaluator:
 
     def _load_model(self):
         """Load the RAG model from the index"""
+        if self.server_url:
+            self.rag_model = RAGServiceClient(self.server_url)
+            self.logger.info(f"Using RAG server at {self.server_url}")
+            return
+
         self.logger.info(f"Loading RAG model from index at {self.index_path}")
         try:
             self.rag_model = RAGPretrainedModel.from_index(str(self.index_path))
@@ -62,7 +71,10 @@ class RetrieverEvaluator:
         """Evaluate a single question"""
         # Query the retriever
         results = self.rag_model.search(question, k=k)
-        
+        return self.evaluate_results(question, ground_truth_chunks, results)
+
+    def evaluate_results(self, question: str, ground_truth_chunks: List[str], results: List[Dict]) -> Dict:
+        """Evaluate the retriever results for a single question"""
         # Get retrieved chunk IDs
         retrieved_chunks = self.get_chunk_ids_from_results(results)
         
@@ -77,15 +89,30 @@ class RetrieverEvaluator:
             "total_overlap": len(overlapping)
         }
 
-    def evaluate_all(self, eval_set: List[Dict], output_path: str, k: int = 20):
+    def evaluate_all(self, eval_set: List[Dict], output_path: str, k: int = 20,
+                     batch_size: int = SEARCH_BATCH_SIZE):
         """Evaluate all questions and save results"""
         results = []
         total_questions = len(eval_set)
         
-        for i, item in enumerate(eval_set, 1):
-            self.logger.info(f"Evaluating question {i}/{total_questions}")
-            result = self.evaluate_question(item['question'], item['chunk_ids'], k)
-            results.append(result)
+        # Retrieve a batch of questions per model call instead of one at a time
+        for start in range(0, total_questions, batch_size):
+            batch = eval_set[start:start + batch_size]
+            self.logger.info(f"Evaluating questions {start + 1}-{start + len(batch)}/{total_questions}")
+            
+            batch_results = batched_search(
+                self.rag_model, [item['question'] for item in batch], k=k, batch_size=batch_size
+            )
+            for item, question_results in zip(batch, batch_results):
+                result = self.evaluate_results(item['question'], item['chunk_ids'], question_results)
+                results.append(result)
+
+        metrics = quality_metrics(
+            [result['retrieved_chunks'] for result in results],
+            [result['ground_truth'] for result in results],
+            [cutoff for cutoff in K_VALUES if cutoff <= k] or [k]
+        )
+        self.logger.info("Retrieval quality: " + ', '.join(f"{name}={value}" for name, value in metrics.items()))
 
         # Save results
         try:
@@ -98,20 +125,26 @@ class RetrieverEvaluator:
 
 def main():
     parser = argparse.ArgumentParser(description='Evaluate RAG retriever performance')
-    parser.add_argument('index_path', help='Path to the RAG index directory')
+    parser.add_argument('index_path', nargs='?', help='Path to the RAG index directory')
     parser.add_argument('--eval_set', default='Experiments/002/retriever_evaluation_set.json',
                       help='Path to evaluation set JSON file')
     parser.add_argument('--output', default='Experiments/002/retriever_evaluation_results.json',
                       help='Path to save evaluation results')
     parser.add_argument('--k', type=int, default=20,
                       help='Number of results to retrieve per query (default: 20)')
+    parser.add_argument('--batch_size', type=int, default=SEARCH_BATCH_SIZE,
+                      help=f'Number of questions searched per batch (default: {SEARCH_BATCH_SIZE})')
+    parser.add_argument('--server', default=None,
+                      help='URL of a running rag_server.py (http://host:port or unix:///path) to use instead of loading the index')
     
     args = parser.parse_args()
+    if not args.index_path and not args.server:
+        parser.error('either index_path or --server is required')
     
     try:
-        evaluator = RetrieverEvaluator(args.index_path)
+        evaluator = RetrieverEvaluator(args.index_path, server_url=args.server)
         eval_set = evaluator.load_evaluation_set(args.eval_set)
-        evaluator.evaluate_all(eval_set, args.output, args.k)
+        evaluator.evaluate_all(eval_set, args.output, args.k, args.batch_size)
         
     except Exception as e:
         print(f"Evaluation failed: {str(e)}")
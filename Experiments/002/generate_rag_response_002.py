@@ -1,4 +1,11 @@
-from ragatouille import RAGPretrainedModel
+from rag_client import RAGServiceClient
+from rag_utils import batched_search, load_search_model, SEARCH_BATCH_SIZE
+from llm_utils import TokenBucket, call_with_retry, limit_rate, map_concurrently, reask_retrying, MAX_ATTEMPTS
+from llm_cache import LLMResponseCache, CachedInstructorClient, DEFAULT_CACHE_PATH
+from reranker import CrossEncoderReranker, RERANK_CANDIDATES
+from context_packer import ContextPacker, CONTEXT_TOKEN_BUDGET
+from citation_aligner import align_citations
+from tracing import configure_tracing, instrument_instructor, record_token_usage, tracer
 from openai import OpenAI
 import instructor
 from pydantic import BaseModel, Field, field_validator, ValidationInfo
@@ -59,59 +66,69 @@ class AnswerWithCitation(BaseModel):
         return v
 
 
-    def process_citations(self, retrieved_chunks: Dict[str, str]) -> Dict[str, str]:
-        """Process citations by matching first and last two words of the citation."""
+    def align_citations(self, retrieved_chunks: Dict[str, str]) -> Optional[Dict[str, Dict]]:
+        """Locate each citation in its chunk, with character offsets and a match confidence."""
         if not self.citation or not retrieved_chunks:
             return None
+        return align_citations(self.citation, retrieved_chunks)
 
-        processed_citations = {}
-        for chunk_id, cited_content in self.citation.items():
-            try:
-                full_chunk = retrieved_chunks[chunk_id]
-                cited_content = cited_content.strip()
-                
-                # Convert both strings to lowercase for comparison
-                chunk_lower = full_chunk.lower()
-                cited_lower = cited_content.lower()
-                
-                if cited_lower in chunk_lower:
-                    # If exact match found (case-insensitive), use the original citation
-                    processed_citations[chunk_id] = cited_content
-                else:
-                    # Split into words and get first and last two words
-                    words = [w for w in cited_lower.split() if w]
-                    if len(words) < 4:  # Need at least 4 words for the matching
-                        processed_citations[chunk_id] = cited_content
-                        continue
-                    
-                    first_two = ' '.join(words[:2])
-                    last_two = ' '.join(words[-2:])
-                    
-                    # Find positions of first and last two words
-                    start_pos = chunk_lower.find(first_two)
-                    end_pos = chunk_lower.find(last_two)
-                    
-                    if start_pos != -1 and end_pos != -1 and start_pos < end_pos:
-                        # Extract the substring from original text (maintaining case)
-                        # Include the length of the last two words to get complete text
-                        end_pos = end_pos + len(last_two)
-                        processed_citations[chunk_id] = full_chunk[start_pos:end_pos]
-                    else:
-                        # If no valid match found, keep original citation
-                        processed_citations[chunk_id] = cited_content
-                        
-            except Exception as e:
-                # On any error, keep the original citation
-                processed_citations[chunk_id] = cited_content
-                
-        return processed_citations
+    def process_citations(self, retrieved_chunks: Dict[str, str]) -> Dict[str, str]:
+        """Replace each citation with the exact chunk text it matches, keeping it as is when unmatched."""
+        aligned = self.align_citations(retrieved_chunks)
+        if aligned is None:
+            return None
+        return {chunk_id: span["text"] for chunk_id, span in aligned.items()}
 
 class RAGResponseGenerator:
-    def __init__(self, index_path: str):
+    def __init__(
+        self,
+        index_path: Optional[str] = None,
+        server_url: Optional[str] = None,
+        base_url: Optional[str] = None,
+        requests_per_minute: Optional[float] = None,
+        max_attempts: int = MAX_ATTEMPTS,
+        cache_path: Optional[str] = DEFAULT_CACHE_PATH,
+        hybrid: bool = True,
+        quantized: bool = False,
+        sharded: bool = False,
+        rerank_candidates: Optional[int] = None,
+        rerank_budget_ms: Optional[float] = None,
+        context_token_budget: Optional[int] = CONTEXT_TOKEN_BUDGET
+    ):
+        """
+        Args:
+            index_path: Path to the RAG index directory
+            server_url: URL of a running rag_server.py to use instead of loading the index
+            base_url: OpenAI-compatible API base URL (e.g. a local mock server)
+            requests_per_minute: Limit on LLM requests per minute across all workers
+            max_attempts: Attempts per LLM request on rate limits, timeouts and server errors
+            cache_path: SQLite file caching LLM responses across runs (None disables caching)
+            hybrid: Fuse ColBERT with the index's BM25 ranking; False searches ColBERT only
+            quantized: Search the memory-mapped int8 copy of the index instead of loading the ColBERT index
+            sharded: Search the index shards in parallel worker processes instead of the single ColBERT index
+            rerank_candidates: Retrieve this many candidates and rerank them with a cross-encoder (None disables reranking)
+            rerank_budget_ms: Latency budget for the reranking stage
+            context_token_budget: Pack the retrieved chunks into this many context tokens (None sends every chunk in full)
+        """
         self.logger = self._setup_logger()
-        self.index_path = Path(index_path).resolve()
+        self.index_path = Path(index_path).resolve() if index_path else None
+        self.server_url = server_url
+        self.hybrid = hybrid
+        self.quantized = quantized
+        self.sharded = sharded
         self.rag_model = None
-        self.client = instructor.patch(OpenAI(api_key=OPENAI_API_KEY))
+        self.rate_limiter = TokenBucket.per_minute(requests_per_minute)
+        # The SDK's own retries are off: call_with_retry backs off and every request takes a rate limit token
+        self.client = limit_rate(instrument_instructor(instructor.from_openai(
+            OpenAI(api_key=OPENAI_API_KEY, base_url=base_url, max_retries=0)
+        )), self.rate_limiter)
+        self.cache = LLMResponseCache(cache_path) if cache_path else None
+        if self.cache:
+            self.client = CachedInstructorClient(self.client, self.cache)
+        self.max_attempts = max_attempts
+        self.rerank_candidates = rerank_candidates
+        self.reranker = CrossEncoderReranker(latency_budget_ms=rerank_budget_ms) if rerank_candidates else None
+        self.context_packer = ContextPacker(context_token_budget) if context_token_budget else None
         self._load_model()
 
     def _setup_logger(self) -> logging.Logger:
@@ -125,9 +142,17 @@ class RAGResponseGenerator:
         return logger
 
     def _load_model(self):
+        if self.server_url:
+            self.rag_model = RAGServiceClient(self.server_url)
+            self.logger.info(f"Using RAG server at {self.server_url}")
+            return
+
         self.logger.info(f"Loading RAG model from index at {self.index_path}")
         try:
-            self.rag_model = RAGPretrainedModel.from_index(str(self.index_path))
+            self.rag_model = load_search_model(
+                self.index_path, hybrid=self.hybrid, quantized=self.quantized, sharded=self.sharded,
+                logger=self.logger
+            )
             self.logger.info("Successfully loaded RAG model")
         except Exception as e:
             self.logger.error(f"Error loading model from index: {str(e)}")
@@ -151,104 +176,236 @@ class RAGResponseGenerator:
             {"role": "user", "content": f"Context:\n{context}\n\nQuestion: {query}"}
         ]
 
-    def process_query(self, query: str, k: int = 10) -> Dict:
+    def retrieval_depth(self, k: int) -> int:
+        """Number of first-stage results to retrieve for k final results"""
+        return max(k, self.rerank_candidates) if self.reranker else k
+
+    def process_query(self, query: str, k: int = 10, results: Optional[List[Dict]] = None) -> Dict:
         try:
-            # Search for relevant documents
-            results = self.rag_model.search(query, k=k)
-            
-            # Create a dictionary of retrieved chunks and list of chunk IDs
-            retrieved_chunks = {
-                result['document_id']: result['content'] 
-                for result in results
-            }
-            retrieved_chunk_ids = list(retrieved_chunks.keys())
-            
-            # Format context
-            context = self.format_context(results)
-            
-            # Create messages for LLM
-            messages = self.create_messages(query, context)
-            
-            # Get response from LLM
-            response = self.client.chat.completions.create(
-                model="gpt-4o",
-                response_model=AnswerWithCitation,
-                messages=messages,
-                max_retries=3,
-                validation_context={"retrieved_chunk_ids": retrieved_chunk_ids}  # Only pass chunk IDs
-            )
+            with tracer.trace("rag_query", k=k) as trace:
+                # Search for relevant documents unless they were retrieved up front
+                if results is None:
+                    with tracer.span("retrieval"):
+                        results = self.rag_model.search(query, k=self.retrieval_depth(k))
+                
+                # Rescore the over-retrieved candidates and keep the best k
+                rerank_stats = None
+                if self.reranker:
+                    with tracer.span("rerank") as span:
+                        results, rerank_stats = self.reranker.rerank(query, results, k=k)
+                        span.attributes.update(rerank_stats)
+                
+                with tracer.span("context_formatting"):
+                    # Create a dictionary of retrieved chunks and list of chunk IDs
+                    retrieved_chunks = {
+                        result['document_id']: result['content'] 
+                        for result in results
+                    }
+                    retrieved_chunk_ids = list(retrieved_chunks.keys())
+                    
+                    # Format context, fitting it into the token budget; only packed chunks can be cited
+                    packing_stats = None
+                    if self.context_packer:
+                        context, packing_stats = self.context_packer.pack(results)
+                        citable_chunk_ids = packing_stats["chunk_ids"]
+                        tracer.increment("context_tokens_saved", packing_stats["tokens_saved"])
+                    else:
+                        context = self.format_context(results)
+                        citable_chunk_ids = retrieved_chunk_ids
+                    
+                    # Create messages for LLM
+                    messages = self.create_messages(query, context)
+                
+                # Without a chunk to cite every answer fails validation, so don't ask the LLM
+                if not citable_chunk_ids:
+                    self.logger.warning(f"No context for query, skipping the LLM: '{query}'")
+                    response = AnswerWithCitation(is_relevant=False, answer="I cannot help with that")
+                else:
+                    # Get response from LLM, backing off on rate limits and transient errors
+                    with tracer.span("llm_completion"):
+                        response = call_with_retry(
+                            self.client.chat.completions.create,
+                            max_attempts=self.max_attempts,
+                            logger=self.logger,
+                            model="gpt-4o",
+                            response_model=AnswerWithCitation,
+                            messages=messages,
+                            max_retries=reask_retrying(3),
+                            validation_context={"retrieved_chunk_ids": citable_chunk_ids}  # Only pass chunk IDs
+                        )
+                    record_token_usage(response)
+                
+                # Align citations to exact chunk spans
+                with tracer.span("citation_processing"):
+                    citation_spans = response.align_citations(retrieved_chunks)
+                    processed_citations = (
+                        {chunk_id: span["text"] for chunk_id, span in citation_spans.items()}
+                        if citation_spans is not None else None
+                    )
+                
+                timings = trace.timings()
+                if rerank_stats:
+                    timings["rerank"] = rerank_stats
             
-            # Process citations to get exact substrings
-            processed_citations = response.process_citations(retrieved_chunks)
+            if packing_stats:
+                self.logger.info(
+                    f"Packed {packing_stats['packed']}/{packing_stats['chunks']} chunks into "
+                    f"{packing_stats['context_tokens']} tokens ({packing_stats['tokens_saved']} saved)"
+                )
             
             return {
                 "llm_response": response.answer,
                 "is_relevant": response.is_relevant,
                 "cited_chunk_ids": processed_citations,
-                "retrieved_chunk_ids": retrieved_chunk_ids
+                "citation_spans": citation_spans,
+                "retrieved_chunk_ids": retrieved_chunk_ids,
+                "timings": timings,
+                "context_packing": packing_stats
             }
             
         except Exception as e:
             self.logger.error(f"Error processing query: {str(e)}")
             return None
 
-    def process_evaluation_set(self, eval_set_path: str, output_path: str):
+    def build_record(self, item: Dict, search_results: List[Dict], k: int = 10) -> Dict:
+        """Generate the response for one evaluation item and map it to the output structure"""
+        self.logger.info(f"Processing question: {item['question']}")
+        
+        # Map fields from evaluation set to output structure
+        record = {
+            "question": item["question"],
+            "ground_truth_answer": item["answer"],  # Map from "answer" to "ground_truth_answer"
+            "difficulty": item["difficulty"],
+            "ground_truth_chunk_ids": item["chunk_ids"],  # Map from "chunk_ids" to "ground_truth_chunk_ids"
+            "document": item["document"]
+        }
+        
+        # Process the query
+        response = self.process_query(item["question"], k=k, results=search_results)
+        if response:
+            record.update({
+                "retrieved_chunk_ids": response["retrieved_chunk_ids"],
+                "llm_response": response["llm_response"],
+                "is_relevant": response["is_relevant"],
+                "cited_chunk_ids": response["cited_chunk_ids"],
+                "citation_spans": response["citation_spans"],
+                "timings": response["timings"],
+                "context_packing": response["context_packing"]
+            })
+        else:
+            record.update({
+                "retrieved_chunk_ids": [],
+                "llm_response": None,
+                "is_relevant": False,
+                "cited_chunk_ids": None,
+                "citation_spans": None
+            })
+        
+        return record
+
+    def process_evaluation_set(self, eval_set_path: str, output_path: str, k: int = 10,
+                               batch_size: int = SEARCH_BATCH_SIZE, max_concurrency: int = 1):
         # Load evaluation set
         with open(eval_set_path, 'r') as f:
             eval_set = json.load(f)
 
-        # Process each question
-        results = []
-        for item in eval_set:
-            self.logger.info(f"Processing question: {item['question']}")
-            
-            # Map fields from evaluation set to output structure
-            record = {
-                "question": item["question"],
-                "ground_truth_answer": item["answer"],  # Map from "answer" to "ground_truth_answer"
-                "difficulty": item["difficulty"],
-                "ground_truth_chunk_ids": item["chunk_ids"],  # Map from "chunk_ids" to "ground_truth_chunk_ids"
-                "document": item["document"]
-            }
-            
-            # Process the query
-            response = self.process_query(item["question"])
-            if response:
-                record.update({
-                    "retrieved_chunk_ids": response["retrieved_chunk_ids"],
-                    "llm_response": response["llm_response"],
-                    "is_relevant": response["is_relevant"],
-                    "cited_chunk_ids": response["cited_chunk_ids"]
-                })
-            else:
-                record.update({
-                    "retrieved_chunk_ids": [],
-                    "llm_response": None,
-                    "is_relevant": False,
-                    "cited_chunk_ids": None
-                })
-            
-            results.append(record)
+        # Retrieve for all questions in batches before generating answers
+        self.logger.info(f"Retrieving chunks for {len(eval_set)} questions in batches of {batch_size}")
+        with tracer.span("batch_retrieval", questions=len(eval_set)) as span:
+            all_search_results = batched_search(
+                self.rag_model, [item["question"] for item in eval_set], k=self.retrieval_depth(k), batch_size=batch_size
+            )
+        self.logger.info(
+            f"Retrieval took {span.duration_ms:.1f} ms ({span.duration_ms / max(1, len(eval_set)):.1f} ms per question)"
+        )
+
+        # Generate answers, up to max_concurrency LLM requests in flight; results keep input order
+        self.logger.info(f"Generating responses with concurrency {max_concurrency}")
+        results = map_concurrently(
+            lambda pair: self.build_record(pair[0], pair[1], k=k),
+            list(zip(eval_set, all_search_results)),
+            max_workers=max_concurrency
+        )
 
         # Save results
         with open(output_path, 'w') as f:
             json.dump(results, f, indent=2)
         
         self.logger.info(f"Results saved to {output_path}")
+        if self.cache:
+            self.logger.info(f"LLM cache: {self.cache.stats()}")
+        for stage, stats in tracer.summary().items():
+            self.logger.info(f"{stage}: {stats}")
 
 def main():
     parser = argparse.ArgumentParser(description='Generate RAG responses for evaluation set')
-    parser.add_argument('index_path', help='Path to the RAG index directory')
+    parser.add_argument('index_path', nargs='?', help='Path to the RAG index directory')
     parser.add_argument('--eval_set', default='Experiments/002/retriever_evaluation_set.json',
                       help='Path to evaluation set JSON file')
     parser.add_argument('--output', default='Experiments/002/llm_responses_eval_set_v2.json',
                       help='Path to save responses')
+    parser.add_argument('--k', type=int, default=10,
+                      help='Number of chunks to retrieve per question (default: 10)')
+    parser.add_argument('--batch_size', type=int, default=SEARCH_BATCH_SIZE,
+                      help=f'Number of questions searched per batch (default: {SEARCH_BATCH_SIZE})')
+    parser.add_argument('--max_concurrency', type=int, default=1,
+                      help='Maximum number of LLM requests in flight (default: 1, sequential)')
+    parser.add_argument('--requests_per_minute', type=float, default=None,
+                      help='Rate limit for LLM requests (default: unlimited)')
+    parser.add_argument('--max_attempts', type=int, default=MAX_ATTEMPTS,
+                      help=f'Attempts per LLM request on rate limits and transient errors (default: {MAX_ATTEMPTS})')
+    parser.add_argument('--base_url', default=None,
+                      help='OpenAI-compatible API base URL, e.g. a local mock server (default: OpenAI)')
+    parser.add_argument('--cache_path', default=DEFAULT_CACHE_PATH,
+                      help=f'SQLite file caching LLM responses across runs (default: {DEFAULT_CACHE_PATH})')
+    parser.add_argument('--no_cache', action='store_true',
+                      help='Always call the LLM instead of reusing cached responses')
+    parser.add_argument('--dense_only', action='store_true',
+                      help='Search with ColBERT only instead of fusing it with BM25')
+    parser.add_argument('--quantized', action='store_true',
+                      help='Search the memory-mapped int8 index built with rag_indexer.py --quantize')
+    parser.add_argument('--sharded', action='store_true',
+                      help='Search the index shards built with rag_indexer.py --shards N in parallel worker processes')
+    parser.add_argument('--rerank_candidates', type=int, nargs='?', const=RERANK_CANDIDATES, default=None,
+                      help=f'Over-retrieve this many candidates (default when given: {RERANK_CANDIDATES}) and rerank them with a cross-encoder')
+    parser.add_argument('--rerank_budget_ms', type=float, default=None,
+                      help='Latency budget for reranking; remaining candidates keep their retrieval order (default: none)')
+    parser.add_argument('--context_tokens', type=int, default=CONTEXT_TOKEN_BUDGET,
+                      help=f'Token budget for the retrieved context sent to the LLM (default: {CONTEXT_TOKEN_BUDGET})')
+    parser.add_argument('--no_context_packing', action='store_true',
+                      help='Send every retrieved chunk in full instead of packing them into the token budget')
+    parser.add_argument('--trace_log', default=None,
+                      help='Append a JSONL trace with per-stage spans for every question to this file')
+    parser.add_argument('--metrics_file', default=None,
+                      help='Write per-stage latency percentiles and counters here in Prometheus text format')
+    parser.add_argument('--server', default=None,
+                      help='URL of a running rag_server.py (http://host:port or unix:///path) to use instead of loading the index')
     
     args = parser.parse_args()
+    if not args.index_path and not args.server:
+        parser.error('either index_path or --server is required')
     
     try:
-        generator = RAGResponseGenerator(args.index_path)
-        generator.process_evaluation_set(args.eval_set, args.output)
+        configure_tracing(args.trace_log)
+        generator = RAGResponseGenerator(
+            args.index_path,
+            server_url=args.server,
+            base_url=args.base_url,
+            requests_per_minute=args.requests_per_minute,
+            max_attempts=args.max_attempts,
+            cache_path=None if args.no_cache else args.cache_path,
+            hybrid=not args.dense_only,
+            quantized=args.quantized,
+            sharded=args.sharded,
+            rerank_candidates=args.rerank_candidates,
+            rerank_budget_ms=args.rerank_budget_ms,
+            context_token_budget=None if args.no_context_packing else args.context_tokens
+        )
+        generator.process_evaluation_set(
+            args.eval_set, args.output, args.k, args.batch_size, max_concurrency=args.max_concurrency
+        )
+        if args.metrics_file:
+            tracer.write_prometheus(args.metrics_file)
     except Exception as e:
         print(f"Error: {str(e)}")
         sys.exit(1)
@@ -0,0 +1,159 @@
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+import logging
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Any, Dict, List, Optional, Type
+from pydantic import BaseModel
+
+DEFAULT_CACHE_PATH = ".llm_cache/responses.sqlite3"
+DEFAULT_TTL_SECONDS = 30 * 24 * 3600  # Entries older than this are treated as misses
+DEFAULT_MAX_ENTRIES = 50000  # Least recently used entries are evicted beyond this
+
+class LLMResponseCache:
+    """
+    Disk-backed cache of LLM responses keyed on a fingerprint of the request
+
+    Entries expire after ttl_seconds and the least recently used entries are
+    evicted once the cache holds more than max_entries. Safe to share between
+    threads.
+    """
+
+    def __init__(
+        self,
+        path: str = DEFAULT_CACHE_PATH,
+        ttl_seconds: Optional[float] = DEFAULT_TTL_SECONDS,
+        max_entries: Optional[int] = DEFAULT_MAX_ENTRIES
+    ):
+        """
+        Args:
+            path: SQLite database file
+            ttl_seconds: Maximum age of a usable entry (None keeps entries forever)
+            max_entries: Maximum number of stored entries (None disables eviction)
+        """
+        self.logger = logging.getLogger(__name__)
+        self.path = Path(path)
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.connection = sqlite3.connect(str(self.path), check_same_thread=False)
+        with self.lock, self.connection:
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+                "created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+            )
+            self.connection.execute("CREATE INDEX IF NOT EXISTS responses_accessed_at ON responses (accessed_at)")
+        self.purge_expired()
+
+    @staticmethod
+    def make_key(model: str, messages: List[Dict], response_schema: Optional[Dict] = None, **extra) -> str:
+        """Fingerprint a request from its model, messages, response schema and any extra inputs"""
+        payload = json.dumps(
+            {"model": model, "messages": messages, "response_schema": response_schema, "extra": extra},
+            sort_keys=True,
+            ensure_ascii=False,
+            default=str
+        )
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        """Return the cached value for key, or None if it is missing or expired"""
+        now = time.time()
+        with self.lock, self.connection:
+            row = self.connection.execute(
+                "SELECT value, created_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+
+            if row is not None and self.ttl_seconds is not None and now - row[1] > self.ttl_seconds:
+                self.connection.execute("DELETE FROM responses WHERE key = ?", (key,))
+                row = None
+
+            if row is None:
+                self.misses += 1
+                return None
+
+            self.connection.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key))
+            self.hits += 1
+            return row[0]
+
+    def set(self, key: str, value: str):
+        """Store value under key, evicting least recently used entries beyond max_entries"""
+        now = time.time()
+        with self.lock, self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO responses (key, value, created_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, value, now, now)
+            )
+            if self.max_entries is not None:
+                self.connection.execute(
+                    "DELETE FROM responses WHERE key IN ("
+                    "SELECT key FROM responses ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                    (self.max_entries,)
+                )
+
+    def purge_expired(self):
+        """Delete every entry older than the TTL"""
+        if self.ttl_seconds is None:
+            return
+        with self.lock, self.connection:
+            self.connection.execute("DELETE FROM responses WHERE created_at < ?", (time.time() - self.ttl_seconds,))
+
+    def stats(self) -> Dict[str, int]:
+        with self.lock:
+            entries = self.connection.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        return {"hits": self.hits, "misses": self.misses, "entries": entries}
+
+class CachedInstructorClient:
+    """
+    Wraps an instructor-patched client so repeated requests are served from the cache
+
+    Exposes chat.completions.create with the same arguments as the wrapped
+    client. Cached responses are re-validated against response_model with the
+    same validation_context, so validators still run on a hit.
+    """
+
+    def __init__(self, client, cache: LLMResponseCache):
+        self.client = client
+        self.cache = cache
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def create(
+        self,
+        model: str,
+        messages: List[Dict],
+        response_model: Optional[Type[BaseModel]] = None,
+        validation_context: Optional[Dict] = None,
+        **kwargs
+    ) -> Any:
+        # Retry and timeout settings don't change the answer, so they are not part of the key
+        key = self.cache.make_key(
+            model,
+            messages,
+            response_model.model_json_schema() if response_model else None,
+            validation_context=validation_context
+        )
+
+        cached = self.cache.get(key)
+        if cached is not None and response_model is not None:
+            return response_model.model_validate_json(cached, context=validation_context)
+
+        if validation_context is not None:
+            kwargs['validation_context'] = validation_context
+        response = self.client.chat.completions.create(
+            model=model,
+            messages=messages,
+            response_model=response_model,
+            **kwargs
+        )
+
+        if response_model is not None:
+            self.cache.set(key, response.model_dump_json())
+        return response
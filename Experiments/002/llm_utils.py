@@ -0,0 +1,158 @@
+import json
+import random
+import threading
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Iterable, List, Optional, Tuple, Type
+import openai
+from pydantic import ValidationError
+from tenacity import Retrying, retry_if_exception_type, stop_after_attempt
+
+# Errors worth retrying: rate limits, timeouts, dropped connections and 5xx responses
+RETRYABLE_ERRORS: Tuple[Type[BaseException], ...] = (
+    openai.RateLimitError,
+    openai.APIConnectionError,
+    openai.InternalServerError,
+)
+MAX_ATTEMPTS = 5
+BASE_RETRY_DELAY = 1.0  # Seconds before the first retry, doubled on every attempt
+MAX_RETRY_DELAY = 30.0
+# Errors instructor answers by re-asking the model with the validation error
+REASK_ERRORS: Tuple[Type[BaseException], ...] = (ValidationError, json.JSONDecodeError)
+
+class TokenBucket:
+    """
+    Thread-safe token bucket rate limiter
+
+    Tokens refill continuously at `rate` per second up to `capacity`; each
+    acquire() takes one token and blocks until one is available.
+    """
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        """
+        Args:
+            rate: Tokens added per second (e.g. requests_per_minute / 60)
+            capacity: Maximum burst size (defaults to one second's worth of tokens, at least 1)
+        """
+        if rate <= 0:
+            raise ValueError("Token bucket rate must be positive")
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    @classmethod
+    def per_minute(cls, requests_per_minute: Optional[float]) -> Optional["TokenBucket"]:
+        """Build a bucket for a requests-per-minute limit, or None when unlimited"""
+        if not requests_per_minute:
+            return None
+        return cls(requests_per_minute / 60.0)
+
+    def acquire(self, tokens: float = 1.0):
+        """Block until `tokens` tokens are available, then take them"""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+                wait_time = (tokens - self.tokens) / self.rate
+
+            time.sleep(wait_time)
+
+def reask_retrying(max_retries: int) -> Retrying:
+    """
+    Retry policy for instructor's max_retries that only re-asks on invalid output
+
+    Instructor otherwise repeats every failed request at once, rate limits and
+    timeouts included, and wraps the last error in InstructorRetryException.
+    With this policy those errors reach call_with_retry as they are and are
+    retried there with backoff.
+
+    Args:
+        max_retries: Attempts per request, counting re-asks, as for an int max_retries
+    """
+    return Retrying(stop=stop_after_attempt(max_retries), retry=retry_if_exception_type(REASK_ERRORS), reraise=True)
+
+def limit_rate(client, rate_limiter: Optional[TokenBucket]):
+    """
+    Take a token from rate_limiter before every request an instructor client sends, re-asks included
+
+    Clients without hooks are returned unchanged; pass the limiter to call_with_retry for those.
+    """
+    if rate_limiter is not None and hasattr(client, 'on'):
+        client.on("completion:kwargs", lambda *args, **kwargs: rate_limiter.acquire())
+    return client
+
+def _retry_cause(error: BaseException) -> BaseException:
+    """The error behind an InstructorRetryException (the last attempt's error), or the error itself"""
+    last_attempt = getattr(error.__cause__, 'last_attempt', None)
+    if last_attempt is not None and last_attempt.failed:
+        return last_attempt.exception()
+    return error
+
+def call_with_retry(
+    func: Callable[..., Any],
+    *args,
+    max_attempts: int = MAX_ATTEMPTS,
+    base_delay: float = BASE_RETRY_DELAY,
+    max_delay: float = MAX_RETRY_DELAY,
+    retry_on: Tuple[Type[BaseException], ...] = RETRYABLE_ERRORS,
+    rate_limiter: Optional[TokenBucket] = None,
+    logger: Optional[logging.Logger] = None,
+    **kwargs
+) -> Any:
+    """
+    Call func, retrying transient failures with exponential backoff and jitter
+
+    Args:
+        func: Function to call
+        max_attempts: Total number of attempts before giving up
+        base_delay: Delay before the first retry in seconds
+        max_delay: Upper bound for a single delay in seconds
+        retry_on: Exception types that trigger a retry, also when instructor wraps them in
+            InstructorRetryException; anything else is raised immediately
+        rate_limiter: Optional token bucket consulted before every attempt (see limit_rate for instructor clients)
+        logger: Logger for retry warnings
+
+    Returns:
+        The return value of func
+    """
+    for attempt in range(1, max_attempts + 1):
+        if rate_limiter is not None:
+            rate_limiter.acquire()
+        try:
+            return func(*args, **kwargs)
+        except Exception as e:
+            cause = _retry_cause(e)
+            if not isinstance(cause, retry_on) or attempt == max_attempts:
+                raise
+            delay = min(max_delay, base_delay * 2 ** (attempt - 1))
+            delay = random.uniform(delay / 2, delay)
+            if logger:
+                logger.warning(f"Attempt {attempt}/{max_attempts} failed ({type(cause).__name__}: {str(cause)}), "
+                               f"retrying in {delay:.1f}s")
+            time.sleep(delay)
+
+def map_concurrently(func: Callable[[Any], Any], items: Iterable[Any], max_workers: int = 1) -> List[Any]:
+    """
+    Apply func to every item using a bounded thread pool
+
+    Args:
+        func: Function applied to each item
+        items: Items to process
+        max_workers: Maximum number of calls in flight; 1 runs sequentially in the calling thread
+
+    Returns:
+        Results in the same order as items
+    """
+    if max_workers <= 1:
+        return [func(item) for item in items]
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(func, items))
@@ -0,0 +1,261 @@
+import json
+import shutil
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple, Union
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+QUANTIZED_INDEX_DIR = "quantized"  # Stored inside the ColBERT index directory
+FORMAT_VERSION = 1
+CODES_FILE = "codes.int8"  # (tokens, dim) int8 token vectors
+SCALES_FILE = "scales.float16"  # (tokens,) per-token dequantization scale
+OFFSETS_FILE = "doc_offsets.int64"  # (chunks + 1,) first token row of each chunk
+CHUNKS_FILE = "chunks.parquet"  # chunk_id, content and metadata per chunk, in token order
+META_FILE = "quantized_meta.json"
+SCORE_BLOCK_TOKENS = 1 << 16  # Token vectors dequantized and scored at a time
+DOC_ENCODE_BATCH_SIZE = 32
+COPY_BATCH_CHUNKS = 4096  # Chunks copied at a time when carrying rows over from an existing index
+
+CHUNK_SCHEMA = pa.schema([
+    ('chunk_id', pa.string()),
+    ('chunk_content', pa.string()),
+    ('chunk_metadata', pa.string()),  # JSON encoded, null when the chunk has none
+])
+
+def quantize(embeddings: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Symmetric per-token int8 quantization: embeddings ~= codes * scales[:, None]"""
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    scales = np.abs(embeddings).max(axis=1) / 127.0
+    scales[scales == 0] = 1.0
+    codes = np.clip(np.rint(embeddings / scales[:, None]), -127, 127).astype(np.int8)
+    return codes, scales.astype(np.float16)
+
+def colbert_document_encoder(rag_model) -> Callable[[List[str]], Tuple[np.ndarray, List[int]]]:
+    """Token embeddings of documents from a RAGPretrainedModel's ColBERT checkpoint"""
+    checkpoint = rag_model.model.inference_ckpt
+
+    def encode(documents: List[str]) -> Tuple[np.ndarray, List[int]]:
+        embeddings, doclens = checkpoint.docFromText(
+            documents, bsize=DOC_ENCODE_BATCH_SIZE, keep_dims='flatten', showprogress=False
+        )
+        return embeddings.float().cpu().numpy(), list(doclens)
+
+    return encode
+
+def colbert_query_encoder(rag_model) -> Callable[[List[str]], np.ndarray]:
+    """(queries, query tokens, dim) embeddings from a RAGPretrainedModel's ColBERT checkpoint"""
+    checkpoint = rag_model.model.inference_ckpt
+
+    def encode(queries: List[str]) -> np.ndarray:
+        return checkpoint.queryFromText(queries, bsize=len(queries)).float().cpu().numpy()
+
+    return encode
+
+class QuantizedIndexWriter:
+    """
+    Writes a quantized index batch by batch, so the float embeddings of only one batch are in memory
+
+    The index is assembled in a temporary directory next to the target and
+    moved into place by close(), so readers never see a partial index.
+    """
+
+    def __init__(self, index_path: Path, model_name: str):
+        self.target = Path(index_path) / QUANTIZED_INDEX_DIR
+        self.directory = self.target.with_name(QUANTIZED_INDEX_DIR + '.tmp')
+        shutil.rmtree(self.directory, ignore_errors=True)
+        self.directory.mkdir(parents=True)
+        self.model_name = model_name
+        self.codes_file = open(self.directory / CODES_FILE, 'wb')
+        self.scales_file = open(self.directory / SCALES_FILE, 'wb')
+        self.chunk_writer = pq.ParquetWriter(self.directory / CHUNKS_FILE, CHUNK_SCHEMA)
+        self.offsets = [0]
+        self.dim = None
+
+    def add(self, chunk_ids: List[str], contents: List[str], metadata: List[Dict],
+            embeddings: np.ndarray, doclens: List[int]):
+        """Append a batch of chunks with their flattened token embeddings and per-chunk token counts"""
+        if len(doclens) != len(chunk_ids) or sum(doclens) != len(embeddings):
+            raise ValueError("Token counts do not match the chunks and embeddings of the batch")
+        if any(doclen == 0 for doclen in doclens):
+            raise ValueError("Every chunk needs at least one token vector")
+        if self.dim is None:
+            self.dim = int(embeddings.shape[1])
+
+        codes, scales = quantize(embeddings)
+        codes.tofile(self.codes_file)
+        scales.tofile(self.scales_file)
+        for doclen in doclens:
+            self.offsets.append(self.offsets[-1] + int(doclen))
+
+        self.chunk_writer.write_table(pa.table([
+            chunk_ids,
+            contents,
+            [json.dumps(chunk_metadata, ensure_ascii=False) if chunk_metadata else None for chunk_metadata in metadata],
+        ], schema=CHUNK_SCHEMA))
+
+    def add_from(self, index: "QuantizedIndex", rows: List[int]):
+        """Append chunks of an existing quantized index as they are, without re-encoding them"""
+        if self.dim is None:
+            self.dim = int(index.meta['dim'])
+        for start in range(0, len(rows), COPY_BATCH_CHUNKS):
+            batch = np.asarray(rows[start:start + COPY_BATCH_CHUNKS], dtype=np.int64)
+            token_rows, starts = index.token_rows(batch)
+            index.codes[token_rows].tofile(self.codes_file)
+            index.scales[token_rows].tofile(self.scales_file)
+            self.offsets.extend((self.offsets[-1] + np.append(starts[1:], len(token_rows))).tolist())
+            self.chunk_writer.write_table(index.chunks.take(pa.array(batch)))
+
+    def close(self) -> Path:
+        """Finish the index and move it into place"""
+        self.codes_file.close()
+        self.scales_file.close()
+        self.chunk_writer.close()
+        np.asarray(self.offsets, dtype=np.int64).tofile(self.directory / OFFSETS_FILE)
+        with open(self.directory / META_FILE, 'w', encoding='utf-8') as f:
+            json.dump({
+                'format_version': FORMAT_VERSION,
+                'model_name': self.model_name,
+                'dim': self.dim,
+                'num_tokens': self.offsets[-1],
+                'num_chunks': len(self.offsets) - 1,
+            }, f)
+
+        shutil.rmtree(self.target, ignore_errors=True)
+        self.directory.replace(self.target)
+        return self.target
+
+class QuantizedIndex:
+    """
+    Read-only, memory-mapped multi-vector index with int8 token vectors
+
+    Token vectors, scales and chunk offsets are numpy memmaps and the chunk
+    texts are a memory-mapped Arrow table, so loading only maps the files:
+    pages are read on demand and shared through the page cache by every
+    process serving the same index. Scoring dequantizes one block of token
+    vectors at a time and takes the ColBERT MaxSim per chunk.
+    """
+
+    def __init__(self, directory: Path):
+        self.directory = Path(directory)
+        with open(self.directory / META_FILE, 'r', encoding='utf-8') as f:
+            self.meta = json.load(f)
+        if self.meta['format_version'] != FORMAT_VERSION:
+            raise ValueError(f"Unsupported quantized index format {self.meta['format_version']} in {self.directory}")
+
+        num_tokens, dim = self.meta['num_tokens'], self.meta['dim']
+        self.codes = np.memmap(self.directory / CODES_FILE, dtype=np.int8, mode='r', shape=(num_tokens, dim))
+        self.scales = np.memmap(self.directory / SCALES_FILE, dtype=np.float16, mode='r', shape=(num_tokens,))
+        self.offsets = np.memmap(self.directory / OFFSETS_FILE, dtype=np.int64, mode='r')
+        self.chunks = pq.read_table(self.directory / CHUNKS_FILE, memory_map=True)
+        self.chunk_ids = self.chunks.column('chunk_id').to_pylist()
+        self.row_by_id = {chunk_id: row for row, chunk_id in enumerate(self.chunk_ids)}
+        self.blocks = self._score_blocks()
+
+    @classmethod
+    def load(cls, index_path: Path) -> Optional["QuantizedIndex"]:
+        """Open the quantized index stored in an index directory, if it has one"""
+        directory = Path(index_path) / QUANTIZED_INDEX_DIR
+        if not (directory / META_FILE).exists():
+            return None
+        return cls(directory)
+
+    def __len__(self) -> int:
+        return len(self.chunk_ids)
+
+    def _score_blocks(self) -> List[Tuple[int, int]]:
+        """Split the chunks into runs of about SCORE_BLOCK_TOKENS tokens"""
+        blocks = []
+        start = 0
+        while start < len(self):
+            end = int(np.searchsorted(self.offsets, self.offsets[start] + SCORE_BLOCK_TOKENS, side='right')) - 1
+            end = min(max(end, start + 1), len(self))
+            blocks.append((start, end))
+            start = end
+        return blocks
+
+    def token_rows(self, rows: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Token rows of the given chunks, concatenated, and where each chunk starts within them"""
+        lengths = self.offsets[rows + 1] - self.offsets[rows]
+        starts = np.concatenate([[0], np.cumsum(lengths)[:-1]]).astype(np.int64)
+        return np.repeat(self.offsets[rows] - starts, lengths) + np.arange(lengths.sum()), starts
+
+    def _maxsim(self, token_rows: Union[slice, np.ndarray], starts: np.ndarray, queries: np.ndarray) -> np.ndarray:
+        """(chunks, queries) MaxSim scores of the chunks whose token vectors start at starts within token_rows"""
+        codes = self.codes[token_rows].astype(np.float32)
+        similarities = codes @ queries.reshape(-1, queries.shape[-1]).T
+        similarities *= self.scales[token_rows].astype(np.float32)[:, None]
+        best = np.maximum.reduceat(similarities, starts, axis=0)
+        return best.reshape(len(starts), queries.shape[0], queries.shape[1]).sum(axis=2)
+
+    def score(self, queries: np.ndarray, rows: Optional[List[int]] = None) -> np.ndarray:
+        """
+        MaxSim scores of chunks for a batch of encoded queries
+
+        Args:
+            queries: (queries, query tokens, dim) query embeddings
+            rows: Chunk rows to score (None scores every chunk)
+
+        Returns:
+            (queries, chunks) scores, chunks in row order or in the order of rows
+        """
+        queries = np.asarray(queries, dtype=np.float32)
+        if rows is not None:
+            rows = np.asarray(rows, dtype=np.int64)
+            if len(rows) == 0:
+                return np.zeros((queries.shape[0], 0), dtype=np.float32)
+            token_rows, starts = self.token_rows(rows)
+            return self._maxsim(token_rows, starts, queries).T
+
+        scores = np.empty((queries.shape[0], len(self)), dtype=np.float32)
+        for start, end in self.blocks:
+            token_start, token_end = int(self.offsets[start]), int(self.offsets[end])
+            starts = np.asarray(self.offsets[start:end]) - token_start
+            scores[:, start:end] = self._maxsim(slice(token_start, token_end), starts, queries).T
+        return scores
+
+    def result(self, row: int, score: float, rank: int) -> Dict:
+        """Build a search result for a chunk in the RAGatouille result layout"""
+        result = {
+            'content': self.chunks.column('chunk_content')[row].as_py(),
+            'score': score,
+            'rank': rank,
+            'document_id': self.chunk_ids[row],
+        }
+        metadata_json = self.chunks.column('chunk_metadata')[row].as_py()
+        if metadata_json:
+            result['document_metadata'] = json.loads(metadata_json)
+        return result
+
+class QuantizedSearchModel:
+    """Searches a QuantizedIndex behind the RAGPretrainedModel search() call"""
+
+    def __init__(self, index: QuantizedIndex, encode_queries: Callable[[List[str]], np.ndarray]):
+        """
+        Args:
+            index: Memory-mapped quantized index
+            encode_queries: Maps a list of queries to (queries, query tokens, dim) embeddings
+        """
+        self.index = index
+        self.encode_queries = encode_queries
+
+    def search(self, query: Union[str, List[str]], k: int = 10,
+               doc_ids: Optional[List[str]] = None) -> Union[List[Dict], List[List[Dict]]]:
+        queries = query if isinstance(query, list) else [query]
+        rows = None
+        if doc_ids is not None:
+            rows = [self.index.row_by_id[chunk_id] for chunk_id in doc_ids if chunk_id in self.index.row_by_id]
+        scores = self.index.score(self.encode_queries(queries), rows)
+
+        results = []
+        for query_scores in scores:
+            top = np.arange(len(query_scores))
+            if 0 < k < len(top):
+                top = np.argpartition(-query_scores, k - 1)[:k]
+            top = top[np.lexsort((top, -query_scores[top]))][:max(k, 0)]
+            results.append([
+                self.index.result(rows[i] if rows is not None else int(i), float(query_scores[i]), rank)
+                for rank, i in enumerate(top, 1)
+            ])
+        # Mirror RAGatouille, which unwraps the result list when given a single query
+        return results if len(queries) > 1 else results[0]
@@ -0,0 +1,90 @@
+import json
+import socket
+import http.client
+from typing import Dict, List, Optional, Union
+from urllib.parse import urlparse
+
+DEFAULT_SERVER_URL = "http://127.0.0.1:8765"
+REQUEST_TIMEOUT = 300  # Seconds; batch searches over large eval sets can take a while
+
+class _UnixHTTPConnection(http.client.HTTPConnection):
+    """HTTP connection over a Unix domain socket"""
+
+    def __init__(self, socket_path: str, timeout: float):
+        super().__init__('localhost', timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+class RAGServiceClient:
+    """
+    Thin client for a running rag_server.py
+
+    Exposes the same search() call as RAGPretrainedModel so the CLIs can use it
+    in place of a locally loaded model.
+    """
+    supports_metadata_filters = True  # The server resolves filters against its metadata index
+
+    def __init__(self, server_url: str = DEFAULT_SERVER_URL, timeout: float = REQUEST_TIMEOUT):
+        """
+        Args:
+            server_url: http://host:port or unix:///path/to/socket
+            timeout: Per-request timeout in seconds
+        """
+        self.server_url = server_url
+        self.timeout = timeout
+        self._parsed_url = urlparse(server_url)
+        if self._parsed_url.scheme not in ('http', 'unix'):
+            raise ValueError(f"Unsupported server URL {server_url}, expected http://host:port or unix:///path")
+
+    def _connection(self) -> http.client.HTTPConnection:
+        if self._parsed_url.scheme == 'unix':
+            return _UnixHTTPConnection(self._parsed_url.path, self.timeout)
+        return http.client.HTTPConnection(self._parsed_url.hostname, self._parsed_url.port or 80, timeout=self.timeout)
+
+    def _request(self, method: str, path: str, payload: Optional[Dict] = None) -> Dict:
+        """Send a JSON request to the server and return the decoded JSON response"""
+        connection = self._connection()
+        try:
+            body = json.dumps(payload).encode('utf-8') if payload is not None else None
+            headers = {'Content-Type': 'application/json'} if body is not None else {}
+            connection.request(method, path, body=body, headers=headers)
+            response = connection.getresponse()
+            data = json.loads(response.read().decode('utf-8') or '{}')
+        finally:
+            connection.close()
+
+        if response.status != 200:
+            raise RuntimeError(f"RAG server error {response.status}: {data.get('error', 'unknown error')}")
+        return data
+
+    def health(self) -> Dict:
+        """Return the server's status and the index it has loaded"""
+        return self._request('GET', '/health')
+
+    def search(self, query: Union[str, List[str]], k: int = 10, doc_ids: Optional[List[str]] = None,
+               metadata_filters: Optional[Dict[str, str]] = None) -> Union[List[Dict], List[List[Dict]]]:
+        """
+        Search the server's index
+
+        Mirrors RAGPretrainedModel.search: a single query returns a list of
+        results, a list of queries returns one result list per query. doc_ids
+        and metadata_filters restrict the search to the chunks matching both.
+        """
+        if isinstance(query, list):
+            return self.search_batch(query, k=k, doc_ids=doc_ids, metadata_filters=metadata_filters)
+        payload = {'query': query, 'k': k, 'doc_ids': doc_ids, 'metadata_filters': metadata_filters}
+        return self._request('POST', '/search', payload)['results']
+
+    def search_batch(self, queries: List[str], k: int = 10, doc_ids: Optional[List[str]] = None,
+                     metadata_filters: Optional[Dict[str, str]] = None) -> List[List[Dict]]:
+        """Search the server's index for several queries in one request"""
+        payload = {'queries': queries, 'k': k, 'doc_ids': doc_ids, 'metadata_filters': metadata_filters}
+        return self._request('POST', '/search_batch', payload)['results']
+
+    def answer(self, query: str, k: int = 10) -> Optional[Dict]:
+        """Run retrieval and answer generation on the server"""
+        return self._request('POST', '/answer', {'query': query, 'k': k})['response']
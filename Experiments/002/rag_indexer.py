@@ -1,36 +1,50 @@
 # Build index using: python rag_indexer.py 002
+# Re-index only changed chunks using: python rag_indexer.py 002 --incremental
+# Also write the memory-mapped int8 index for --quantized search using: python rag_indexer.py 002 --quantize
+# Also partition the index into 8 shards for --sharded search using: python rag_indexer.py 002 --shards 8
 # Index path will be .ragatouille/colbert/indexes/Experiment_002
 
-from rag_utils import DocumentIndexer
+from rag_utils import DocumentIndexer, CHUNK_BATCH_SIZE
 from pathlib import Path
 import argparse
 import sys
 import logging
 
 class RAGIndexBuilder:
-    def __init__(self, experiment_number: str):
+    def __init__(self, experiment_number: str, batch_size: int = CHUNK_BATCH_SIZE, quantize: bool = False,
+                 shards: int = 1):
         """
         Initialize the RAG index builder for a specific experiment
         
         Args:
             experiment_number: The experiment number to work with
+            batch_size: Number of chunks read or encoded at a time
+            quantize: Also build the memory-mapped int8 copy of the index
+            shards: Also partition the index into this many shards (1 builds none)
         """
         self.experiment_number = experiment_number
-        self.indexer = DocumentIndexer(experiment_number)
+        self.indexer = DocumentIndexer(experiment_number, batch_size=batch_size, quantize=quantize, shards=shards)
         
-    def build_index(self) -> Path:
+    def build_index(self, incremental: bool = False) -> Path:
         """
         Build the index for the experiment
         
+        Args:
+            incremental: Only add/delete chunks that changed since the last build
+            
         Returns:
             Path: Location of the created index
         """
         try:
-            print(f"\nBuilding index for experiment {self.experiment_number}...")
-            print("This may take a while depending on the size of your document collection.")
-            
-            # Build the index
-            index_path = self.indexer.create_index()
+            if incremental:
+                print(f"\nUpdating index for experiment {self.experiment_number}...")
+                index_path = self.indexer.update_index()
+            else:
+                print(f"\nBuilding index for experiment {self.experiment_number}...")
+                print("This may take a while depending on the size of your document collection.")
+                
+                # Build the index
+                index_path = self.indexer.create_index()
             
             print(f"\nSuccess! Index built at: {index_path}")
             return index_path
@@ -53,6 +67,9 @@ def main():
 Example usage:
   python rag_indexer.py 001
   python rag_indexer.py experiment_001
+  python rag_indexer.py 002 --incremental
+  python rag_indexer.py 002 --quantize
+  python rag_indexer.py 002 --shards 8
         """
     )
     
@@ -60,14 +77,37 @@ Example usage:
         'experiment_number',
         help='Experiment number/name (e.g., 001 or experiment_001)'
     )
+    parser.add_argument(
+        '--batch_size',
+        type=int,
+        default=CHUNK_BATCH_SIZE,
+        help=f'Number of chunks read or encoded at a time (default: {CHUNK_BATCH_SIZE})'
+    )
+    parser.add_argument(
+        '--incremental',
+        action='store_true',
+        help='Only index new/changed chunks and delete removed ones (falls back to a full build)'
+    )
+    parser.add_argument(
+        '--quantize',
+        action='store_true',
+        help='Also write a memory-mapped int8 copy of the index, searched with --quantized'
+    )
+    parser.add_argument(
+        '--shards',
+        type=int,
+        default=1,
+        help='Also partition the index into this many shards, searched in parallel with --sharded (default: 1, no shards)'
+    )
     
     # Parse arguments
     args = parser.parse_args()
     
     try:
         # Initialize and run index builder
-        builder = RAGIndexBuilder(args.experiment_number)
-        index_path = builder.build_index()
+        builder = RAGIndexBuilder(args.experiment_number, batch_size=args.batch_size, quantize=args.quantize,
+                                   shards=args.shards)
+        index_path = builder.build_index(incremental=args.incremental)
         
         # Final success message
         print("\nIndex building completed successfully!")
@@ -1,18 +1,36 @@
 # run  on ubuntu using:  python rag_querier.py .ragatouille/colbert/indexes/Experiment_002 --k 10 
+# or against a running rag_server.py:  python rag_querier.py --server http://127.0.0.1:8765 --k 10
 
 from pathlib import Path
 import argparse
 import sys
 import logging
-from typing import Dict, List
-from ragatouille import RAGPretrainedModel
+from typing import Dict, List, Optional
+from rag_client import RAGServiceClient
+from rag_utils import MetadataIndex, load_search_model, search_with_filters, DENSE_WEIGHT, SPARSE_WEIGHT
 
 class RAGQuerier:
-    def __init__(self, index_path: Path):
-        """Initialize the RAG querier with a specific index"""
+    def __init__(
+        self,
+        index_path: Optional[Path] = None,
+        server_url: Optional[str] = None,
+        hybrid: bool = True,
+        dense_weight: float = DENSE_WEIGHT,
+        sparse_weight: float = SPARSE_WEIGHT,
+        bm25_prune_k: Optional[int] = None,
+        quantized: bool = False,
+        sharded: bool = False
+    ):
+        """Initialize the RAG querier with a specific index (hybrid ColBERT + BM25 unless hybrid is False)"""
         self.logger = self._setup_logger()
-        self.index_path = Path(index_path).resolve()
+        self.index_path = Path(index_path).resolve() if index_path else None
+        self.server_url = server_url
+        self.retrieval_options = dict(
+            hybrid=hybrid, dense_weight=dense_weight, sparse_weight=sparse_weight, bm25_prune_k=bm25_prune_k,
+            quantized=quantized, sharded=sharded
+        )
         self.rag_model = None
+        self.metadata_index = None
         self._load_model()
         
     def _setup_logger(self) -> logging.Logger:
@@ -30,9 +48,15 @@ class RAGQuerier:
         
     def _load_model(self):
         """Load the RAG model from the index"""
+        if self.server_url:
+            self.rag_model = RAGServiceClient(self.server_url)
+            self.logger.info(f"Using RAG server at {self.server_url}")
+            return
+
         self.logger.info(f"Loading RAG model from index at {self.index_path}")
         try:
-            self.rag_model = RAGPretrainedModel.from_index(str(self.index_path))
+            self.rag_model = load_search_model(self.index_path, logger=self.logger, **self.retrieval_options)
+            self.metadata_index = MetadataIndex.load(self.index_path)
             self.logger.info("Successfully loaded RAG model")
         except Exception as e:
             self.logger.error(f"Error loading model from index: {str(e)}")
@@ -68,7 +92,7 @@ class RAGQuerier:
         return query, metadata_filters
         
     def _filter_by_metadata(self, results: List[Dict], metadata_filters: Dict) -> List[Dict]:
-        """Filter results based on metadata criteria"""
+        """Filter results based on metadata criteria (safety net when no metadata index is available)"""
         if not metadata_filters:
             return results
             
@@ -95,8 +119,8 @@ class RAGQuerier:
             if metadata_filters:
                 self.logger.info(f"Applying metadata filters: {metadata_filters}")
             
-            # Perform search and filter results
-            results = self.rag_model.search(query, k=k)
+            # Restrict the search to chunks matching the filters, then double check
+            results = search_with_filters(self.rag_model, query, k, metadata_filters, self.metadata_index)
             filtered_results = self._filter_by_metadata(results, metadata_filters)
             
             # Display results
@@ -127,13 +151,38 @@ class RAGQuerier:
 
 def main():
     parser = argparse.ArgumentParser(description='Query RAG index with metadata filtering')
-    parser.add_argument('index_path', help='Path to the index directory')
+    parser.add_argument('index_path', nargs='?', help='Path to the index directory')
     parser.add_argument('--k', type=int, default=10, help='Number of results to retrieve (default: 10)')
+    parser.add_argument('--server', default=None,
+                      help='URL of a running rag_server.py (http://host:port or unix:///path) to use instead of loading the index')
+    parser.add_argument('--dense_only', action='store_true',
+                      help='Search with ColBERT only instead of fusing it with BM25')
+    parser.add_argument('--dense_weight', type=float, default=DENSE_WEIGHT,
+                      help=f'Rank fusion weight of ColBERT results (default: {DENSE_WEIGHT})')
+    parser.add_argument('--sparse_weight', type=float, default=SPARSE_WEIGHT,
+                      help=f'Rank fusion weight of BM25 results (default: {SPARSE_WEIGHT})')
+    parser.add_argument('--bm25_prune_k', type=int, default=None,
+                      help='Only let ColBERT score the top N BM25 candidates (default: score every chunk)')
+    parser.add_argument('--quantized', action='store_true',
+                      help='Search the memory-mapped int8 index built with rag_indexer.py --quantize')
+    parser.add_argument('--sharded', action='store_true',
+                      help='Search the index shards built with rag_indexer.py --shards N in parallel worker processes')
     
     args = parser.parse_args()
+    if not args.index_path and not args.server:
+        parser.error('either index_path or --server is required')
     
     try:
-        querier = RAGQuerier(args.index_path)
+        querier = RAGQuerier(
+            args.index_path,
+            server_url=args.server,
+            hybrid=not args.dense_only,
+            dense_weight=args.dense_weight,
+            sparse_weight=args.sparse_weight,
+            bm25_prune_k=args.bm25_prune_k,
+            quantized=args.quantized,
+            sharded=args.sharded
+        )
         querier.search(k=args.k)
         
     except KeyboardInterrupt:
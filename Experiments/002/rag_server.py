@@ -0,0 +1,226 @@
+# Start using: python rag_server.py .ragatouille/colbert/indexes/Experiment_002 --port 8765
+# Or on a Unix socket: python rag_server.py .ragatouille/colbert/indexes/Experiment_002 --socket /tmp/rag.sock
+# Then point the CLIs at it, e.g.: python rag_querier.py --server http://127.0.0.1:8765
+# Prometheus can scrape per-stage latency percentiles from /metrics
+
+import os
+import json
+import argparse
+import logging
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from socketserver import ThreadingMixIn, UnixStreamServer
+from typing import Dict, List, Optional
+from generate_rag_response_002 import RAGResponseGenerator
+from rag_utils import (
+    HybridSearchModel, MetadataIndex, batched_search, batched_search_with_filters, filter_by_metadata,
+    search_with_filters, POST_FILTER_DEPTH
+)
+from tracing import configure_tracing, tracer
+
+class UnixHTTPServer(ThreadingMixIn, UnixStreamServer):
+    """Threaded HTTP server listening on a Unix domain socket"""
+    daemon_threads = True
+
+class _LockedSearchModel:
+    """Serializes search calls on a shared RAG model; ColBERT searchers are not thread-safe"""
+
+    def __init__(self, rag_model, lock: threading.Lock):
+        self._rag_model = rag_model
+        self._lock = lock
+
+    def search(self, *args, **kwargs):
+        with self._lock:
+            return self._rag_model.search(*args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self._rag_model, name)
+
+class RAGServer:
+    def __init__(self, index_path: str, quantized: bool = False, sharded: bool = False):
+        """Load the index once and keep it resident for all requests (memory-mapped when quantized)"""
+        self.logger = self._setup_logger()
+        self.generator = RAGResponseGenerator(index_path, quantized=quantized, sharded=sharded)
+        self.index_path = self.generator.index_path
+        self.search_lock = threading.Lock()
+        # Lock only the underlying model so cache hits don't queue behind running searches
+        self.rag_model = self.generator.rag_model
+        searcher_owner = self.rag_model.rag_model if isinstance(self.rag_model.rag_model, HybridSearchModel) \
+            else self.rag_model
+        # Sharded search runs in worker processes and takes concurrent requests without a lock
+        if not getattr(searcher_owner.rag_model, 'thread_safe', False):
+            searcher_owner.rag_model = _LockedSearchModel(searcher_owner.rag_model, self.search_lock)
+        self.metadata_index = MetadataIndex.load(self.index_path)
+
+    def _setup_logger(self) -> logging.Logger:
+        """Configure and return a logger instance"""
+        logger = logging.getLogger(__name__)
+        logger.setLevel(logging.INFO)
+
+        if not logger.handlers:
+            console_handler = logging.StreamHandler()
+            formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+            console_handler.setFormatter(formatter)
+            logger.addHandler(console_handler)
+
+        return logger
+
+    def search(self, query: str, k: int = 10, metadata_filters: Optional[Dict[str, str]] = None,
+               doc_ids: Optional[List[str]] = None) -> List[Dict]:
+        """Search the resident index for a single query, restricted to chunks matching the filters and among doc_ids"""
+        with tracer.trace("search_request", k=k, filtered=bool(metadata_filters) or doc_ids is not None):
+            if doc_ids is not None:
+                return self._search_doc_ids([query], k, metadata_filters, doc_ids)[0]
+            return search_with_filters(self.rag_model, query, k, metadata_filters, self.metadata_index)
+
+    def search_batch(self, queries: List[str], k: int = 10, metadata_filters: Optional[Dict[str, str]] = None,
+                     doc_ids: Optional[List[str]] = None) -> List[List[Dict]]:
+        """Search the resident index for several queries at once, all restricted like search()"""
+        with tracer.trace("search_batch_request", k=k, queries=len(queries),
+                          filtered=bool(metadata_filters) or doc_ids is not None):
+            if doc_ids is not None:
+                return self._search_doc_ids(queries, k, metadata_filters, doc_ids)
+            return batched_search_with_filters(self.rag_model, queries, k, metadata_filters, self.metadata_index)
+
+    def _search_doc_ids(self, queries: List[str], k: int, metadata_filters: Optional[Dict[str, str]],
+                        doc_ids: List[str]) -> List[List[Dict]]:
+        """Search only doc_ids, narrowed to the chunks matching the filters"""
+        if metadata_filters and self.metadata_index is not None:
+            matching_ids = set(self.metadata_index.candidates(metadata_filters))
+            doc_ids = [chunk_id for chunk_id in doc_ids if chunk_id in matching_ids]
+            metadata_filters = None
+        if not doc_ids:
+            return [[] for _ in queries]
+        if not metadata_filters:
+            return batched_search(self.rag_model, queries, k=k, doc_ids=doc_ids)
+        return [
+            filter_by_metadata(results, metadata_filters)[:k]
+            for results in batched_search(self.rag_model, queries, k=k * POST_FILTER_DEPTH, doc_ids=doc_ids)
+        ]
+
+    def answer(self, query: str, k: int = 10) -> Optional[Dict]:
+        """Run retrieval and LLM answer generation for a query"""
+        return self.generator.process_query(query, k=k)
+
+    def health(self) -> Dict:
+        return {"status": "ok", "index_path": str(self.index_path), "cache": self.rag_model.cache_stats()}
+
+    def make_handler(self):
+        """Build a request handler class bound to this server"""
+        rag_server = self
+
+        class RAGRequestHandler(BaseHTTPRequestHandler):
+            def _send_json(self, status: int, payload: Dict):
+                body = json.dumps(payload, default=float).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _read_json(self) -> Dict:
+                length = int(self.headers.get('Content-Length', 0))
+                return json.loads(self.rfile.read(length).decode('utf-8')) if length else {}
+
+            def do_GET(self):
+                if self.path == '/health':
+                    self._send_json(200, rag_server.health())
+                elif self.path == '/metrics':
+                    body = tracer.prometheus_text().encode('utf-8')
+                    self.send_response(200)
+                    self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                    self.send_header('Content-Length', str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+                else:
+                    self._send_json(404, {"error": f"Unknown endpoint {self.path}"})
+
+            def do_POST(self):
+                try:
+                    payload = self._read_json()
+                    k = int(payload.get('k', 10))
+
+                    if self.path == '/search':
+                        response = {"results": rag_server.search(
+                            payload['query'], k=k, metadata_filters=payload.get('metadata_filters'),
+                            doc_ids=payload.get('doc_ids')
+                        )}
+                    elif self.path == '/search_batch':
+                        response = {"results": rag_server.search_batch(
+                            payload['queries'], k=k, metadata_filters=payload.get('metadata_filters'),
+                            doc_ids=payload.get('doc_ids')
+                        )}
+                    elif self.path == '/answer':
+                        response = {"response": rag_server.answer(payload['query'], k=k)}
+                    else:
+                        self._send_json(404, {"error": f"Unknown endpoint {self.path}"})
+                        return
+
+                    self._send_json(200, response)
+
+                except (KeyError, ValueError) as e:
+                    self._send_json(400, {"error": f"Bad request: {str(e)}"})
+                except Exception as e:
+                    rag_server.logger.error(f"Error handling {self.path}: {str(e)}")
+                    self._send_json(500, {"error": str(e)})
+
+            def address_string(self) -> str:
+                # Unix socket clients have no (host, port) address
+                return self.client_address[0] if isinstance(self.client_address, tuple) else 'unix'
+
+            def log_message(self, format, *args):
+                rag_server.logger.debug(f"{self.address_string()} - {format % args}")
+
+        return RAGRequestHandler
+
+    def serve(self, host: str = '127.0.0.1', port: int = 8765, socket_path: Optional[str] = None):
+        """Serve requests until interrupted"""
+        handler = self.make_handler()
+
+        if socket_path:
+            if os.path.exists(socket_path):
+                os.remove(socket_path)
+            httpd = UnixHTTPServer(socket_path, handler)
+            self.logger.info(f"RAG server listening on unix://{socket_path}")
+        else:
+            httpd = ThreadingHTTPServer((host, port), handler)
+            self.logger.info(f"RAG server listening on http://{host}:{port}")
+
+        try:
+            httpd.serve_forever()
+        finally:
+            httpd.server_close()
+            if socket_path and os.path.exists(socket_path):
+                os.remove(socket_path)
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve a RAG index over local HTTP or a Unix socket')
+    parser.add_argument('index_path', help='Path to the RAG index directory')
+    parser.add_argument('--host', default='127.0.0.1', help='Host to bind (default: 127.0.0.1)')
+    parser.add_argument('--port', type=int, default=8765, help='Port to bind (default: 8765)')
+    parser.add_argument('--socket', default=None, help='Serve on this Unix socket path instead of TCP')
+    parser.add_argument('--trace_log', default=None,
+                      help='Append a JSONL trace with per-stage spans for every request to this file')
+    parser.add_argument('--quantized', action='store_true',
+                      help='Serve the memory-mapped int8 index built with rag_indexer.py --quantize; '
+                           'servers on one host then share a single copy of the index in the page cache')
+    parser.add_argument('--sharded', action='store_true',
+                      help='Serve the index shards built with rag_indexer.py --shards N, '
+                           'each searched by its own worker process so requests use every core')
+
+    args = parser.parse_args()
+
+    try:
+        configure_tracing(args.trace_log)
+        server = RAGServer(args.index_path, quantized=args.quantized, sharded=args.sharded)
+        server.serve(args.host, args.port, args.socket)
+    except KeyboardInterrupt:
+        print("\n\nServer stopped by user. Exiting...")
+        sys.exit(0)
+    except Exception as e:
+        print(f"\nServer failed: {str(e)}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -3,15 +3,26 @@
 ### Implement guardrails to make sure response is safe and does not contain offensive content
 
 # To run: python rag_system_002.py .ragatouille/colbert/indexes/Experiment_002
+# Or against a running rag_server.py: python rag_system_002.py --server http://127.0.0.1:8765
+# Add --stream to print answers as they are generated
+# Add --async_session to search while the filters are entered and take the next query while an answer is generated
 
-from ragatouille import RAGPretrainedModel
+from rag_client import RAGServiceClient
+from rag_utils import MetadataIndex, load_search_model, search_with_filters, DENSE_WEIGHT, SPARSE_WEIGHT
+from reranker import CrossEncoderReranker, RERANK_CANDIDATES
+from context_packer import ContextPacker, CONTEXT_TOKEN_BUDGET
+from tracing import Trace, configure_tracing, instrument_instructor, record_token_usage, tracer
 from openai import OpenAI
 import instructor
-from pydantic import BaseModel, Field, field_validator, ValidationInfo
-from typing import Optional, Dict, List, Annotated
+from pydantic import BaseModel, Field, field_validator, ValidationInfo, ValidationError
+from typing import Optional, Dict, List, Tuple, Annotated
+from concurrent.futures import Future, ThreadPoolExecutor
 import argparse
+import asyncio
 import logging
 import sys
+import threading
+import time
 from pathlib import Path
 import os
 from dotenv import load_dotenv
@@ -19,9 +30,18 @@ from dotenv import load_dotenv
 # Load environment variables
 load_dotenv()
 OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
+HEADER_FILTERS = [("Header 1", "Header 1"), ("Header 2", "Header 2"), ("Header 3", "Header 3"),
+                  ("Header 4", "Header 4"), ("Header 5", "Header 5")]  # (prompt name, metadata field)
+QUIT_COMMANDS = ('q', 'quit', 'exit')  # End an async session at the query prompt
 
-class AnswerWithCitation(BaseModel):
-    """Validates and structures the final response with citations."""
+def _read_stdin_lines(loop: asyncio.AbstractEventLoop, lines: asyncio.Queue):
+    """Reader thread of an async session: hand every stdin line to the event loop, then None at EOF"""
+    for line in sys.stdin:
+        loop.call_soon_threadsafe(lines.put_nowait, line.rstrip('\n'))
+    loop.call_soon_threadsafe(lines.put_nowait, None)
+
+class AnswerDraft(BaseModel):
+    """Structures the response with citations."""
     is_relevant: bool = Field(
         description='Whether the query is relevant to the provided context. If not relevant, return False.'
     )
@@ -37,6 +57,9 @@ class AnswerWithCitation(BaseModel):
         description="Citation mapping chunk ids to their content. Must include all relevant chunks."
     )
 
+class AnswerWithCitation(AnswerDraft):
+    """Validates and structures the final response with citations."""
+
     @field_validator('is_relevant', 'answer', 'citation')
     def validate_response(cls, v, info: ValidationInfo):
         if info.field_name == 'answer':
@@ -52,12 +75,47 @@ class AnswerWithCitation(BaseModel):
         return v
 
 class RAGSystem:
-    def __init__(self, index_path: str):
-        """Initialize the RAG system."""
+    def __init__(
+        self,
+        index_path: Optional[str] = None,
+        server_url: Optional[str] = None,
+        hybrid: bool = True,
+        dense_weight: float = DENSE_WEIGHT,
+        sparse_weight: float = SPARSE_WEIGHT,
+        bm25_prune_k: Optional[int] = None,
+        quantized: bool = False,
+        sharded: bool = False,
+        rerank_candidates: Optional[int] = None,
+        rerank_budget_ms: Optional[float] = None,
+        metrics_file: Optional[str] = None,
+        stream: bool = False,
+        context_token_budget: Optional[int] = CONTEXT_TOKEN_BUDGET
+    ):
+        """
+        Initialize the RAG system (hybrid ColBERT + BM25 retrieval unless hybrid is False).
+        
+        With rerank_candidates set, that many candidates are retrieved and reranked
+        with a cross-encoder within rerank_budget_ms before the top k go to the LLM.
+        Per-stage latency percentiles are written to metrics_file after every query.
+        Retrieved chunks are packed into context_token_budget tokens (None sends
+        every chunk in full). With stream set, the answer is printed as it is generated and the
+        citations are validated once the stream closes.
+        """
         self.logger = self._setup_logger()
-        self.index_path = Path(index_path).resolve()
+        self.index_path = Path(index_path).resolve() if index_path else None
+        self.server_url = server_url
+        self.retrieval_options = dict(
+            hybrid=hybrid, dense_weight=dense_weight, sparse_weight=sparse_weight, bm25_prune_k=bm25_prune_k,
+            quantized=quantized, sharded=sharded
+        )
         self.rag_model = None
-        self.client = instructor.from_openai(OpenAI(api_key=OPENAI_API_KEY))
+        self.metadata_index = None
+        self.client = instrument_instructor(instructor.from_openai(OpenAI(api_key=OPENAI_API_KEY)))
+        self.metrics_file = metrics_file
+        self.stream = stream
+        self.rerank_candidates = rerank_candidates
+        self.reranker = CrossEncoderReranker(latency_budget_ms=rerank_budget_ms) if rerank_candidates else None
+        self.context_packer = ContextPacker(context_token_budget) if context_token_budget else None
         self._load_model()
 
     def _setup_logger(self) -> logging.Logger:
@@ -75,9 +133,15 @@ class RAGSystem:
 
     def _load_model(self):
         """Load the RAG model from the index."""
+        if self.server_url:
+            self.rag_model = RAGServiceClient(self.server_url)
+            self.logger.info(f"Using RAG server at {self.server_url}")
+            return
+
         self.logger.info(f"Loading RAG model from index at {self.index_path}")
         try:
-            self.rag_model = RAGPretrainedModel.from_index(str(self.index_path))
+            self.rag_model = load_search_model(self.index_path, logger=self.logger, **self.retrieval_options)
+            self.metadata_index = MetadataIndex.load(self.index_path)
             self.logger.info("Successfully loaded RAG model")
         except Exception as e:
             self.logger.error(f"Error loading model from index: {str(e)}")
@@ -97,21 +161,101 @@ class RAGSystem:
         metadata_filters = {}
         
         # Get metadata filters
-        headers = [
-            ("Header 1", "Header 1"),
-            ("Header 2", "Header 2"),
-            ("Header 3", "Header 3"),
-            ("Header 4", "Header 4"),
-            ("Header 5", "Header 5")
-        ]
-        
-        for display_name, field_name in headers:
+        for display_name, field_name in HEADER_FILTERS:
             value = input(f"Enter {display_name}: ").strip()
             if value:
                 metadata_filters[field_name] = value
                 
         return query, metadata_filters
 
+    async def _prompt(self, lines: asyncio.Queue, prompt: str,
+                      answering: Optional[asyncio.Task] = None) -> Optional[str]:
+        """
+        Show a prompt and wait for the next stdin line without blocking the event loop (None at EOF)
+        
+        While an answer is still being printed the prompt is held back until it
+        finishes, so the two never interleave. A line typed ahead in the meantime
+        is returned straight away, without showing the prompt it answers.
+        """
+        line = asyncio.ensure_future(lines.get())
+        if answering is not None and not answering.done():
+            await asyncio.wait([line, answering], return_when=asyncio.FIRST_COMPLETED)
+        if not line.done():
+            print(prompt, end="", flush=True)
+        line = await line
+        return line.strip() if line is not None else None
+
+    async def get_user_input_async(
+        self, lines: asyncio.Queue, retrieval_executor: ThreadPoolExecutor, k: int = 10,
+        answering: Optional[asyncio.Task] = None
+    ) -> Optional[Tuple[str, Dict, Future]]:
+        """
+        Get query and metadata filters like get_user_input, retrieving while the filters are entered.
+        
+        Retrieval starts as soon as the query is entered and is resubmitted
+        whenever a filter is set, so the search for the final filters is already
+        running, or done, by the time the last filter prompt is answered.
+        Superseded searches that have not started yet are cancelled. Each search
+        captures its spans for process_query to add to the query's trace.
+        
+        Returns:
+            Query, metadata filters and the future of its retrieval, or None once the user quits
+        """
+        query_prompt = "\n=== RAG Query System ===\n\nEnter your search query (q to quit): "
+        query = await self._prompt(lines, query_prompt, answering)
+        while query == "":
+            query = await self._prompt(lines, "Query cannot be empty. Please try again.\n" + query_prompt, answering)
+        if query is None or query.lower() in QUIT_COMMANDS:
+            return None
+        retrieval = retrieval_executor.submit(self.capture_retrieval, query, {}, k)
+        
+        metadata_filters = {}
+        for position, (display_name, field_name) in enumerate(HEADER_FILTERS):
+            prompt = f"Enter {display_name}: "
+            if position == 0:
+                prompt = "\nEnter metadata filters (press Enter to skip):\n" + prompt
+            value = await self._prompt(lines, prompt, answering)
+            if value is None:
+                break
+            if value:
+                metadata_filters[field_name] = value
+                retrieval.cancel()
+                retrieval = retrieval_executor.submit(self.capture_retrieval, query, dict(metadata_filters), k)
+        
+        return query, metadata_filters, retrieval
+
+    async def run_session(self, k: int = 10):
+        """
+        Interactive session that overlaps retrieval and generation with the user's typing.
+        
+        Each query is searched while its filters are being entered, and its answer
+        is generated, and streamed with --stream, in a worker thread while the next
+        query is read, so only the retrieval time left after the last filter prompt
+        is spent waiting. Answers are still produced one at a time, in query order.
+        Prompts wait for the answer being printed, but lines typed meanwhile are
+        read and searched at once. Retrievals run one at a time on their own
+        thread, as the searchers are not thread-safe.
+        """
+        loop = asyncio.get_running_loop()
+        lines = asyncio.Queue()
+        # A daemon thread rather than the default executor, so a pending read never blocks exiting
+        threading.Thread(target=_read_stdin_lines, args=(loop, lines), daemon=True).start()
+        retrieval_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="retrieval")
+        answering = None
+        try:
+            while True:
+                user_input = await self.get_user_input_async(lines, retrieval_executor, k, answering)
+                if answering is not None:
+                    await answering
+                if user_input is None:
+                    break
+                query, metadata_filters, retrieval = user_input
+                answering = asyncio.create_task(
+                    asyncio.to_thread(self.process_query, query, metadata_filters, k, retrieval)
+                )
+        finally:
+            retrieval_executor.shutdown(wait=False, cancel_futures=True)
+
     def format_context(self, results: List[Dict]) -> str:
         """Format retrieved results into context string."""
         formatted_chunks = []
@@ -140,35 +284,142 @@ class RAGSystem:
             }
         ]
 
-    def process_query(self, query: str, metadata_filters: Dict, k: int = 10):
-        """Process a query through the RAG system."""
-        try:
-            # Search for relevant documents
-            self.logger.info(f"Searching with query: '{query}'")
-            results = self.rag_model.search(query, k=k)
-            
-            # Format context
-            context = self.format_context(results)
-            
-            # Create messages for LLM
-            messages = self.create_messages(query, context)
-            
-            # Get response from LLM
+    def stream_answer(self, messages: List[Dict]) -> AnswerWithCitation:
+        """
+        Print the answer as the LLM generates it, then validate the complete response.
+        
+        The partial responses are parsed without the AnswerWithCitation validators,
+        which only hold for a finished answer. If the finished answer fails them, it
+        is regenerated without streaming, with retries, and reprinted.
+        """
+        printed = 0
+        draft = None
+        start = time.perf_counter()
+        with tracer.span("llm_completion", streamed=True):
+            for draft in self.client.chat.completions.create_partial(
+                response_model=AnswerDraft,
+                model="gpt-4o",
+                messages=messages,
+                max_retries=3,
+                stream_options={"include_usage": True}  # Token usage for the llm_*_tokens counters
+            ):
+                answer = draft.answer or ""
+                if len(answer) > printed:
+                    if not printed:
+                        tracer.record("llm_first_token", (time.perf_counter() - start) * 1000)
+                        print("\n=== Response ===")
+                        print("\nAnswer: ", end="")
+                    print(answer[printed:], end="", flush=True)
+                    printed = len(answer)
+        print()
+        
+        with tracer.span("citation_validation"):
+            try:
+                return AnswerWithCitation.model_validate(draft.model_dump() if draft else {})
+            except ValidationError as e:
+                self.logger.warning(f"Streamed answer failed validation, regenerating: {str(e)}")
+        
+        with tracer.span("llm_completion", streamed=False):
             response = self.client.chat.completions.create(
                 response_model=AnswerWithCitation,
                 model="gpt-4o",
                 messages=messages,
                 max_retries=3
             )
+        record_token_usage(response)
+        print(f"\nRevised answer: {response.answer}")
+        return response
+
+    def retrieve(self, query: str, metadata_filters: Dict, k: int = 10) -> List[Dict]:
+        """Search for the chunks matching a query and its filters, reranked down to k if reranking."""
+        self.logger.info(f"Searching with query: '{query}'")
+        if metadata_filters:
+            self.logger.info(f"Applying metadata filters: {metadata_filters}")
+        depth = max(k, self.rerank_candidates) if self.reranker else k
+        with tracer.span("retrieval"):
+            results = search_with_filters(self.rag_model, query, depth, metadata_filters, self.metadata_index)
+        
+        # Rescore the over-retrieved candidates and keep the best k
+        if self.reranker:
+            with tracer.span("rerank") as span:
+                results, rerank_stats = self.reranker.rerank(query, results, k=k)
+                span.attributes.update(rerank_stats)
+            self.logger.info(
+                f"Reranked {rerank_stats['scored']}/{rerank_stats['candidates']} candidates "
+                f"({rerank_stats['stop_reason']})"
+            )
+        return results
+
+    def capture_retrieval(self, query: str, metadata_filters: Dict, k: int = 10) -> Tuple[List[Dict], Trace]:
+        """Retrieve outside any query trace, returning the results with the spans captured while searching."""
+        with tracer.capture("retrieval") as captured:
+            results = self.retrieve(query, metadata_filters, k)
+        return results, captured
+
+    def process_query(self, query: str, metadata_filters: Dict, k: int = 10, retrieval: Optional[Future] = None):
+        """
+        Process a query through the RAG system.
+        
+        A retrieval already started with capture_retrieval for the query and filters
+        is awaited instead of searching again; the trace records the time left
+        waiting for it alongside the spans of the search itself.
+        """
+        try:
+            with tracer.trace("rag_query", k=k, filtered=bool(metadata_filters)) as trace:
+                # Search for relevant documents
+                if retrieval is not None:
+                    with tracer.span("retrieval_wait"):
+                        results, retrieval_trace = retrieval.result()
+                    tracer.attach(retrieval_trace)
+                else:
+                    results = self.retrieve(query, metadata_filters, k)
+                
+                with tracer.span("context_formatting"):
+                    # Format context, fitting it into the token budget
+                    packing_stats = None
+                    if self.context_packer:
+                        context, packing_stats = self.context_packer.pack(results)
+                        tracer.increment("context_tokens_saved", packing_stats["tokens_saved"])
+                    else:
+                        context = self.format_context(results)
+                    
+                    # Create messages for LLM
+                    messages = self.create_messages(query, context)
+                
+                # Get response from LLM
+                if self.stream:
+                    response = self.stream_answer(messages)
+                else:
+                    with tracer.span("llm_completion"):
+                        response = self.client.chat.completions.create(
+                            response_model=AnswerWithCitation,
+                            model="gpt-4o",
+                            messages=messages,
+                            max_retries=3
+                        )
+                    record_token_usage(response)
+                timings = trace.timings()
             
             # Display results
-            print("\n=== Response ===")
-            print(f"\nAnswer: {response.answer}")
+            if not self.stream:
+                print("\n=== Response ===")
+                print(f"\nAnswer: {response.answer}")
             
             if response.citation:
                 print("\nCitations:")
                 for chunk_id, content in response.citation.items():
                     print(f"\n{chunk_id}: {content}")
+            
+            if packing_stats:
+                print(
+                    f"\nContext: {packing_stats['packed']}/{packing_stats['chunks']} chunks, "
+                    f"{packing_stats['context_tokens']} tokens ({packing_stats['tokens_saved']} saved, "
+                    f"{packing_stats['truncated']} truncated, {packing_stats['dropped']} dropped, "
+                    f"{packing_stats['duplicates']} duplicates)"
+                )
+            print("\nTimings: " + ", ".join(f"{stage[:-3]} {ms} ms" for stage, ms in timings.items()))
+            if self.metrics_file:
+                tracer.write_prometheus(self.metrics_file)
                     
         except Exception as e:
             self.logger.error(f"Error processing query: {str(e)}")
@@ -176,12 +427,67 @@ class RAGSystem:
 
 def main():
     parser = argparse.ArgumentParser(description='RAG System with LLM integration')
-    parser.add_argument('index_path', help='Path to the RAG index directory')
+    parser.add_argument('index_path', nargs='?', help='Path to the RAG index directory')
+    parser.add_argument('--server', default=None,
+                      help='URL of a running rag_server.py (http://host:port or unix:///path) to use instead of loading the index')
+    parser.add_argument('--dense_only', action='store_true',
+                      help='Search with ColBERT only instead of fusing it with BM25')
+    parser.add_argument('--dense_weight', type=float, default=DENSE_WEIGHT,
+                      help=f'Rank fusion weight of ColBERT results (default: {DENSE_WEIGHT})')
+    parser.add_argument('--sparse_weight', type=float, default=SPARSE_WEIGHT,
+                      help=f'Rank fusion weight of BM25 results (default: {SPARSE_WEIGHT})')
+    parser.add_argument('--bm25_prune_k', type=int, default=None,
+                      help='Only let ColBERT score the top N BM25 candidates (default: score every chunk)')
+    parser.add_argument('--quantized', action='store_true',
+                      help='Search the memory-mapped int8 index built with rag_indexer.py --quantize')
+    parser.add_argument('--sharded', action='store_true',
+                      help='Search the index shards built with rag_indexer.py --shards N in parallel worker processes')
+    parser.add_argument('--rerank_candidates', type=int, nargs='?', const=RERANK_CANDIDATES, default=None,
+                      help=f'Over-retrieve this many candidates (default when given: {RERANK_CANDIDATES}) and rerank them with a cross-encoder')
+    parser.add_argument('--rerank_budget_ms', type=float, default=None,
+                      help='Latency budget for reranking; remaining candidates keep their retrieval order (default: none)')
+    
+    parser.add_argument('--trace_log', default=None,
+                      help='Append a JSONL trace with per-stage spans for every query to this file')
+    parser.add_argument('--metrics_file', default=None,
+                      help='Write per-stage latency percentiles and counters here in Prometheus text format')
+    parser.add_argument('--context_tokens', type=int, default=CONTEXT_TOKEN_BUDGET,
+                      help=f'Token budget for the retrieved context sent to the LLM (default: {CONTEXT_TOKEN_BUDGET})')
+    parser.add_argument('--no_context_packing', action='store_true',
+                      help='Send every retrieved chunk in full instead of packing them into the token budget')
+    parser.add_argument('--stream', action='store_true',
+                      help='Print the answer as it is generated; citations are validated and shown when it completes')
+    parser.add_argument('--async_session', action='store_true',
+                      help='Search while the filters are entered and take the next query while the answer is generated')
     
     args = parser.parse_args()
+    if not args.index_path and not args.server:
+        parser.error('either index_path or --server is required')
     
     try:
-        rag_system = RAGSystem(args.index_path)
+        configure_tracing(args.trace_log)
+        rag_system = RAGSystem(
+            args.index_path,
+            server_url=args.server,
+            hybrid=not args.dense_only,
+            dense_weight=args.dense_weight,
+            sparse_weight=args.sparse_weight,
+            bm25_prune_k=args.bm25_prune_k,
+            quantized=args.quantized,
+            sharded=args.sharded,
+            rerank_candidates=args.rerank_candidates,
+            rerank_budget_ms=args.rerank_budget_ms,
+            metrics_file=args.metrics_file,
+            stream=args.stream,
+            context_token_budget=None if args.no_context_packing else args.context_tokens
+        )
+        if args.async_session:
+            try:
+                asyncio.run(rag_system.run_session())
+            except KeyboardInterrupt:
+                print("\n\nSearch interrupted by user.")
+            return
+        
         while True:
             try:
                 query, metadata_filters = rag_system.get_user_input()
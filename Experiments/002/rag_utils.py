@@ -1,14 +1,41 @@
+import contextvars
+import functools
+import hashlib
 import json
 import logging
+import threading
+import warnings
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import List, Dict, Optional
+from typing import Any, List, Dict, Optional, Iterator, Tuple, Union
 from ragatouille import RAGPretrainedModel
+from chunk_store import iter_chunk_records, resolve_chunks_path
+from bm25_index import BM25Index, BM25_INDEX_FILE
+from quantized_index import (
+    QuantizedIndex, QuantizedIndexWriter, QuantizedSearchModel, colbert_document_encoder, colbert_query_encoder,
+    QUANTIZED_INDEX_DIR
+)
+from sharded_search import ShardedSearchModel, load_shard_manifest, save_shard_manifest, shard_index_name, shard_of
+from tracing import tracer
 
 # Configuration
 BASE_EXPERIMENTS_PATH = "Experiments"
 MODEL_NAME = "colbert-ir/colbertv2.0" #modernBERT_text_similarity_finetune or colbert-ir/colbertv2.0
 LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
 LOG_LEVEL = "INFO"
+CHUNK_BATCH_SIZE = 2000  # Number of chunks read or encoded at a time
+INDEX_ROOT = ".ragatouille/colbert/indexes"  # Where RAGatouille writes its indexes
+CHUNK_MANIFEST_FILE = "chunk_manifest.json"  # chunk_id -> content hash, stored in the index directory
+METADATA_INDEX_FILE = "metadata_index.json"  # metadata field -> value -> chunk_ids, stored in the index directory
+SEARCH_BATCH_SIZE = 32  # Number of queries encoded and scored together in batched search
+POST_FILTER_DEPTH = 10  # Results searched per requested hit when filters can only be applied after the search
+QUERY_EMBEDDING_CACHE_SIZE = 512  # Query token embeddings kept in memory (about 16KB each for colbertv2.0)
+SEARCH_RESULT_CACHE_SIZE = 2048  # Result lists kept in memory per (query, k, filters, index version)
+DENSE_WEIGHT = 1.0  # Weight of the ColBERT ranking in reciprocal rank fusion
+SPARSE_WEIGHT = 1.0  # Weight of the BM25 ranking in reciprocal rank fusion
+RRF_K = 60  # Rank offset in reciprocal rank fusion; larger values flatten the contribution of top ranks
+FUSION_DEPTH = 50  # Hits taken from each retriever before fusing
 
 def setup_logger(name):
     """Configure and return a logger instance"""
@@ -23,15 +50,518 @@ def setup_logger(name):
         logger.addHandler(console_handler)
     return logger
 
+def chunk_fingerprint(content: str, metadata: Dict) -> str:
+    """Return a stable content hash for a chunk's text and metadata"""
+    payload = json.dumps({'content': content, 'metadata': metadata}, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+class MetadataIndex:
+    """Inverted index from metadata field values to the chunk ids carrying them"""
+
+    def __init__(self, postings: Optional[Dict[str, Dict[str, List[str]]]] = None):
+        self.postings = postings or {}
+
+    def add(self, chunk_id: str, metadata: Dict):
+        """Record the string-valued metadata fields of a chunk"""
+        for field, value in metadata.items():
+            if isinstance(value, str):
+                self.postings.setdefault(field, {}).setdefault(value, []).append(chunk_id)
+
+    def candidates(self, metadata_filters: Dict[str, str]) -> List[str]:
+        """Return the ids of chunks matching every filter, in index order"""
+        candidate_ids = None
+        for field, value in metadata_filters.items():
+            matching_ids = self.postings.get(field, {}).get(value, [])
+            if candidate_ids is None:
+                candidate_ids = matching_ids
+            else:
+                matching_set = set(matching_ids)
+                candidate_ids = [chunk_id for chunk_id in candidate_ids if chunk_id in matching_set]
+            if not candidate_ids:
+                return []
+        return list(candidate_ids or [])
+
+    def save(self, path: Path):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.postings, f, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, index_path: Path) -> Optional["MetadataIndex"]:
+        """Load the metadata index stored in an index directory, if it has one"""
+        metadata_index_path = Path(index_path) / METADATA_INDEX_FILE
+        if not metadata_index_path.exists():
+            return None
+        with open(metadata_index_path, 'r', encoding='utf-8') as f:
+            return cls(json.load(f))
+
+def search_with_filters(rag_model, query: str, k: int = 10,
+                        metadata_filters: Optional[Dict[str, str]] = None,
+                        metadata_index: Optional[MetadataIndex] = None) -> List[Dict]:
+    """
+    Search only the chunks whose metadata matches every filter
+
+    The candidate chunk ids are looked up in the metadata index and passed to
+    the search as doc_ids, so filtering happens before scoring and returns up
+    to k matching hits.
+
+    Args:
+        rag_model: RAGPretrainedModel or anything exposing the same search() call
+        query: Search query
+        k: Number of results to return
+        metadata_filters: Metadata field -> required value
+        metadata_index: Metadata index of the searched index
+
+    Returns:
+        List of search results
+    """
+    if not metadata_filters:
+        return rag_model.search(query, k=k)
+
+    if metadata_index is not None:
+        candidate_ids = metadata_index.candidates(metadata_filters)
+        if not candidate_ids:
+            return []
+        return rag_model.search(query, k=k, doc_ids=candidate_ids)
+
+    # Remote models resolve the filters against their own metadata index
+    if getattr(rag_model, 'supports_metadata_filters', False):
+        return rag_model.search(query, k=k, metadata_filters=metadata_filters)
+
+    return filter_by_metadata(rag_model.search(query, k=k * POST_FILTER_DEPTH), metadata_filters)[:k]
+
+def batched_search_with_filters(rag_model, queries: List[str], k: int = 10,
+                                metadata_filters: Optional[Dict[str, str]] = None,
+                                metadata_index: Optional[MetadataIndex] = None) -> List[List[Dict]]:
+    """Batched search of several queries, all restricted to the chunks matching the filters like search_with_filters"""
+    if not metadata_filters:
+        return batched_search(rag_model, queries, k=k)
+
+    if metadata_index is not None:
+        candidate_ids = metadata_index.candidates(metadata_filters)
+        if not candidate_ids:
+            return [[] for _ in queries]
+        return batched_search(rag_model, queries, k=k, doc_ids=candidate_ids)
+
+    if getattr(rag_model, 'supports_metadata_filters', False):
+        return batched_search(rag_model, queries, k=k, metadata_filters=metadata_filters)
+
+    return [
+        filter_by_metadata(results, metadata_filters)[:k]
+        for results in batched_search(rag_model, queries, k=k * POST_FILTER_DEPTH)
+    ]
+
+def filter_by_metadata(results: List[Dict], metadata_filters: Dict[str, str]) -> List[Dict]:
+    """
+    Keep the results whose metadata matches every filter
+
+    Fallback for indexes built without a metadata index: filtering after the
+    search can return fewer than k hits, so callers search deeper first. The
+    rebuild hint is a warning, shown once per calling line rather than per query.
+    """
+    warnings.warn(
+        "Index has no metadata index, filtering search results after retrieval; rebuild the index to pre-filter",
+        stacklevel=2
+    )
+    return [
+        result for result in results
+        if all(result.get('document_metadata', {}).get(key) == value for key, value in metadata_filters.items())
+    ]
+
+def batched_search(rag_model, queries: List[str], k: int = 10,
+                   batch_size: int = SEARCH_BATCH_SIZE, **search_kwargs) -> List[List[Dict]]:
+    """
+    Search many queries, encoding and scoring each batch in a single model call
+
+    Args:
+        rag_model: RAGPretrainedModel or anything exposing the same search() call
+        queries: Queries to search for
+        k: Number of results per query
+        batch_size: Number of queries passed to the model at a time
+
+    Returns:
+        One result list per query, in query order
+    """
+    results = []
+    for start in range(0, len(queries), batch_size):
+        batch = queries[start:start + batch_size]
+        batch_results = rag_model.search(batch, k=k, **search_kwargs)
+
+        # RAGatouille unwraps the result list when given a single query
+        if len(batch) == 1 and (not batch_results or isinstance(batch_results[0], dict)):
+            batch_results = [batch_results]
+        results.extend(batch_results)
+
+    return results
+
+def normalize_query(query: str) -> str:
+    """Collapse whitespace so trivially different spellings of a query share cache entries"""
+    return ' '.join(query.split())
+
+class LRUCache:
+    """Thread-safe bounded mapping that evicts the least recently used entry and counts hits and misses"""
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, key) -> Optional[Any]:
+        with self.lock:
+            if key not in self.entries:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return self.entries[key]
+
+    def put(self, key, value):
+        if self.max_size <= 0:
+            return
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self) -> Dict[str, int]:
+        with self.lock:
+            return {"hits": self.hits, "misses": self.misses, "entries": len(self.entries)}
+
+def index_version(index_path: Optional[Path]) -> Optional[Tuple]:
+    """
+    Return a cheap stamp that changes whenever the index on disk is rebuilt
+
+    Every create_index/update_index run rewrites the chunk manifest; indexes
+    built without one fall back to RAGatouille's own metadata.json.
+    """
+    if index_path is None:
+        return None
+    for file_name in (CHUNK_MANIFEST_FILE, 'metadata.json'):
+        path = Path(index_path) / file_name
+        try:
+            stat = path.stat()
+        except OSError:
+            continue
+        return (file_name, stat.st_mtime_ns, stat.st_size)
+    return None
+
+class CachedSearchModel:
+    """
+    Wraps a RAG model's search() with a two-level in-memory cache
+
+    The first level maps normalized query text to the query token embeddings
+    computed by the ColBERT searcher, so a repeated query skips the encoder
+    even when k or the filters differ. The second level maps (query, k,
+    search arguments, index version) to the result list. Both levels are
+    bounded LRUs and are cleared whenever the index is rebuilt on disk or
+    modified through this wrapper.
+    """
+
+    def __init__(self, rag_model, index_path: Optional[Path] = None,
+                 embedding_cache_size: int = QUERY_EMBEDDING_CACHE_SIZE,
+                 result_cache_size: int = SEARCH_RESULT_CACHE_SIZE):
+        """
+        Args:
+            rag_model: RAGPretrainedModel or anything exposing the same search() call
+            index_path: Index directory watched for rebuilds (None only tracks changes made through this wrapper)
+            embedding_cache_size: Maximum number of cached query embeddings
+            result_cache_size: Maximum number of cached result lists
+        """
+        self.rag_model = rag_model
+        self.index_path = Path(index_path) if index_path else None
+        self.embedding_cache = LRUCache(embedding_cache_size)
+        self.result_cache = LRUCache(result_cache_size)
+        self.generation = 0
+        self.version = (self.generation, index_version(self.index_path))
+        self.lock = threading.Lock()
+
+    def _current_version(self) -> Tuple:
+        """Return the index version, dropping every cached entry if it changed"""
+        version = (self.generation, index_version(self.index_path))
+        with self.lock:
+            if version != self.version:
+                self.version = version
+                self.embedding_cache.clear()
+                self.result_cache.clear()
+        return version
+
+    def _install_embedding_cache(self):
+        """Route the ColBERT searcher's query encoder through the embedding cache"""
+        model_index = getattr(getattr(self.rag_model, 'model', None), 'model_index', None)
+        searcher = getattr(model_index, 'searcher', None)
+        if searcher is None or getattr(searcher.encode, 'embedding_cache', None) is self.embedding_cache:
+            return
+
+        encode = searcher.encode
+        embedding_cache = self.embedding_cache
+
+        @functools.wraps(encode)
+        def cached_encode(text, full_length_search=False):
+            # Batched searches encode lists of queries in one pass, leave those alone
+            if not isinstance(text, str):
+                with tracer.span("query_encoding", queries=len(text)):
+                    return encode(text, full_length_search=full_length_search)
+            key = (normalize_query(text), full_length_search)
+            embeddings = embedding_cache.get(key)
+            if embeddings is None:
+                with tracer.span("query_encoding", queries=1):
+                    embeddings = encode(text, full_length_search=full_length_search)
+                embedding_cache.put(key, embeddings)
+            return embeddings
+
+        cached_encode.embedding_cache = embedding_cache
+        searcher.encode = cached_encode
+
+    def _result_key(self, query: str, k: int, version: Tuple, search_kwargs: Dict) -> Tuple:
+        # doc_ids from metadata filters can be long, so the arguments are stored as a digest
+        arguments = json.dumps(search_kwargs, sort_keys=True, default=str)
+        return (normalize_query(query), k, hashlib.sha1(arguments.encode('utf-8')).hexdigest(), version)
+
+    def _search(self, queries: Union[str, List[str]], k: int, search_kwargs: Dict):
+        # The searcher is created lazily on the first search, so check before and after
+        self._install_embedding_cache()
+        with tracer.span("index_search"):
+            results = self.rag_model.search(queries, k=k, **search_kwargs)
+        self._install_embedding_cache()
+        return results
+
+    def search(self, query: Union[str, List[str]], k: int = 10, **search_kwargs) -> Union[List[Dict], List[List[Dict]]]:
+        """
+        Search with caching, mirroring RAGPretrainedModel.search
+
+        A list of queries only sends the queries missing from the result cache
+        to the model, in a single call.
+        """
+        version = self._current_version()
+        queries = query if isinstance(query, list) else [query]
+        keys = [self._result_key(q, k, version, search_kwargs) for q in queries]
+        results = [self.result_cache.get(key) for key in keys]
+
+        missing = [i for i, result in enumerate(results) if result is None]
+        tracer.increment("search_cache_hits", len(queries) - len(missing))
+        tracer.increment("search_cache_misses", len(missing))
+        if missing:
+            if isinstance(query, list):
+                searched = self._search([queries[i] for i in missing], k, search_kwargs)
+                # RAGatouille unwraps the result list when given a single query
+                if len(missing) == 1 and (not searched or isinstance(searched[0], dict)):
+                    searched = [searched]
+            else:
+                searched = [self._search(query, k, search_kwargs)]
+
+            for i, result in zip(missing, searched):
+                results[i] = result
+                self.result_cache.put(keys[i], result)
+
+        # Hand out copies so callers can't modify the cached results
+        results = [[dict(hit) for hit in result] for result in results]
+        return results if isinstance(query, list) else results[0]
+
+    def index(self, *args, **kwargs):
+        try:
+            return self.rag_model.index(*args, **kwargs)
+        finally:
+            self.generation += 1
+
+    def add_to_index(self, *args, **kwargs):
+        try:
+            return self.rag_model.add_to_index(*args, **kwargs)
+        finally:
+            self.generation += 1
+
+    def delete_from_index(self, *args, **kwargs):
+        try:
+            return self.rag_model.delete_from_index(*args, **kwargs)
+        finally:
+            self.generation += 1
+
+    def cache_stats(self) -> Dict[str, Dict[str, int]]:
+        """Hit, miss and size counters for both cache levels"""
+        return {"query_embeddings": self.embedding_cache.stats(), "results": self.result_cache.stats()}
+
+    def __getattr__(self, name):
+        return getattr(self.rag_model, name)
+
+def reciprocal_rank_fusion(rankings: List[List[str]], weights: List[float], rrf_k: int = RRF_K) -> List[Tuple[str, float]]:
+    """
+    Merge rankings by summing weight / (rrf_k + rank) for every list a document appears in
+
+    Args:
+        rankings: Document ids per retriever, best first and without duplicates
+        weights: Weight of each ranking
+        rrf_k: Rank offset
+
+    Returns:
+        (document_id, fused score) pairs, best first
+    """
+    scores = {}
+    for ranking, weight in zip(rankings, weights):
+        for rank, document_id in enumerate(ranking, 1):
+            scores[document_id] = scores.get(document_id, 0.0) + weight / (rrf_k + rank)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
+
+class HybridSearchModel:
+    """
+    Combines ColBERT and BM25 retrieval behind the RAGPretrainedModel search() call
+
+    Both retrievers run concurrently and their rankings are merged with
+    weighted reciprocal rank fusion. With bm25_prune_k set, ColBERT only scores
+    the top BM25 candidates instead, which is much cheaper for keyword-heavy
+    queries such as "Article 35" at the cost of missing purely semantic matches.
+    """
+
+    def __init__(self, rag_model, bm25_index: BM25Index,
+                 dense_weight: float = DENSE_WEIGHT, sparse_weight: float = SPARSE_WEIGHT,
+                 rrf_k: int = RRF_K, fusion_depth: int = FUSION_DEPTH, bm25_prune_k: Optional[int] = None):
+        """
+        Args:
+            rag_model: RAGPretrainedModel or anything exposing the same search() call
+            bm25_index: BM25 index over the same chunks
+            dense_weight: Fusion weight of the ColBERT ranking
+            sparse_weight: Fusion weight of the BM25 ranking
+            rrf_k: Rank offset used in fusion
+            fusion_depth: Minimum number of hits taken from each retriever before fusing
+            bm25_prune_k: Restrict ColBERT scoring to this many BM25 candidates (None scores every chunk)
+        """
+        self.rag_model = rag_model
+        self.bm25_index = bm25_index
+        self.dense_weight = dense_weight
+        self.sparse_weight = sparse_weight
+        self.rrf_k = rrf_k
+        self.fusion_depth = fusion_depth
+        self.bm25_prune_k = bm25_prune_k
+        self.executor = ThreadPoolExecutor(max_workers=1)
+
+    def _fuse(self, dense_results: List[Dict], sparse_hits: List[Tuple[str, float]], k: int) -> List[Dict]:
+        """Merge one query's dense results and BM25 hits into k results"""
+        # A document can come back as several passages; keep its best one
+        dense_by_id = {}
+        for result in dense_results:
+            dense_by_id.setdefault(result['document_id'], result)
+
+        fused = reciprocal_rank_fusion(
+            [list(dense_by_id), [chunk_id for chunk_id, _ in sparse_hits]],
+            [self.dense_weight, self.sparse_weight],
+            self.rrf_k
+        )
+
+        results = []
+        for rank, (document_id, score) in enumerate(fused[:k], 1):
+            if document_id in dense_by_id:
+                result = dict(dense_by_id[document_id], score=score, rank=rank)
+            else:
+                result = self.bm25_index.result(document_id, score, rank)
+            results.append(result)
+        return results
+
+    def _dense_search(self, queries: List[str], depth: int, search_kwargs: Dict) -> List[List[Dict]]:
+        with tracer.span("dense_search"):
+            return batched_search(self.rag_model, queries, k=depth, batch_size=max(1, len(queries)), **search_kwargs)
+
+    def _sparse_search(self, query: str, depth: int, doc_ids: Optional[List[str]]) -> List[Tuple[str, float]]:
+        with tracer.span("bm25_search"):
+            return self.bm25_index.search(query, depth, candidate_ids=doc_ids)
+
+    def search(self, query: Union[str, List[str]], k: int = 10, doc_ids: Optional[List[str]] = None,
+               **search_kwargs) -> Union[List[Dict], List[List[Dict]]]:
+        """Hybrid search mirroring RAGPretrainedModel.search, including the doc_ids restriction"""
+        queries = query if isinstance(query, list) else [query]
+        depth = max(k, self.fusion_depth)
+        if doc_ids is not None:
+            search_kwargs['doc_ids'] = doc_ids
+
+        if self.bm25_prune_k:
+            results = []
+            for q in queries:
+                sparse_hits = self._sparse_search(q, max(depth, self.bm25_prune_k), doc_ids)
+                query_kwargs = dict(search_kwargs)
+                if sparse_hits:
+                    query_kwargs['doc_ids'] = [chunk_id for chunk_id, _ in sparse_hits[:self.bm25_prune_k]]
+                dense_results = self._dense_search([q], depth, query_kwargs)[0]
+                results.append(self._fuse(dense_results, sparse_hits[:depth], k))
+        else:
+            # ColBERT runs in the background while BM25 scores the queries here
+            # (in a copy of this context so its spans land in the current trace)
+            dense_future = self.executor.submit(
+                contextvars.copy_context().run, self._dense_search, queries, depth, search_kwargs
+            )
+            sparse_hits = [self._sparse_search(q, depth, doc_ids) for q in queries]
+            dense_results = dense_future.result()
+            results = [self._fuse(dense, sparse, k) for dense, sparse in zip(dense_results, sparse_hits)]
+
+        return results if isinstance(query, list) else results[0]
+
+    def __getattr__(self, name):
+        return getattr(self.rag_model, name)
+
+def load_search_model(index_path: Path, hybrid: bool = True,
+                      dense_weight: float = DENSE_WEIGHT, sparse_weight: float = SPARSE_WEIGHT,
+                      bm25_prune_k: Optional[int] = None, quantized: bool = False,
+                      sharded: bool = False, logger: Optional[logging.Logger] = None):
+    """
+    Load an index for searching: ColBERT, fused with BM25 when the index has a BM25 sidecar, behind the query cache
+
+    Args:
+        index_path: Index directory
+        hybrid: Fuse with BM25 if available; False searches ColBERT only
+        dense_weight: Fusion weight of the ColBERT ranking
+        sparse_weight: Fusion weight of the BM25 ranking
+        bm25_prune_k: Restrict ColBERT scoring to this many BM25 candidates
+        quantized: Score against the memory-mapped int8 copy of the index instead of loading the ColBERT index
+        sharded: Search the index shards in parallel worker processes instead of the single ColBERT index
+        logger: Logger for status messages
+
+    Returns:
+        CachedSearchModel wrapping the loaded model
+    """
+    logger = logger or logging.getLogger(__name__)
+    if quantized:
+        quantized_index = QuantizedIndex.load(index_path)
+        if quantized_index is None:
+            raise FileNotFoundError(f"No quantized index in {index_path}, build one with rag_indexer.py --quantize")
+        # Only the checkpoint is loaded, for encoding queries; the token vectors stay in the mmap
+        encoder = RAGPretrainedModel.from_pretrained(quantized_index.meta['model_name'])
+        rag_model = QuantizedSearchModel(quantized_index, colbert_query_encoder(encoder))
+        logger.info(f"Searching the memory-mapped quantized index over {len(quantized_index)} chunks")
+    elif sharded:
+        shard_paths = load_shard_manifest(index_path)
+        if shard_paths is None:
+            raise FileNotFoundError(f"No index shards for {index_path}, build them with rag_indexer.py --shards N")
+        rag_model = ShardedSearchModel(shard_paths)
+        logger.info(f"Searching {len(rag_model.executors)} index shards in parallel worker processes")
+    else:
+        rag_model = RAGPretrainedModel.from_index(str(index_path))
+
+    bm25_index = BM25Index.load(index_path) if hybrid else None
+    if bm25_index is not None:
+        rag_model = HybridSearchModel(rag_model, bm25_index, dense_weight, sparse_weight, bm25_prune_k=bm25_prune_k)
+        logger.info(f"Hybrid ColBERT + BM25 search over {len(bm25_index)} chunks")
+    elif hybrid:
+        logger.info("No BM25 index found, rebuild the index to enable hybrid search; using ColBERT only")
+
+    return CachedSearchModel(rag_model, index_path)
+
 class DocumentIndexer:
-    def __init__(self, experiment_number: str):
+    def __init__(self, experiment_number: str, batch_size: int = CHUNK_BATCH_SIZE, quantize: bool = False,
+                 shards: int = 1):
         self.logger = setup_logger(__name__)
         self.experiment_number = experiment_number
         self.experiment_path = Path(BASE_EXPERIMENTS_PATH) / experiment_number
-        self.chunks_path = self.experiment_path / "document_chunks.json"
+        self.chunks_path = resolve_chunks_path(self.experiment_path)
         self.index_path = self.experiment_path / "index"
+        self.index_name = str("Experiment_"+experiment_number)
+        self.index_dir = Path(INDEX_ROOT) / self.index_name
+        self.batch_size = batch_size
+        self.quantize = quantize
+        self.shards = shards
         self.rag_model = None
-        
+
     def validate_chunk(self, chunk: Dict, chunk_idx: int) -> Dict:
         """
         Validate and extract required fields from a document chunk
@@ -85,82 +615,366 @@ class DocumentIndexer:
             'id': chunk_id
         }
         
-    def load_document_chunks(self) -> tuple[List[str], List[Dict], List[str]]:
-        """Load and parse document chunks from JSON file"""
-        self.logger.info(f"Loading document chunks from {self.chunks_path}")
-        
+    def iter_document_chunks(self) -> Iterator[Dict]:
+        """
+        Stream validated document chunks from the chunk store, or from the JSON
+        or JSONL chunks file when the store is missing or older than it
+
+        Returns:
+            Iterator over validated chunks (see validate_chunk), in file order
+        """
+        self.logger.info(f"Streaming document chunks from {self.chunks_path}")
+
         if not self.chunks_path.exists():
             raise FileNotFoundError(f"Document chunks file not found at {self.chunks_path}")
-        
+
+        idx = -1
         try:
-            with open(self.chunks_path, 'r') as f:
-                chunks_data = json.load(f)
-                
-            # Ensure we have a list of chunks
-            if not isinstance(chunks_data, list):
-                raise ValueError("Document chunks must be a list")
-                
-            if not chunks_data:
-                raise ValueError("Document chunks list is empty")
-                
-            # Process each chunk
-            documents = []
-            metadata = []
-            doc_ids = []
-            
-            self.logger.info(f"Found {len(chunks_data)} chunks to process")
-            
-            for idx, chunk in enumerate(chunks_data):
+            for idx, chunk in enumerate(iter_chunk_records(self.chunks_path)):
                 try:
                     validated_chunk = self.validate_chunk(chunk, idx)
-                    documents.append(validated_chunk['content'])
-                    metadata.append(validated_chunk['metadata'])
-                    doc_ids.append(validated_chunk['id'])
                 except Exception as e:
                     self.logger.error(f"Error processing chunk {idx}: {str(e)}")
                     raise
-                    
-            self.logger.info(f"Successfully processed {len(documents)} document chunks")
-            
-            # Log a sample chunk for verification
-            if documents:
-                self.logger.info("Sample document chunk structure:")
-                self.logger.info(f"Content preview: {documents[0][:100]}...")
-                self.logger.info(f"Metadata: {metadata[0]}")
-                self.logger.info(f"ID: {doc_ids[0]}")
-                
-            return documents, metadata, doc_ids
-            
+
+                # Log a sample chunk for verification
+                if idx == 0:
+                    self.logger.info("Sample document chunk structure:")
+                    self.logger.info(f"Content preview: {validated_chunk['content'][:100]}...")
+                    self.logger.info(f"Metadata: {validated_chunk['metadata']}")
+                    self.logger.info(f"ID: {validated_chunk['id']}")
+
+                yield validated_chunk
+
         except json.JSONDecodeError as e:
             self.logger.error(f"Invalid JSON format in chunks file: {str(e)}")
             raise
-        except Exception as e:
-            self.logger.error(f"Error loading document chunks: {str(e)}")
-            raise
-            
+
+        if idx < 0:
+            raise ValueError("Document chunks list is empty")
+
+        self.logger.info(f"Successfully processed {idx + 1} document chunks")
+
+    def iter_chunk_batches(self, batch_size: Optional[int] = None) -> Iterator[Tuple[List[str], List[Dict], List[str]]]:
+        """
+        Group streamed chunks into fixed-size batches for the indexer
+
+        Args:
+            batch_size: Maximum number of chunks per batch (defaults to self.batch_size)
+
+        Returns:
+            Iterator over (documents, metadata, doc_ids) tuples
+        """
+        batch_size = batch_size or self.batch_size
+        documents, metadata, doc_ids = [], [], []
+
+        for validated_chunk in self.iter_document_chunks():
+            documents.append(validated_chunk['content'])
+            metadata.append(validated_chunk['metadata'])
+            doc_ids.append(validated_chunk['id'])
+
+            if len(documents) == batch_size:
+                yield documents, metadata, doc_ids
+                documents, metadata, doc_ids = [], [], []
+
+        if documents:
+            yield documents, metadata, doc_ids
+
+    def load_document_chunks(self) -> tuple[List[str], List[Dict], List[str]]:
+        """Load and parse all document chunks into memory"""
+        documents = []
+        metadata = []
+        doc_ids = []
+
+        for batch_documents, batch_metadata, batch_doc_ids in self.iter_chunk_batches():
+            documents.extend(batch_documents)
+            metadata.extend(batch_metadata)
+            doc_ids.extend(batch_doc_ids)
+
+        return documents, metadata, doc_ids
+
     def create_index(self) -> Path:
-        """Create a new index with metadata"""
+        """
+        Create a new index with metadata
+
+        Chunks are streamed from disk in batches of self.batch_size, which only
+        avoids holding the raw JSON: the whole collection is then indexed in a
+        single RAGatouille index() call, so indexing starts once the file is
+        read and peak memory grows with the corpus. RAGatouille cannot do
+        better: PLAID trains its centroids on a sample of the whole collection,
+        the model keeps the collection in memory and rewrites collection.json
+        on every add, and add_to_index rebuilds the index from scratch while a
+        batch is over 5% of the index or the index has under 5000 chunks.
+        Building from the first batch and appending the rest would be
+        quadratic or leave later chunks on centroids trained without them.
+        The manifest, metadata index and BM25 index are also built in memory.
+        """
         self.logger.info(f"Creating new index for experiment {self.experiment_number}")
-        
+        index_name = self.index_name
+
         try:
             # Load the model
             self.rag_model = RAGPretrainedModel.from_pretrained(MODEL_NAME)
             self.logger.info("Successfully loaded RAG model")
-            
-            # Load documents and metadata
-            documents, metadata, doc_ids = self.load_document_chunks()
-            
-            # Create the index
+
+            collection, collection_metadata, collection_ids = [], [], []
+            manifest = {}
+            metadata_index = MetadataIndex()
+            bm25_index = BM25Index()
+            for documents, metadata, doc_ids in self.iter_chunk_batches():
+                for content, chunk_metadata, chunk_id in zip(documents, metadata, doc_ids):
+                    manifest[chunk_id] = chunk_fingerprint(content, chunk_metadata)
+                    metadata_index.add(chunk_id, chunk_metadata)
+                    bm25_index.add(chunk_id, content, chunk_metadata)
+                collection.extend(documents)
+                collection_metadata.extend(metadata)
+                collection_ids.extend(doc_ids)
+                self.logger.info(f"Read {len(collection)} chunks so far")
+
             index_path = self.rag_model.index(
-                index_name=str("Experiment_"+self.experiment_number),
-                collection=documents,
-                document_ids=doc_ids,
-                document_metadatas=metadata
+                index_name=index_name,
+                collection=collection,
+                document_ids=collection_ids,
+                document_metadatas=collection_metadata
             )
-            
+            self.logger.info(f"Indexed {len(collection)} chunks")
+
+            self._save_manifest(Path(index_path), manifest)
+            metadata_index.save(Path(index_path) / METADATA_INDEX_FILE)
+            bm25_index.save(Path(index_path) / BM25_INDEX_FILE)
+            if self.shards > 1:
+                self.build_index_shards(Path(index_path), (collection, collection_metadata, collection_ids))
+            del collection, collection_metadata, collection_ids
+            if self.quantize:
+                self.build_quantized_index(Path(index_path))
             self.logger.info(f"Successfully created index at {index_path}")
             return index_path
-            
+
         except Exception as e:
             self.logger.error(f"Error creating index: {str(e)}")
-            raise
\ No newline at end of file
+            raise
+
+    def build_quantized_index(self, index_path: Path) -> Path:
+        """
+        Write the memory-mapped int8 copy of the index used by quantized search
+
+        Chunks are streamed and encoded with the ColBERT checkpoint batch by
+        batch, so only one batch of float token vectors is held in memory.
+        """
+        self.logger.info(f"Building quantized index in {Path(index_path) / QUANTIZED_INDEX_DIR}")
+        encode_documents = colbert_document_encoder(self.rag_model or RAGPretrainedModel.from_pretrained(MODEL_NAME))
+        writer = QuantizedIndexWriter(index_path, MODEL_NAME)
+        total_chunks = 0
+        for documents, metadata, doc_ids in self.iter_chunk_batches():
+            embeddings, doclens = encode_documents(documents)
+            writer.add(doc_ids, documents, metadata, embeddings, doclens)
+            total_chunks += len(documents)
+            self.logger.info(f"Quantized {total_chunks} chunks so far")
+        quantized_path = writer.close()
+        self.logger.info(f"Saved quantized index for {total_chunks} chunks to {quantized_path}")
+        return quantized_path
+
+    def update_quantized_index(self, index_path: Path, documents: List[str], metadata: List[Dict],
+                               doc_ids: List[str], deleted_ids: List[str]) -> Path:
+        """
+        Bring the quantized copy of the index in line with an incremental update
+
+        Rows of unchanged chunks are copied over as int8 codes, so only the new
+        and changed chunks are encoded. Falls back to a full build when there is
+        no quantized copy or it was encoded with a different model.
+        """
+        quantized_index = QuantizedIndex.load(index_path)
+        if quantized_index is None or quantized_index.meta['model_name'] != MODEL_NAME:
+            return self.build_quantized_index(index_path)
+
+        dropped = set(deleted_ids)
+        keep = [row for row, chunk_id in enumerate(quantized_index.chunk_ids) if chunk_id not in dropped]
+        encode_documents = colbert_document_encoder(self.rag_model or RAGPretrainedModel.from_pretrained(MODEL_NAME))
+        writer = QuantizedIndexWriter(index_path, MODEL_NAME)
+        writer.add_from(quantized_index, keep)
+        for start in range(0, len(doc_ids), self.batch_size):
+            end = start + self.batch_size
+            embeddings, doclens = encode_documents(documents[start:end])
+            writer.add(doc_ids[start:end], documents[start:end], metadata[start:end], embeddings, doclens)
+        quantized_path = writer.close()
+        self.logger.info(
+            f"Updated quantized index in {quantized_path}: {len(keep)} chunks kept, "
+            f"{len(quantized_index) - len(keep)} dropped, {len(doc_ids)} encoded"
+        )
+        return quantized_path
+
+    def build_index_shards(self, index_path: Path,
+                           collection: Optional[Tuple[List[str], List[Dict], List[str]]] = None) -> List[Optional[str]]:
+        """
+        Partition the chunks into self.shards ColBERT indexes for sharded search
+
+        Each chunk goes to the shard picked by a hash of its id, so updates find
+        it again. The chunks are partitioned in a single pass, over collection
+        when the caller already holds it or else over the chunks file, and each
+        shard is then built with one index() call of a shared model. The shard
+        paths are recorded next to the main index, None for a shard that got no
+        chunks.
+
+        Args:
+            index_path: Directory of the main index
+            collection: Documents, metadata and chunk ids of every chunk, if already in memory
+        """
+        self.logger.info(f"Partitioning the index into {self.shards} shards")
+        shard_collections = [([], [], []) for _ in range(self.shards)]
+        for documents, metadata, doc_ids in [collection] if collection else self.iter_chunk_batches():
+            for content, chunk_metadata, chunk_id in zip(documents, metadata, doc_ids):
+                shard_documents, shard_metadata, shard_ids = shard_collections[shard_of(chunk_id, self.shards)]
+                shard_documents.append(content)
+                shard_metadata.append(chunk_metadata)
+                shard_ids.append(chunk_id)
+
+        shard_model = RAGPretrainedModel.from_pretrained(MODEL_NAME)
+        shard_paths = []
+        for shard, (documents, metadata, doc_ids) in enumerate(shard_collections):
+            shard_path = shard_model.index(
+                index_name=shard_index_name(self.index_name, shard, self.shards),
+                collection=documents,
+                document_ids=doc_ids,
+                document_metadatas=metadata
+            ) if doc_ids else None
+            shard_paths.append(str(shard_path) if shard_path else None)
+            self.logger.info(f"Shard {shard + 1}/{self.shards}: {len(doc_ids)} chunks at {shard_path}")
+
+        save_shard_manifest(index_path, shard_paths)
+        return shard_paths
+
+    def _update_index_shards(self, documents: List[str], metadata: List[Dict], doc_ids: List[str],
+                             deleted_ids: List[str]):
+        """Apply an incremental update to the shards holding the affected chunks"""
+        shard_paths = load_shard_manifest(self.index_dir)
+        num_shards = len(shard_paths)
+        for shard, shard_path in enumerate(shard_paths):
+            shard_deleted = [chunk_id for chunk_id in deleted_ids if shard_of(chunk_id, num_shards) == shard]
+            keep = [i for i, chunk_id in enumerate(doc_ids) if shard_of(chunk_id, num_shards) == shard]
+            if not shard_deleted and not keep:
+                continue
+
+            if shard_path is None:
+                # The shard had no chunks so far, it gets a fresh index
+                shard_paths[shard] = str(RAGPretrainedModel.from_pretrained(MODEL_NAME).index(
+                    index_name=shard_index_name(self.index_name, shard, num_shards),
+                    collection=[documents[i] for i in keep],
+                    document_ids=[doc_ids[i] for i in keep],
+                    document_metadatas=[metadata[i] for i in keep]
+                ))
+                continue
+
+            shard_model = RAGPretrainedModel.from_index(shard_path)
+            if shard_deleted:
+                shard_model.delete_from_index(document_ids=shard_deleted)
+            if keep:
+                shard_model.add_to_index(
+                    new_collection=[documents[i] for i in keep],
+                    new_document_ids=[doc_ids[i] for i in keep],
+                    new_document_metadatas=[metadata[i] for i in keep]
+                )
+            self.logger.info(f"Updated shard {shard + 1}/{num_shards}: {len(keep)} added, {len(shard_deleted)} deleted")
+
+        save_shard_manifest(self.index_dir, shard_paths)
+
+    def _load_manifest(self) -> Optional[Dict[str, str]]:
+        """Load the chunk manifest recorded by the last build, if there is one"""
+        manifest_path = self.index_dir / CHUNK_MANIFEST_FILE
+        if not manifest_path.exists():
+            return None
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def _save_manifest(self, index_path: Path, manifest: Dict[str, str]):
+        """Record the content hash of every indexed chunk next to the index"""
+        manifest_path = index_path / CHUNK_MANIFEST_FILE
+        with open(manifest_path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f)
+        self.logger.info(f"Saved manifest for {len(manifest)} chunks to {manifest_path}")
+
+    def update_index(self) -> Path:
+        """
+        Bring an existing index in line with the chunks file
+
+        Chunks are compared against the manifest written by the previous build:
+        new and changed chunks are added, changed and removed chunks are deleted,
+        and unchanged chunks are left alone. Falls back to create_index when
+        there is no previous index or manifest to compare against.
+
+        Returns:
+            Path: Location of the updated index
+        """
+        previous_manifest = self._load_manifest()
+        if previous_manifest is None or not self.index_dir.exists():
+            self.logger.info("No existing index manifest found, building the full index")
+            return self.create_index()
+
+        self.logger.info(f"Updating index for experiment {self.experiment_number} incrementally")
+
+        try:
+            # Only chunks that need (re)indexing are kept in memory
+            manifest = {}
+            metadata_index = MetadataIndex()
+            bm25_index = BM25Index()
+            documents, metadata, doc_ids = [], [], []
+            for validated_chunk in self.iter_document_chunks():
+                chunk_id = validated_chunk['id']
+                fingerprint = chunk_fingerprint(validated_chunk['content'], validated_chunk['metadata'])
+                manifest[chunk_id] = fingerprint
+                metadata_index.add(chunk_id, validated_chunk['metadata'])
+                bm25_index.add(chunk_id, validated_chunk['content'], validated_chunk['metadata'])
+
+                if previous_manifest.get(chunk_id) != fingerprint:
+                    documents.append(validated_chunk['content'])
+                    metadata.append(validated_chunk['metadata'])
+                    doc_ids.append(chunk_id)
+
+            changed_ids = [chunk_id for chunk_id in doc_ids if chunk_id in previous_manifest]
+            removed_ids = [chunk_id for chunk_id in previous_manifest if chunk_id not in manifest]
+            self.logger.info(
+                f"{len(doc_ids) - len(changed_ids)} new, {len(changed_ids)} changed, "
+                f"{len(removed_ids)} removed chunks"
+            )
+
+            if not doc_ids and not removed_ids:
+                self.logger.info("Index is already up to date")
+                metadata_index.save(self.index_dir / METADATA_INDEX_FILE)
+                bm25_index.save(self.index_dir / BM25_INDEX_FILE)
+                if self.quantize and not (self.index_dir / QUANTIZED_INDEX_DIR).exists():
+                    self.build_quantized_index(self.index_dir)
+                if self.shards > 1 and len(load_shard_manifest(self.index_dir) or []) != self.shards:
+                    self.build_index_shards(self.index_dir)
+                return self.index_dir
+
+            self.rag_model = RAGPretrainedModel.from_index(str(self.index_dir))
+            self.logger.info("Successfully loaded existing index")
+
+            if changed_ids or removed_ids:
+                self.rag_model.delete_from_index(document_ids=changed_ids + removed_ids)
+
+            # One call: every add_to_index call may rebuild the whole index
+            if doc_ids:
+                self.rag_model.add_to_index(
+                    new_collection=documents,
+                    new_document_ids=doc_ids,
+                    new_document_metadatas=metadata
+                )
+
+            self._save_manifest(self.index_dir, manifest)
+            metadata_index.save(self.index_dir / METADATA_INDEX_FILE)
+            bm25_index.save(self.index_dir / BM25_INDEX_FILE)
+            # Keep the quantized copy current by encoding only the new and changed chunks
+            if self.quantize or (self.index_dir / QUANTIZED_INDEX_DIR).exists():
+                self.update_quantized_index(self.index_dir, documents, metadata, doc_ids, changed_ids + removed_ids)
+            # Existing shards are updated in place unless a different shard count was asked for
+            shard_paths = load_shard_manifest(self.index_dir)
+            if self.shards > 1 and len(shard_paths or []) != self.shards:
+                self.build_index_shards(self.index_dir)
+            elif shard_paths is not None:
+                self._update_index_shards(documents, metadata, doc_ids, changed_ids + removed_ids)
+            self.logger.info(f"Successfully updated index at {self.index_dir}")
+            return self.index_dir
+
+        except Exception as e:
+            self.logger.error(f"Error updating index: {str(e)}")
+            raise
@@ -0,0 +1,87 @@
+import time
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from sentence_transformers.cross_encoder import CrossEncoder
+
+RERANKER_MODEL = "cross-encoder/stsb-distilroberta-base"  # Same cross-encoder as create_eval_set_002.py
+RERANK_CANDIDATES = 50  # Candidates retrieved by the first stage when reranking is enabled
+RERANK_BATCH_SIZE = 16  # (query, passage) pairs scored per cross-encoder forward pass
+EARLY_EXIT_MARGIN = 0.2  # Stop once a whole batch scores this far below the current k-th best (stsb scores are 0-1)
+
+class CrossEncoderReranker:
+    """
+    Second retrieval stage: rescore first-stage candidates with a cross-encoder
+
+    Candidates are scored in batches, best first-stage rank first. Scoring
+    stops early when the latency budget is spent, or when a whole batch falls
+    clearly below the current k-th best score, since lower-ranked candidates
+    are then unlikely to make the cut. Candidates left unscored keep their
+    first-stage order after the scored ones.
+    """
+
+    def __init__(self, model_name: str = RERANKER_MODEL, batch_size: int = RERANK_BATCH_SIZE,
+                 latency_budget_ms: Optional[float] = None, early_exit_margin: Optional[float] = EARLY_EXIT_MARGIN):
+        """
+        Args:
+            model_name: Cross-encoder model to load
+            batch_size: Number of candidates scored per batch
+            latency_budget_ms: Stop scoring new batches after this many milliseconds (None scores every candidate)
+            early_exit_margin: Score gap that ends scoring early (None disables early exit)
+        """
+        self.model = CrossEncoder(model_name)
+        self.batch_size = batch_size
+        self.latency_budget_ms = latency_budget_ms
+        self.early_exit_margin = early_exit_margin
+
+    def rerank(self, query: str, candidates: List[Dict], k: int = 10) -> Tuple[List[Dict], Dict]:
+        """
+        Rerank first-stage results and keep the top k
+
+        Args:
+            query: Search query
+            candidates: First-stage results, best first
+            k: Number of results to keep
+
+        Returns:
+            (results, stats): the top k results with a rerank_score for every scored
+            candidate, and a dict with the number of candidates scored and why scoring stopped
+        """
+        start = time.perf_counter()
+        scores: List[float] = []
+        stop_reason = "all_scored"
+
+        for batch_start in range(0, len(candidates), self.batch_size):
+            batch = candidates[batch_start:batch_start + self.batch_size]
+            batch_scores = np.atleast_1d(self.model.predict(
+                [(query, candidate['content']) for candidate in batch],
+                batch_size=self.batch_size
+            ))
+            scores.extend(float(score) for score in batch_scores)
+
+            if len(scores) == len(candidates):
+                break
+            if self.latency_budget_ms is not None and (time.perf_counter() - start) * 1000 >= self.latency_budget_ms:
+                stop_reason = "latency_budget"
+                break
+            if self.early_exit_margin is not None and len(scores) >= k:
+                kth_best = np.partition(scores, len(scores) - k)[len(scores) - k]
+                if float(batch_scores.max()) + self.early_exit_margin < kth_best:
+                    stop_reason = "early_exit"
+                    break
+
+        order = sorted(range(len(scores)), key=lambda i: scores[i], reverse=True)
+        order.extend(range(len(scores), len(candidates)))
+
+        results = []
+        for rank, i in enumerate(order[:k], 1):
+            result = dict(candidates[i], rank=rank, first_stage_rank=i + 1)
+            if i < len(scores):
+                result['rerank_score'] = scores[i]
+            results.append(result)
+
+        stats = {
+            "candidates": len(candidates),
+            "scored": len(scores),
+            "stop_reason": stop_reason if candidates else "no_candidates",
+        }
+        return results, stats
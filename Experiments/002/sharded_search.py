@@ -0,0 +1,122 @@
+import os
+import json
+import heapq
+import zlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from pathlib import Path
+from typing import Dict, List, Optional, Union
+from ragatouille import RAGPretrainedModel
+
+SHARD_MANIFEST_FILE = "shards.json"  # Shard index paths, stored in the main index directory
+
+# The shard loaded by this worker process
+_shard_model = None
+
+def shard_of(chunk_id: str, num_shards: int) -> int:
+    """Shard a chunk belongs to; stable across runs so incremental updates find it again"""
+    return zlib.crc32(chunk_id.encode('utf-8')) % num_shards
+
+def shard_index_name(index_name: str, shard: int, num_shards: int) -> str:
+    return f"{index_name}_shard{shard}of{num_shards}"
+
+def save_shard_manifest(index_path: Path, shard_paths: List[Optional[str]]):
+    """Record the shard index paths next to the main index; None marks a shard without chunks"""
+    with open(Path(index_path) / SHARD_MANIFEST_FILE, 'w', encoding='utf-8') as f:
+        json.dump({
+            "num_shards": len(shard_paths),
+            "shards": [str(path) if path else None for path in shard_paths],
+        }, f, indent=2)
+
+def load_shard_manifest(index_path: Path) -> Optional[List[Optional[str]]]:
+    """Shard index paths recorded next to an index, if it was built with shards"""
+    manifest_path = Path(index_path) / SHARD_MANIFEST_FILE
+    if not manifest_path.exists():
+        return None
+    with open(manifest_path, 'r', encoding='utf-8') as f:
+        return json.load(f)["shards"]
+
+def _load_shard(shard_path: str, num_threads: int):
+    """Worker initializer: load one shard and keep it resident for the life of the process"""
+    global _shard_model
+    import torch
+    torch.set_num_threads(num_threads)
+    _shard_model = RAGPretrainedModel.from_index(shard_path)
+
+def _shard_ready() -> bool:
+    return _shard_model is not None
+
+def _search_shard(queries: List[str], k: int, doc_ids: Optional[List[str]]) -> List[List[Dict]]:
+    """Search this worker's shard, one result list per query"""
+    if doc_ids is not None:
+        results = _shard_model.search(queries, k=k, doc_ids=doc_ids)
+    else:
+        results = _shard_model.search(queries, k=k)
+    # RAGatouille unwraps the result list when given a single query
+    if len(queries) == 1 and (not results or isinstance(results[0], dict)):
+        results = [results]
+    return results
+
+class ShardedSearchModel:
+    """
+    Fans a search out over index shards, each held resident by its own worker process
+
+    Every shard gets a single-process pool, so a shard is loaded exactly once
+    and its searches queue in that process while other shards run on other
+    cores. Each shard returns its top k and the lists are merged with a heap.
+    ColBERT scores are MaxSim sums over the same model's embeddings, so they
+    compare across shards even though each shard has its own centroids.
+    """
+    thread_safe = True  # Each shard process handles one search at a time, callers need no lock
+
+    def __init__(self, shard_paths: List[Optional[str]], threads_per_shard: Optional[int] = None):
+        """
+        Args:
+            shard_paths: Index directory of each shard in shard order, None for shards without chunks
+            threads_per_shard: Torch threads per worker (default: CPU cores split evenly across shards)
+        """
+        self.shard_paths = shard_paths
+        self.num_shards = len(shard_paths)
+        built_shards = [shard for shard, shard_path in enumerate(shard_paths) if shard_path]
+        if not built_shards:
+            raise ValueError("None of the shards has an index to search")
+        threads_per_shard = threads_per_shard or max(1, (os.cpu_count() or 1) // len(built_shards))
+        # Spawned rather than forked, torch does not survive forking once initialized
+        context = multiprocessing.get_context('spawn')
+        self.executors = {
+            shard: ProcessPoolExecutor(
+                max_workers=1, mp_context=context,
+                initializer=_load_shard, initargs=(str(shard_paths[shard]), threads_per_shard)
+            )
+            for shard in built_shards
+        }
+        # Load every shard up front, in parallel, instead of on the first query
+        for future in [executor.submit(_shard_ready) for executor in self.executors.values()]:
+            future.result()
+
+    def search(self, query: Union[str, List[str]], k: int = 10,
+               doc_ids: Optional[List[str]] = None) -> Union[List[Dict], List[List[Dict]]]:
+        """Search every shard (or only those holding doc_ids) and merge their top k per query"""
+        queries = query if isinstance(query, list) else [query]
+        if doc_ids is not None:
+            shard_doc_ids = [[] for _ in range(self.num_shards)]
+            for chunk_id in doc_ids:
+                shard_doc_ids[shard_of(chunk_id, self.num_shards)].append(chunk_id)
+            futures = [
+                executor.submit(_search_shard, queries, k, shard_doc_ids[shard])
+                for shard, executor in self.executors.items() if shard_doc_ids[shard]
+            ]
+        else:
+            futures = [executor.submit(_search_shard, queries, k, None) for executor in self.executors.values()]
+        shard_results = [future.result() for future in futures]
+
+        results = []
+        for i in range(len(queries)):
+            merged = heapq.merge(*(shard[i] for shard in shard_results), key=lambda result: -result['score'])
+            results.append([dict(result, rank=rank) for rank, result in enumerate(islice(merged, k), 1)])
+        return results if isinstance(query, list) else results[0]
+
+    def close(self):
+        for executor in self.executors.values():
+            executor.shutdown()
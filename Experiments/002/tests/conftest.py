@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# The experiment modules import each other as top-level modules, like when run as scripts
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
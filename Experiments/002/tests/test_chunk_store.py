@@ -0,0 +1,37 @@
+import json
+import pytest
+import chunk_store
+from chunk_store import iter_json_records
+
+RECORDS = [
+    {"chunk_id": f"DOC_chunk_{i}", "chunk_content": f"content {i} " + "x" * (i * 7), "chunk_metadata": {"Header 1": "A"}}
+    for i in range(40)
+]
+
+@pytest.fixture(params=[1 << 16, 16])
+def read_size(request, monkeypatch):
+    """The default read size and one that splits records across many reads"""
+    monkeypatch.setattr(chunk_store, 'JSON_READ_SIZE', request.param)
+    return request.param
+
+def test_reads_jsonl_with_many_lines(tmp_path, read_size):
+    path = tmp_path / "document_chunks.jsonl"
+    path.write_text("".join(json.dumps(record) + "\n" for record in RECORDS), encoding='utf-8')
+    assert list(iter_json_records(path)) == RECORDS
+
+def test_reads_jsonl_without_trailing_newline(tmp_path, read_size):
+    path = tmp_path / "document_chunks.jsonl"
+    path.write_text("\n".join(json.dumps(record) for record in RECORDS[:3]), encoding='utf-8')
+    assert list(iter_json_records(path)) == RECORDS[:3]
+
+def test_reads_json_array(tmp_path, read_size):
+    path = tmp_path / "document_chunks.json"
+    path.write_text(json.dumps(RECORDS, indent=2), encoding='utf-8')
+    assert list(iter_json_records(path)) == RECORDS
+
+def test_empty_files_yield_nothing(tmp_path):
+    empty, empty_array = tmp_path / "empty.jsonl", tmp_path / "empty.json"
+    empty.write_text("\n", encoding='utf-8')
+    empty_array.write_text("[]", encoding='utf-8')
+    assert list(iter_json_records(empty)) == []
+    assert list(iter_json_records(empty_array)) == []
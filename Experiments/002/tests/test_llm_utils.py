@@ -0,0 +1,112 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import instructor
+import openai
+import pytest
+from openai import OpenAI
+from pydantic import BaseModel
+from llm_utils import call_with_retry, limit_rate, reask_retrying
+
+class Answer(BaseModel):
+    answer: str
+
+def _completion(arguments: str) -> dict:
+    return {
+        "id": "chatcmpl-mock", "object": "chat.completion", "created": 0, "model": "gpt-4o",
+        "choices": [{
+            "index": 0, "finish_reason": "stop",
+            "message": {"role": "assistant", "content": None, "tool_calls": [{
+                "id": "call_0", "type": "function",
+                "function": {"name": "Answer", "arguments": arguments},
+            }]},
+        }],
+        "usage": {"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2},
+    }
+
+class MockOpenAIServer:
+    """OpenAI-compatible /chat/completions endpoint replaying a script of (status, tool call arguments)"""
+
+    def __init__(self, script):
+        self.script = list(script)
+        self.requests = 0
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                self.rfile.read(int(self.headers['Content-Length']))
+                status, arguments = server.script[min(server.requests, len(server.script) - 1)]
+                server.requests += 1
+                body = json.dumps(_completion(arguments) if status == 200 else
+                                  {"error": {"message": "mock error", "type": "rate_limit_error"}}).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        self.base_url = f"http://127.0.0.1:{self.httpd.server_address[1]}/v1"
+
+    def close(self):
+        self.httpd.shutdown()
+
+class CountingLimiter:
+    def __init__(self):
+        self.acquired = 0
+
+    def acquire(self):
+        self.acquired += 1
+
+@pytest.fixture
+def mock_server():
+    servers = []
+
+    def start(script):
+        servers.append(MockOpenAIServer(script))
+        return servers[-1]
+
+    yield start
+    for server in servers:
+        server.close()
+
+def _create(server, limiter, max_retries, max_attempts=4):
+    client = limit_rate(instructor.from_openai(OpenAI(api_key="test", base_url=server.base_url, max_retries=0)), limiter)
+    return call_with_retry(
+        client.chat.completions.create,
+        max_attempts=max_attempts, base_delay=0.01, max_delay=0.02,
+        model="gpt-4o", response_model=Answer, messages=[{"role": "user", "content": "q"}],
+        max_retries=max_retries,
+    )
+
+def test_rate_limits_are_retried_with_backoff(mock_server):
+    server = mock_server([(429, None), (429, None), (200, '{"answer": "ok"}')])
+    limiter = CountingLimiter()
+    assert _create(server, limiter, reask_retrying(3)).answer == "ok"
+    assert server.requests == 3
+    assert limiter.acquired == 3
+
+def test_persistent_rate_limit_gives_up_after_max_attempts(mock_server):
+    server = mock_server([(429, None)])
+    limiter = CountingLimiter()
+    with pytest.raises(openai.RateLimitError):
+        _create(server, limiter, reask_retrying(3), max_attempts=3)
+    assert server.requests == 3
+    assert limiter.acquired == 3
+
+def test_rate_limits_wrapped_by_instructor_are_retried(mock_server):
+    # An int max_retries makes instructor wrap the 429 in InstructorRetryException
+    server = mock_server([(429, None), (200, '{"answer": "ok"}')])
+    assert _create(server, CountingLimiter(), 1).answer == "ok"
+    assert server.requests == 2
+
+def test_invalid_output_is_reasked_without_backoff(mock_server):
+    server = mock_server([(200, '{"wrong": 1}'), (200, '{"answer": "ok"}')])
+    limiter = CountingLimiter()
+    assert _create(server, limiter, reask_retrying(3)).answer == "ok"
+    assert server.requests == 2
+    assert limiter.acquired == 2
@@ -0,0 +1,29 @@
+import numpy as np
+from quantized_index import QuantizedIndex, QuantizedIndexWriter
+
+def _write(index_path, chunks, rng):
+    writer = QuantizedIndexWriter(index_path, "model")
+    doclens = [int(rng.integers(1, 5)) for _ in chunks]
+    writer.add(chunks, [f"text {chunk_id}" for chunk_id in chunks], [{'id': chunk_id} for chunk_id in chunks],
+               rng.standard_normal((sum(doclens), 8)).astype(np.float32), doclens)
+    writer.close()
+    return QuantizedIndex.load(index_path)
+
+def test_add_from_carries_rows_over_unchanged(tmp_path, monkeypatch):
+    monkeypatch.setattr('quantized_index.COPY_BATCH_CHUNKS', 2)
+    rng = np.random.default_rng(0)
+    old = _write(tmp_path, [f"c{i}" for i in range(7)], rng)
+    queries = rng.standard_normal((2, 3, 8)).astype(np.float32)
+    expected = old.score(queries)
+
+    keep = [0, 2, 3, 6]
+    writer = QuantizedIndexWriter(tmp_path, "model")
+    writer.add_from(old, keep)
+    writer.add(["new"], ["text new"], [{}], rng.standard_normal((2, 8)).astype(np.float32), [2])
+    writer.close()
+
+    updated = QuantizedIndex.load(tmp_path)
+    assert updated.chunk_ids == ["c0", "c2", "c3", "c6", "new"]
+    assert updated.meta['num_tokens'] == sum(int(old.offsets[row + 1] - old.offsets[row]) for row in keep) + 2
+    np.testing.assert_allclose(updated.score(queries)[:, :4], expected[:, keep], rtol=1e-6)
+    assert updated.result(1, 0.0, 1)['document_metadata'] == {'id': 'c2'}
@@ -0,0 +1,337 @@
+# Summarize recorded traces with: python tracing.py traces.jsonl [--prometheus]
+
+import json
+import time
+import uuid
+import argparse
+import threading
+import contextvars
+from collections import deque
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional
+import numpy as np
+
+STAGE_SAMPLE_SIZE = 10000  # Most recent durations kept per stage for percentiles
+QUANTILES = (0.5, 0.95, 0.99)
+METRIC_PREFIX = "rag"
+
+class Span:
+    """One timed stage of a trace"""
+
+    def __init__(self, name: str, offset_ms: float, attributes: Optional[Dict] = None):
+        self.name = name
+        self.offset_ms = offset_ms
+        self.duration_ms = None
+        self.attributes = attributes or {}
+
+    def to_dict(self) -> Dict:
+        return {
+            "name": self.name,
+            "offset_ms": round(self.offset_ms, 3),
+            "duration_ms": round(self.duration_ms, 3) if self.duration_ms is not None else None,
+            **({"attributes": self.attributes} if self.attributes else {}),
+        }
+
+class Trace:
+    """Spans and counters recorded while handling one request"""
+
+    def __init__(self, name: str, attributes: Optional[Dict] = None):
+        self.trace_id = uuid.uuid4().hex
+        self.name = name
+        self.attributes = attributes or {}
+        self.started_at = time.time()
+        self.start = time.perf_counter()
+        self.duration_ms = None
+        self.spans: List[Span] = []
+        self.counters: Dict[str, float] = {}
+        self.lock = threading.Lock()
+
+    def timings(self) -> Dict[str, float]:
+        """Total milliseconds per stage name, plus the whole trace as total_ms"""
+        timings = {}
+        with self.lock:
+            for span in self.spans:
+                if span.duration_ms is not None:
+                    key = f"{span.name}_ms"
+                    timings[key] = round(timings.get(key, 0.0) + span.duration_ms, 1)
+        elapsed = self.duration_ms if self.duration_ms is not None else (time.perf_counter() - self.start) * 1000
+        timings["total_ms"] = round(elapsed, 1)
+        return timings
+
+    def to_dict(self) -> Dict:
+        with self.lock:
+            spans = [span.to_dict() for span in self.spans]
+            counters = dict(self.counters)
+        return {
+            "trace_id": self.trace_id,
+            "name": self.name,
+            "started_at": self.started_at,
+            "duration_ms": round(self.duration_ms, 3) if self.duration_ms is not None else None,
+            "attributes": self.attributes,
+            "spans": spans,
+            "counters": counters,
+        }
+
+class JSONLTraceExporter:
+    """Appends every finished trace to a JSONL file"""
+
+    def __init__(self, path: str):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.lock = threading.Lock()
+
+    def export(self, trace: Trace):
+        line = json.dumps(trace.to_dict(), ensure_ascii=False, default=str)
+        with self.lock, open(self.path, 'a', encoding='utf-8') as f:
+            f.write(line + "\n")
+
+class Tracer:
+    """
+    Records per-stage spans and counters for the RAG query path
+
+    Spans opened inside tracer.trace() are attached to that trace, which is
+    handed to the exporters when it finishes. Every span also feeds a
+    per-stage sample used for p50/p95/p99, and counters are accumulated
+    process-wide, whether or not a trace is active.
+    """
+
+    def __init__(self, sample_size: int = STAGE_SAMPLE_SIZE):
+        self.sample_size = sample_size
+        self.exporters = []
+        self.stage_samples: Dict[str, deque] = {}
+        self.stage_counts: Dict[str, int] = {}
+        self.stage_sums: Dict[str, float] = {}
+        self.counters: Dict[str, float] = {}
+        self.lock = threading.Lock()
+        self._current = contextvars.ContextVar("current_trace", default=None)
+
+    def add_exporter(self, exporter):
+        self.exporters.append(exporter)
+
+    def current_trace(self) -> Optional[Trace]:
+        return self._current.get()
+
+    def _record_stage(self, name: str, duration_ms: float):
+        with self.lock:
+            if name not in self.stage_samples:
+                self.stage_samples[name] = deque(maxlen=self.sample_size)
+                self.stage_counts[name] = 0
+                self.stage_sums[name] = 0.0
+            self.stage_samples[name].append(duration_ms)
+            self.stage_counts[name] += 1
+            self.stage_sums[name] += duration_ms
+
+    @contextmanager
+    def trace(self, name: str, **attributes) -> Iterator[Trace]:
+        """Start a trace for one request; nested spans and counters are attached to it"""
+        trace = Trace(name, attributes)
+        token = self._current.set(trace)
+        try:
+            yield trace
+        finally:
+            self._current.reset(token)
+            trace.duration_ms = (time.perf_counter() - trace.start) * 1000
+            self._record_stage(name, trace.duration_ms)
+            for exporter in self.exporters:
+                exporter.export(trace)
+
+    @contextmanager
+    def capture(self, name: str) -> Iterator[Trace]:
+        """
+        Collect spans and counters in a detached trace for attach() to add to a request's trace
+
+        For work started before the trace of the request using it exists, e.g.
+        a retrieval run speculatively on another thread. The captured trace is
+        not exported itself.
+        """
+        trace = Trace(name)
+        token = self._current.set(trace)
+        try:
+            yield trace
+        finally:
+            self._current.reset(token)
+            trace.duration_ms = (time.perf_counter() - trace.start) * 1000
+
+    def attach(self, captured: Trace):
+        """Add the spans and counters of a captured trace to the current trace, offsets relative to its start"""
+        trace = self._current.get()
+        if trace is None:
+            return
+        shift_ms = (captured.start - trace.start) * 1000
+        with captured.lock:
+            spans = list(captured.spans)
+            counters = dict(captured.counters)
+        with trace.lock:
+            for span in spans:
+                span.offset_ms += shift_ms
+                trace.spans.append(span)
+            for name, value in counters.items():
+                trace.counters[name] = trace.counters.get(name, 0) + value
+
+    @contextmanager
+    def span(self, name: str, **attributes) -> Iterator[Span]:
+        """Time a stage; attributes can also be set on the yielded span while it runs"""
+        trace = self._current.get()
+        start = time.perf_counter()
+        span = Span(name, (start - trace.start) * 1000 if trace else 0.0, attributes)
+        try:
+            yield span
+        finally:
+            span.duration_ms = (time.perf_counter() - start) * 1000
+            self._record_stage(name, span.duration_ms)
+            if trace is not None:
+                with trace.lock:
+                    trace.spans.append(span)
+
+    def record(self, name: str, duration_ms: float, **attributes):
+        """Record a stage timed by the caller, e.g. time to first token inside a streamed completion"""
+        trace = self._current.get()
+        offset_ms = (time.perf_counter() - trace.start) * 1000 - duration_ms if trace else 0.0
+        span = Span(name, offset_ms, attributes)
+        span.duration_ms = duration_ms
+        self._record_stage(name, duration_ms)
+        if trace is not None:
+            with trace.lock:
+                trace.spans.append(span)
+
+    def increment(self, name: str, value: float = 1):
+        """Add to a counter, both process-wide and on the current trace"""
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+        trace = self._current.get()
+        if trace is not None:
+            with trace.lock:
+                trace.counters[name] = trace.counters.get(name, 0) + value
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        """Count and p50/p95/p99 in milliseconds for every stage seen so far"""
+        with self.lock:
+            samples = {name: list(values) for name, values in self.stage_samples.items()}
+            counts = dict(self.stage_counts)
+        return {name: {"count": counts[name], **stage_percentiles(values)} for name, values in samples.items()}
+
+    def prometheus_text(self) -> str:
+        """Render stage durations as Prometheus summaries and counters as Prometheus counters"""
+        with self.lock:
+            samples = {name: list(values) for name, values in self.stage_samples.items()}
+            counts = dict(self.stage_counts)
+            sums = dict(self.stage_sums)
+            counters = dict(self.counters)
+        return render_prometheus(samples, counts, sums, counters)
+
+    def write_prometheus(self, path: str):
+        """Write the current metrics to a file, e.g. for the node_exporter textfile collector"""
+        tmp_path = Path(path).with_suffix('.tmp')
+        tmp_path.write_text(self.prometheus_text(), encoding='utf-8')
+        tmp_path.replace(path)
+
+def stage_percentiles(durations_ms: List[float]) -> Dict[str, float]:
+    """p50/p95/p99 of a list of durations in milliseconds"""
+    if not durations_ms:
+        return {}
+    values = np.percentile(durations_ms, [q * 100 for q in QUANTILES])
+    return {f"p{int(q * 100)}_ms": round(float(v), 1) for q, v in zip(QUANTILES, values)}
+
+def render_prometheus(samples: Dict[str, List[float]], counts: Dict[str, int],
+                      sums: Dict[str, float], counters: Dict[str, float]) -> str:
+    """Prometheus text exposition format for stage durations (in seconds) and counters"""
+    metric = f"{METRIC_PREFIX}_stage_duration_seconds"
+    lines = [
+        f"# HELP {metric} Duration of RAG query stages",
+        f"# TYPE {metric} summary",
+    ]
+    for stage in sorted(samples):
+        if samples[stage]:
+            values = np.percentile(samples[stage], [q * 100 for q in QUANTILES])
+            for q, value in zip(QUANTILES, values):
+                lines.append(f'{metric}{{stage="{stage}",quantile="{q}"}} {value / 1000:.6f}')
+        lines.append(f'{metric}_sum{{stage="{stage}"}} {sums[stage] / 1000:.6f}')
+        lines.append(f'{metric}_count{{stage="{stage}"}} {counts[stage]}')
+
+    for name in sorted(counters):
+        counter = f"{METRIC_PREFIX}_{name}_total"
+        lines.append(f"# TYPE {counter} counter")
+        lines.append(f"{counter} {counters[name]:g}")
+
+    return "\n".join(lines) + "\n"
+
+def instrument_instructor(client):
+    """Count attempts, validation retries and errors of an instructor client (no-op for clients without hooks)"""
+    if not hasattr(client, 'on'):
+        return client
+    client.on("completion:kwargs", lambda *args, **kwargs: tracer.increment("llm_attempts"))
+    client.on("completion:response", record_stream_usage)
+    client.on("parse:error", lambda error: tracer.increment("llm_validation_retries"))
+    client.on("completion:error", lambda error: tracer.increment("llm_errors"))
+    return client
+
+def _increment_token_usage(usage):
+    if usage is None:
+        return
+    tracer.increment("llm_prompt_tokens", getattr(usage, 'prompt_tokens', 0) or 0)
+    tracer.increment("llm_completion_tokens", getattr(usage, 'completion_tokens', 0) or 0)
+
+def record_token_usage(response):
+    """Add the token usage of an instructor response (summed over its retries) to the counters"""
+    _increment_token_usage(getattr(getattr(response, '_raw_response', None), 'usage', None))
+
+def record_stream_usage(response):
+    """
+    Add the token usage of a streamed completion to the counters as its chunks are read
+
+    Partial responses carry no raw response, and instructor skips the final usage chunk that
+    OpenAI sends for stream_options={"include_usage": True}, so the chunks are counted on their
+    way through the stream. Responses that are not streams are left to record_token_usage.
+    """
+    chunks = getattr(response, '_iterator', None)
+    if chunks is None:
+        return
+
+    def counted_chunks():
+        for chunk in chunks:
+            _increment_token_usage(getattr(chunk, 'usage', None))
+            yield chunk
+
+    response._iterator = counted_chunks()
+
+def configure_tracing(trace_log: Optional[str] = None) -> "Tracer":
+    """Attach a JSONL exporter to the shared tracer when a path is given"""
+    if trace_log:
+        tracer.add_exporter(JSONLTraceExporter(trace_log))
+    return tracer
+
+# Shared tracer used by the RAG modules
+tracer = Tracer()
+
+def summarize_trace_log(path: str) -> Tracer:
+    """Replay the spans and counters of a JSONL trace log into a fresh tracer"""
+    summary_tracer = Tracer(sample_size=None)
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            trace = json.loads(line)
+            if trace.get("duration_ms") is not None:
+                summary_tracer._record_stage(trace["name"], trace["duration_ms"])
+            for span in trace.get("spans", []):
+                if span.get("duration_ms") is not None:
+                    summary_tracer._record_stage(span["name"], span["duration_ms"])
+            for name, value in trace.get("counters", {}).items():
+                summary_tracer.counters[name] = summary_tracer.counters.get(name, 0) + value
+    return summary_tracer
+
+def main():
+    parser = argparse.ArgumentParser(description='Per-stage latency percentiles from a JSONL trace log')
+    parser.add_argument('trace_log', help='JSONL file written with --trace_log')
+    parser.add_argument('--prometheus', action='store_true', help='Print Prometheus text format instead of JSON')
+
+    args = parser.parse_args()
+    summary_tracer = summarize_trace_log(args.trace_log)
+    if args.prometheus:
+        print(summary_tracer.prometheus_text(), end='')
+    else:
+        print(json.dumps({"stages": summary_tracer.summary(), "counters": summary_tracer.counters}, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,399 @@
+import io
+import re
+import json
+import logging
+from collections import Counter, deque
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+HEADING_MARKERS = re.compile(r'^#+\s*')
+SEPARATORS = re.compile(r'[-—–]+')
+NON_WORD = re.compile(r'[^\w\s]')
+LEADING_NUMBER = re.compile(r'^[0-9.]+\s*')
+SECTION_NUMBER = re.compile(r'^[0-9]+[A-Z]*\s+')  # Privacy Act sections like "20", "20A", "20WW"
+CHAPTER = re.compile(r'#.*[Cc][Hh][Aa][Pp][Tt][Ee][Rr]')
+ARTICLE = re.compile(r'#.*[Aa][Rr][Tt][Ii][Cc][Ll][Ee]')
+SECTION = re.compile(r'#.*[Ss][Ee][Cc][Tt][Ii][Oo][Nn]')
+CHAPTER_NUMBER = re.compile(r'[Cc][Hh][Aa][Pp][Tt][Ee][Rr]\s*(.*)')
+ARTICLE_NUMBER = re.compile(r'(?:\*)?[Aa][Rr][Tt][Ii][Cc][Ll][Ee](?:\*)?\s*(.*)')
+SECTION_NUMBER_TITLE = re.compile(r'(?:\*)?[Ss][Ee][Cc][Tt][Ii][Oo][Nn](?:\*)?\s*(.*)')
+NOT_CHAPTER_TITLE = re.compile(r'[Ss][Ee][Cc][Tt][Ii][Oo][Nn]|[Aa][Rr][Tt][Ii][Cc][Ll][Ee]')
+NOT_ARTICLE_TITLE = re.compile(r'[Cc][Hh][Aa][Pp][Tt][Ee][Rr]|[Ss][Ee][Cc][Tt][Ii][Oo][Nn]')
+NOT_SECTION_TITLE = re.compile(r'[Cc][Hh][Aa][Pp][Tt][Ee][Rr]|[Aa][Rr][Tt][Ii][Cc][Ll][Ee]')
+DASH_NUMBERED_ITEM = re.compile(r'- (\d+)\.')
+NUMBERED_ITEM = re.compile(r'^(\d+)\.')
+
+def normalize_title(text: str, strip_numbers: bool = True) -> str:
+    """
+    Normalize a heading or TOC title for matching: lowercase, punctuation to
+    spaces, collapsed whitespace and, with strip_numbers, no leading numbers
+    """
+    text = text.lower()
+    text = SEPARATORS.sub(' ', text)
+    text = NON_WORD.sub(' ', text)
+    if strip_numbers:
+        text = LEADING_NUMBER.sub('', text)
+    return ' '.join(text.split())
+
+def clean_heading(line: str) -> str:
+    """Heading text without its leading # markers"""
+    return HEADING_MARKERS.sub('', line.strip())
+
+class TitleMatcher:
+    """
+    Tests whether a normalized heading contains, or is contained in, any of a set of titles
+
+    "Heading within a title" is one substring search over the titles joined
+    by newlines, which no normalized text contains. "Title within the
+    heading" walks an Aho-Corasick automaton of the titles over the heading.
+    Both take time independent of the number of titles.
+    """
+
+    def __init__(self, titles: Iterable[str]):
+        titles = list(dict.fromkeys(titles))
+        self.has_titles = bool(titles)
+        self.joined = "\n".join(titles)
+        self.goto: List[Dict[str, int]] = [{}]
+        self.terminal: List[bool] = [False]
+        for title in titles:
+            state = 0
+            for char in title:
+                next_state = self.goto[state].get(char)
+                if next_state is None:
+                    next_state = len(self.goto)
+                    self.goto[state][char] = next_state
+                    self.goto.append({})
+                    self.terminal.append(False)
+                state = next_state
+            self.terminal[state] = True
+
+        # Failure links in breadth-first order; a state is terminal if any suffix of it is a title
+        self.fail = [0] * len(self.goto)
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self.goto[state].items():
+                fallback = self.fail[state]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[next_state] = self.goto[fallback].get(char, 0)
+                self.terminal[next_state] = self.terminal[next_state] or self.terminal[self.fail[next_state]]
+                queue.append(next_state)
+
+    def matches(self, text: str) -> bool:
+        if not self.has_titles:
+            return False
+        if text in self.joined or self.terminal[0]:
+            return True
+        goto, fail, terminal = self.goto, self.fail, self.terminal
+        state = 0
+        for char in text:
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            if terminal[state]:
+                return True
+        return False
+
+class TocHeadingNormalizer:
+    """
+    Repairs the headings of a Privacy Act style document against its table of contents
+
+    Every heading line is matched against the Part, Division, Subdivision and
+    Section titles of the TOC and rewritten at its level; unknown headings are
+    wrapped in <extra> tags. A heading that starts like a Part, Division,
+    Subdivision or Section number is tried against that level first.
+    """
+    HEADING_LEVELS = {'Part': '##', 'Division': '###', 'Subdivision': '####', 'Section': '#####'}
+    PREFIXES = {'Part': 'part ', 'Division': 'division ', 'Subdivision': 'subdivision '}
+
+    def __init__(self, titles: Dict[str, List[str]]):
+        """
+        Args:
+            titles: TOC titles per heading type (Part, Division, Subdivision, Section)
+        """
+        self.matchers = {
+            heading_type: TitleMatcher(normalize_title(title) for title in titles.get(heading_type, []))
+            for heading_type in self.HEADING_LEVELS
+        }
+
+    @classmethod
+    def from_toc(cls, toc_data: Dict) -> "TocHeadingNormalizer":
+        """Collect the titles of a parts -> divisions -> sub_divisions -> sections TOC"""
+        titles = {heading_type: [] for heading_type in cls.HEADING_LEVELS}
+        for part in toc_data['parts']:
+            titles['Part'].append(part['title'])
+            for division in part.get('divisions') or []:
+                titles['Division'].append(division['title'])
+                for subdivision in division.get('sub_divisions') or []:
+                    titles['Subdivision'].append(subdivision['title'])
+                    titles['Section'].extend(section['title'] for section in subdivision.get('sections') or [])
+                titles['Section'].extend(section['title'] for section in division.get('sections') or [])
+            titles['Section'].extend(section['title'] for section in part.get('sections') or [])
+        return cls(titles)
+
+    def _pattern_type(self, heading: str) -> Optional[str]:
+        heading = heading.strip()
+        lowered = heading.lower()
+        for heading_type, prefix in self.PREFIXES.items():
+            if lowered.startswith(prefix):
+                return heading_type
+        return 'Section' if SECTION_NUMBER.match(heading) else None
+
+    def heading_type(self, line: str) -> Tuple[Optional[str], str]:
+        """(heading type or None, heading text) of a markdown heading line"""
+        heading = clean_heading(line)
+        normalized = normalize_title(heading)
+        pattern_type = self._pattern_type(heading)
+        if pattern_type and self.matchers[pattern_type].matches(normalized):
+            return pattern_type, heading
+        for heading_type, matcher in self.matchers.items():
+            if matcher.matches(normalized):
+                return heading_type, heading
+        return None, heading
+
+    def normalize_lines(self, lines: Iterable[str], counts: Optional[Counter] = None) -> Iterator[str]:
+        """Rewrite heading lines (readlines() style, with line endings) in one streaming pass"""
+        for line in lines:
+            if not line.strip().startswith('#'):
+                yield line
+                continue
+            heading_type, heading = self.heading_type(line)
+            if counts is not None:
+                counts[heading_type or 'extra'] += 1
+            if heading_type:
+                yield f"{self.HEADING_LEVELS[heading_type]} {heading}\n"
+            else:
+                yield f"<extra>{line.strip()}</extra>\n"
+
+class CcpaHeadingNormalizer:
+    """
+    Repairs the headings of the CCPA document against its table of contents
+
+    Headings matching a main heading or section title are rewritten at their
+    level and unknown headings are wrapped in <extra> tags. A "Compliance
+    Recommendations" heading becomes a heading only between two sections;
+    lines after one are held back until the next section shows whether it
+    is, so the document is still read once.
+    """
+    HEADING_LEVELS = {'MainHeading': '##', 'Section': '###', 'ComplianceRecommendations': '####'}
+
+    def __init__(self, titles: Dict[str, List[str]]):
+        """
+        Args:
+            titles: TOC titles per heading type (MainHeading, Section)
+        """
+        self.matchers = {
+            heading_type: TitleMatcher(normalize_title(title, strip_numbers=False) for title in titles.get(heading_type, []))
+            for heading_type in ('MainHeading', 'Section')
+        }
+
+    @classmethod
+    def from_toc(cls, toc_data: Dict) -> "CcpaHeadingNormalizer":
+        """Collect the titles of a ccpaTOC main_heading -> section TOC"""
+        titles = {'MainHeading': [], 'Section': []}
+        for item in toc_data['ccpaTOC']:
+            if item.get('main_heading') is not None:
+                titles['MainHeading'].append(item['main_heading'])
+            titles['Section'].extend(section['title'] for section in item.get('section') or [])
+        return cls(titles)
+
+    def heading_type(self, line: str) -> Tuple[Optional[str], str]:
+        """(heading type or None, heading text) of a markdown heading line"""
+        heading = clean_heading(line)
+        if 'compliance recommendations' in heading.lower():
+            return 'ComplianceRecommendations', heading
+        normalized = normalize_title(heading, strip_numbers=False)
+        for heading_type, matcher in self.matchers.items():
+            if matcher.matches(normalized):
+                return heading_type, heading
+        return None, heading
+
+    def normalize_lines(self, lines: Iterable[str], counts: Optional[Counter] = None) -> Iterator[str]:
+        """Rewrite heading lines (readlines() style, with line endings) in one streaming pass"""
+        counts = counts if counts is not None else Counter()
+        seen_section = False
+        # Lines from the first undecided Compliance Recommendations heading on; those
+        # headings are (heading, extra) pairs until the next section settles them
+        pending: List[Union[str, Tuple[str, str]]] = []
+
+        def flush(between_sections: bool) -> Iterator[str]:
+            for item in pending:
+                if isinstance(item, tuple):
+                    counts['ComplianceRecommendations' if between_sections else 'extra'] += 1
+                    yield item[0] if between_sections else item[1]
+                else:
+                    yield item
+            pending.clear()
+
+        for line in lines:
+            if not line.strip().startswith('#'):
+                output = line
+            else:
+                heading_type, heading = self.heading_type(line)
+                extra = f"<extra>{line.strip()}</extra>\n"
+                if heading_type == 'ComplianceRecommendations':
+                    if seen_section:
+                        pending.append((f"{self.HEADING_LEVELS[heading_type]} {heading}\n", extra))
+                        continue
+                    counts['extra'] += 1
+                    output = extra
+                else:
+                    counts[heading_type or 'extra'] += 1
+                    output = f"{self.HEADING_LEVELS[heading_type]} {heading}\n" if heading_type else extra
+                    if heading_type == 'Section':
+                        seen_section = True
+                        yield from flush(between_sections=True)
+
+            if pending:
+                pending.append(output)
+            else:
+                yield output
+        yield from flush(between_sections=False)
+
+class MarkdownPreprocessor:
+    """
+    Standardizes the CHAPTER, SECTION and Article headings and numbered lists
+    of regulation markdown (AI Act, GDPR)
+
+    A heading line takes the next non-empty line as its title unless that
+    line is itself another kind of heading. Lines without a # are never
+    headings, so only they reach the list patterns.
+    """
+
+    def __init__(self, log_level: int = logging.INFO):
+        self.logger = logging.getLogger(__name__)
+        self.logger.setLevel(log_level)
+
+    def process_file(self, input_path: Union[str, Path], output_path: Optional[Union[str, Path]] = None) -> str:
+        """
+        Standardize a markdown file
+
+        Args:
+            input_path: Path to the input markdown file
+            output_path: Path where the processed file should be saved (optional)
+
+        Returns:
+            The processed markdown content
+        """
+        input_path = Path(input_path)
+        if not input_path.exists():
+            self.logger.error(f"Input file not found: {input_path}")
+            raise FileNotFoundError(f"Input file not found: {input_path}")
+
+        processed_content = self.process_text(input_path.read_text(encoding='utf-8'))
+        if output_path:
+            output_path = Path(output_path)
+            output_path.parent.mkdir(parents=True, exist_ok=True)
+            output_path.write_text(processed_content, encoding='utf-8')
+            self.logger.info(f"Processed markdown saved to: {output_path}")
+        return processed_content
+
+    def process_text(self, content: str) -> str:
+        return '\n'.join(self.process_lines(content.split('\n')))
+
+    @staticmethod
+    def _next_non_empty(lines: List[str], index: int) -> Tuple[Optional[int], Optional[str]]:
+        for next_index in range(index + 1, len(lines)):
+            if lines[next_index].strip():
+                return next_index, lines[next_index].strip()
+        return None, None
+
+    def _heading(self, lines: List[str], index: int, number_pattern: re.Pattern, not_title: re.Pattern,
+                 prefix: str) -> Tuple[str, int]:
+        """Standardized heading at lines[index] and the index of the line after it (and its title)"""
+        match = number_pattern.search(lines[index].strip())
+        heading = f"{prefix} {match.group(1).strip() if match else ''}"
+        next_index, next_content = self._next_non_empty(lines, index)
+        if next_index is not None and not not_title.search(next_content):
+            return f"{heading}: {clean_heading(next_content)}", next_index + 1
+        return heading, index + 1
+
+    def process_lines(self, lines: List[str]) -> List[str]:
+        return [line for _, line in self.iter_processed_lines(lines)]
+
+    def iter_processed_lines(self, lines: List[str]) -> Iterator[Tuple[int, str]]:
+        """(index of the input line it starts at, output line) for every output line, a heading and its title being one"""
+        i = 0
+        while i < len(lines):
+            current_line = lines[i].strip()
+            if '#' in current_line:
+                if CHAPTER.search(current_line):
+                    heading, next_i = self._heading(lines, i, CHAPTER_NUMBER, NOT_CHAPTER_TITLE, "## CHAPTER")
+                    yield i, heading
+                    i = next_i
+                    continue
+                if ARTICLE.search(current_line):
+                    heading, next_i = self._heading(lines, i, ARTICLE_NUMBER, NOT_ARTICLE_TITLE, "#### *Article")
+                    yield i, heading
+                    i = next_i
+                    continue
+                if SECTION.search(current_line):
+                    heading, next_i = self._heading(lines, i, SECTION_NUMBER_TITLE, NOT_SECTION_TITLE, "### *SECTION")
+                    yield i, heading
+                    i = next_i
+                    continue
+
+            # Numbered lists: "- 1." becomes "- (1)" and a leading "1." becomes "(1)"
+            if current_line.startswith('- ') and DASH_NUMBERED_ITEM.match(current_line):
+                number = DASH_NUMBERED_ITEM.match(current_line).group(1)
+                yield i, current_line.replace(f"- {number}.", f"- ({number})")
+            elif NUMBERED_ITEM.match(current_line):
+                number = NUMBERED_ITEM.match(current_line).group(1)
+                yield i, current_line.replace(f"{number}.", f"({number})")
+            else:
+                yield i, lines[i]
+            i += 1
+
+def load_heading_normalizer(toc_path: Union[str, Path]) -> Union[TocHeadingNormalizer, CcpaHeadingNormalizer]:
+    """Build the normalizer matching a TOC JSON file: ccpaTOC for the CCPA, parts otherwise"""
+    with open(toc_path, 'r', encoding='utf-8') as f:
+        toc_data = json.load(f)
+    if 'ccpaTOC' in toc_data:
+        return CcpaHeadingNormalizer.from_toc(toc_data)
+    return TocHeadingNormalizer.from_toc(toc_data)
+
+def normalize_ranges(texts: List[str],
+                     normalizer: Union[TocHeadingNormalizer, CcpaHeadingNormalizer, MarkdownPreprocessor]) -> List[str]:
+    """
+    Repair the headings of a document converted in ranges as one text, then split it back into the ranges
+
+    Rules that look across lines, the CCPA Compliance Recommendations rule
+    and the title lookahead of MarkdownPreprocessor, see the whole document,
+    so '\n'.join() of the result is the output for the joined text. Every
+    output line stays with the range of the input line it starts at.
+
+    Args:
+        texts: Markdown of consecutive ranges of one document
+        normalizer: Heading normalizer or MarkdownPreprocessor to apply
+
+    Returns:
+        Repaired markdown of every range
+    """
+    range_of_line = [position for position, text in enumerate(texts) for _ in text.split('\n')]
+    outputs: List[List[str]] = [[] for _ in texts]
+    joined = '\n'.join(texts)
+    if isinstance(normalizer, MarkdownPreprocessor):
+        for index, line in normalizer.iter_processed_lines(joined.split('\n')):
+            outputs[range_of_line[index]].append(line)
+        return ['\n'.join(lines) for lines in outputs]
+
+    for index, line in enumerate(normalizer.normalize_lines(io.StringIO(joined))):
+        outputs[range_of_line[index]].append(line)
+    # Every range but the last ends with the newline that joined it to the next one
+    return [''.join(lines)[:-1] if position < len(texts) - 1 else ''.join(lines)
+            for position, lines in enumerate(outputs)]
+
+def normalize_markdown_file(input_md_path: Union[str, Path], output_md_path: Union[str, Path],
+                            toc_path: Union[str, Path]) -> Counter:
+    """
+    Repair the headings of a markdown file against a TOC JSON file
+
+    Returns:
+        Number of headings rewritten per heading type, and of headings wrapped as extra
+    """
+    normalizer = load_heading_normalizer(toc_path)
+    counts = Counter()
+    with open(input_md_path, 'r', encoding='utf-8') as source, open(output_md_path, 'w', encoding='utf-8') as target:
+        target.writelines(normalizer.normalize_lines(source, counts))
+    return counts
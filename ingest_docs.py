@@ -0,0 +1,489 @@
+# Convert and chunk every PDF in Docs/ into Experiments/002/document_chunks.json using:
+#   python ingest_docs.py 002
+# Stream JSONL instead, from selected PDFs, with 8 worker processes:
+#   python ingest_docs.py 002 --pdfs Docs/AI_ACT.pdf Docs/Privacy_Act_AU.pdf --format jsonl --workers 8
+# Converted markdown and chunks are cached in .preprocess_cache/, reruns only redo ranges or stages whose inputs changed
+# Repair headings against a table of contents, or standardize regulation headings, before chunking:
+#   python ingest_docs.py 002 --toc Privacy_Act_AU=Experiments/002/toc_data_full_mistral.json --standardize_headings AI_ACT GDPR
+
+import os
+import json
+import argparse
+import logging
+import multiprocessing
+import statistics
+import sys
+import tempfile
+from concurrent.futures import Future, ProcessPoolExecutor
+from functools import lru_cache
+from importlib.metadata import version
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple, Union
+from transformers import AutoTokenizer
+from docling.chunking import HybridChunker
+from docling.datamodel.base_models import InputFormat
+from docling.datamodel.pipeline_options import AcceleratorDevice, AcceleratorOptions, PdfPipelineOptions
+from docling.document_converter import DocumentConverter, PdfFormatOption
+from heading_normalizer import MarkdownPreprocessor, load_heading_normalizer, normalize_ranges
+from preprocess_cache import DEFAULT_CACHE_DIR, PreprocessCache, file_sha256, text_sha256
+from utils import pdf_page_ranges, save_pdf_pages
+
+DOCS_DIR = "Docs"
+BASE_EXPERIMENTS_PATH = "Experiments"
+TOKENIZER_MODEL = "answerdotai/ModernBERT-base"  # Tokenizer the HybridChunker sizes chunks with
+PAGES_PER_RANGE = 20  # Pages converted per task; changing it changes the chunk ids of multi-range documents
+TOKEN_COUNT_BATCH_SIZE = 256  # Chunks tokenized per fast tokenizer call
+CHUNK_FORMAT_VERSION = 2  # Bumped when the fields of the chunk stage output change
+OUTPUT_FORMATS = ['json', 'jsonl']
+CONVERT_STAGE = "convert"  # PDF page range -> markdown
+HEADINGS_STAGE = "headings"  # markdown of a whole document -> repaired markdown, only for documents given a heading source
+CHUNK_STAGE = "chunk"  # markdown -> chunks
+HEADINGS_VERSION = 2  # Bumped when the heading rules of heading_normalizer change
+STANDARDIZE_HEADINGS = "standardize"  # Heading source of regulations: CHAPTER/SECTION/Article rules, no TOC
+
+# Converter, tokenizer, chunker and cache of this worker process, built once by _init_worker
+_converter = None
+_tokenizer = None
+_chunker = None
+_cache = None
+
+def convert_config() -> Dict:
+    """Everything besides the PDF that determines the converted markdown"""
+    return {"docling": version("docling"), "pipeline": "PdfPipelineOptions"}
+
+def headings_config(heading_source: str) -> Dict:
+    """Everything besides the markdown that determines the repaired headings"""
+    if heading_source == STANDARDIZE_HEADINGS:
+        return {"normalizer": STANDARDIZE_HEADINGS, "version": HEADINGS_VERSION}
+    return {"normalizer": "toc", "toc": file_sha256(Path(heading_source)), "version": HEADINGS_VERSION}
+
+def chunk_config(tokenizer_model: str, max_tokens: Optional[int]) -> Dict:
+    """Everything besides the markdown that determines the chunks"""
+    return {
+        "docling": version("docling"), "tokenizer": tokenizer_model, "max_tokens": max_tokens, "merge_peers": True,
+        "format": CHUNK_FORMAT_VERSION,
+    }
+
+def count_tokens(tokenizer, texts: List[str], batch_size: int = TOKEN_COUNT_BATCH_SIZE) -> List[int]:
+    """
+    Token count of every text, tokenized in batches
+
+    Counts exclude special tokens, like len(tokenizer.tokenize(text)) in the
+    notebook's chunk statistics, but a fast tokenizer encodes a whole batch
+    in one call.
+    """
+    counts = []
+    for start in range(0, len(texts), batch_size):
+        encoded = tokenizer(texts[start:start + batch_size], add_special_tokens=False, verbose=False)
+        counts.extend(len(input_ids) for input_ids in encoded['input_ids'])
+    return counts
+
+def chunk_statistics(records: List[Dict]) -> Dict[str, Dict[str, float]]:
+    """Per-document chunk length statistics from the precomputed token_count of every chunk"""
+    lengths: Dict[str, List[int]] = {}
+    for record in records:
+        lengths.setdefault(record['document_name'], []).append(record['token_count'])
+    return {
+        doc_name: {
+            'total_chunks': len(chunk_lengths),
+            'mean_length': statistics.fmean(chunk_lengths),
+            'median_length': statistics.median(chunk_lengths),
+            'min_length': min(chunk_lengths),
+            'max_length': max(chunk_lengths),
+            'std_dev': statistics.pstdev(chunk_lengths),
+        }
+        for doc_name, chunk_lengths in lengths.items()
+    }
+
+def _init_worker(tokenizer_model: str, max_tokens: Optional[int], num_threads: int, cache_dir: Optional[str]):
+    """Worker initializer: load the docling models and tokenizer once per process"""
+    global _converter, _tokenizer, _chunker, _cache
+    _cache = PreprocessCache(cache_dir) if cache_dir else None
+    pipeline_options = PdfPipelineOptions()
+    pipeline_options.accelerator_options = AcceleratorOptions(num_threads=num_threads, device=AcceleratorDevice.CPU)
+    _converter = DocumentConverter(
+        format_options={InputFormat.PDF: PdfFormatOption(pipeline_options=pipeline_options)}
+    )
+    _tokenizer = AutoTokenizer.from_pretrained(tokenizer_model, use_fast=True)
+    chunker_options = dict(tokenizer=_tokenizer, merge_peers=True)
+    if max_tokens:
+        chunker_options['max_tokens'] = max_tokens
+    _chunker = HybridChunker(**chunker_options)
+
+@lru_cache(maxsize=None)
+def _heading_normalizer(toc_path: str):
+    """Heading normalizer of a TOC JSON file, compiled once per process"""
+    return load_heading_normalizer(toc_path)
+
+def normalize_headings(markdowns: List[str], heading_source: str) -> List[str]:
+    """
+    Repair the headings of a document's converted ranges against a TOC JSON file, or standardize regulation headings
+
+    The ranges are repaired as one text, like the notebook repairs the whole
+    document, and split back at the same boundaries for chunking.
+    """
+    normalizer = MarkdownPreprocessor() if heading_source == STANDARDIZE_HEADINGS else _heading_normalizer(heading_source)
+    return normalize_ranges(markdowns, normalizer)
+
+def _convert_pages(pdf_path: str, page_from: int, page_to: int, work_dir: str) -> str:
+    """Convert one page range of a PDF to markdown"""
+    range_path = Path(work_dir) / f"{Path(pdf_path).stem}_pages_{page_from}-{page_to}.pdf"
+    save_pdf_pages(pdf_path, page_from, page_to, str(range_path))
+    try:
+        return _converter.convert(source=str(range_path)).document.export_to_markdown()
+    finally:
+        range_path.unlink(missing_ok=True)
+
+def _chunk_markdown(markdown: str, name: str, work_dir: str) -> List[Dict]:
+    """Chunk converted markdown, with the heading path of every chunk as its metadata and its token count"""
+    markdown_path = Path(work_dir) / f"{name}.md"
+    markdown_path.write_text(markdown, encoding='utf-8')
+    try:
+        document = _converter.convert(source=str(markdown_path)).document
+        chunks = [
+            {
+                "content": _chunker.serialize(chunk=chunk),
+                "metadata": {f"Header {level}": heading for level, heading in enumerate(chunk.meta.headings or [], 1)},
+            }
+            for chunk in _chunker.chunk(dl_doc=document)
+        ]
+    finally:
+        markdown_path.unlink(missing_ok=True)
+
+    for chunk, token_count in zip(chunks, count_tokens(_tokenizer, [chunk["content"] for chunk in chunks])):
+        chunk["token_count"] = token_count
+    return chunks
+
+def _convert_range(pdf_path: str, pdf_hash: str, page_from: int, page_to: int, work_dir: str,
+                   stage_configs: Dict[str, Dict]) -> str:
+    """Markdown of one page range of a PDF, reusing the cached conversion"""
+    convert_key = PreprocessCache.make_key(
+        CONVERT_STAGE, pdf_hash, dict(stage_configs[CONVERT_STAGE], pages=[page_from, page_to])
+    )
+    converted = _cache.get(CONVERT_STAGE, convert_key) if _cache else None
+    if converted is None:
+        converted = {"markdown": _convert_pages(pdf_path, page_from, page_to, work_dir)}
+        if _cache:
+            _cache.set(CONVERT_STAGE, convert_key, converted)
+    return converted["markdown"]
+
+def _chunk_range(markdown: str, name: str, work_dir: str, stage_configs: Dict[str, Dict]) -> List[Dict]:
+    """Chunks of the markdown of one page range, reusing the cached chunks"""
+    chunk_key = PreprocessCache.make_key(CHUNK_STAGE, text_sha256(markdown), stage_configs[CHUNK_STAGE])
+    chunks = _cache.get(CHUNK_STAGE, chunk_key) if _cache else None
+    if chunks is None:
+        chunks = _chunk_markdown(markdown, name, work_dir)
+        if _cache:
+            _cache.set(CHUNK_STAGE, chunk_key, chunks)
+    return chunks
+
+def _process_pages(pdf_path: str, pdf_hash: str, page_from: int, page_to: int, work_dir: str,
+                   stage_configs: Dict[str, Dict]) -> List[Dict]:
+    """
+    Convert and chunk one page range of a PDF without a heading source, reusing every cached stage output
+
+    Returns:
+        Chunks of the range in document order, each with its content and heading metadata
+    """
+    markdown = _convert_range(pdf_path, pdf_hash, page_from, page_to, work_dir, stage_configs)
+    return _chunk_range(markdown, _range_name(pdf_path, page_from, page_to), work_dir, stage_configs)
+
+def _range_name(pdf_path: str, page_from: int, page_to: int) -> str:
+    return f"{Path(pdf_path).stem}_pages_{page_from}-{page_to}"
+
+class DocumentIngestor:
+    """
+    Turns PDFs into chunks across a pool of worker processes
+
+    Every PDF is split into ranges of pages_per_range pages and each range is
+    converted and chunked as a separate task, so one long document keeps every
+    worker busy. A range is converted to markdown, which is then chunked,
+    like the notebook flow. Documents with a heading source get their
+    headings repaired in between, over the markdown of the whole document,
+    so their ranges are chunked once every range is converted. Every stage is cached on the hash of its input
+    and its configuration; ranges whose chunks are cached never reach the
+    pool. Results are consumed in (document, range) order, which makes
+    the chunk ids DOC_NAME_chunk_N independent of the number of workers and of
+    the order in which tasks finish. A section that spans two ranges is split
+    into two chunks and the second one starts without its heading metadata.
+    """
+
+    def __init__(self, workers: Optional[int] = None, pages_per_range: int = PAGES_PER_RANGE,
+                 tokenizer_model: str = TOKENIZER_MODEL, max_tokens: Optional[int] = None,
+                 cache_dir: Optional[str] = DEFAULT_CACHE_DIR, heading_sources: Optional[Dict[str, str]] = None):
+        """
+        Args:
+            workers: Worker processes (default: one per CPU core)
+            pages_per_range: Pages converted per task
+            tokenizer_model: Hugging Face tokenizer used to size the chunks
+            max_tokens: Maximum tokens per chunk (defaults to the tokenizer's limit)
+            cache_dir: Directory of the preprocessing cache (None always reruns every stage)
+            heading_sources: TOC JSON file, or STANDARDIZE_HEADINGS, per document name whose headings get repaired
+        """
+        self.logger = self._setup_logger()
+        self.workers = workers or os.cpu_count() or 1
+        self.pages_per_range = pages_per_range
+        self.tokenizer_model = tokenizer_model
+        self.max_tokens = max_tokens
+        self.cache_dir = cache_dir
+        self.cache = PreprocessCache(cache_dir) if cache_dir else None
+        self.heading_sources = heading_sources or {}
+        self.stage_configs = {
+            CONVERT_STAGE: convert_config(),
+            CHUNK_STAGE: chunk_config(tokenizer_model, max_tokens),
+        }
+
+    def _setup_logger(self) -> logging.Logger:
+        """Configure and return a logger instance"""
+        logger = logging.getLogger(__name__)
+        logger.setLevel(logging.INFO)
+
+        if not logger.handlers:
+            console_handler = logging.StreamHandler()
+            formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+            console_handler.setFormatter(formatter)
+            logger.addHandler(console_handler)
+
+        return logger
+
+    def _cached_markdown(self, pdf_hash: str, page_from: int, page_to: int,
+                         stage_configs: Dict[str, Dict]) -> Optional[str]:
+        """Converted markdown of a page range straight from the cache, if neither the PDF nor the converter changed"""
+        if self.cache is None:
+            return None
+        convert_key = PreprocessCache.make_key(
+            CONVERT_STAGE, pdf_hash, dict(stage_configs[CONVERT_STAGE], pages=[page_from, page_to])
+        )
+        converted = self.cache.get(CONVERT_STAGE, convert_key)
+        return converted["markdown"] if converted is not None else None
+
+    def _cached_range_chunks(self, markdown: str, stage_configs: Dict[str, Dict]) -> Optional[List[Dict]]:
+        """Chunks of a range's markdown straight from the cache"""
+        if self.cache is None:
+            return None
+        return self.cache.get(CHUNK_STAGE, PreprocessCache.make_key(
+            CHUNK_STAGE, text_sha256(markdown), stage_configs[CHUNK_STAGE]
+        ))
+
+    def _repair_headings(self, markdowns: List[str], stage_configs: Dict[str, Dict],
+                         heading_source: str) -> List[str]:
+        """Repaired markdown of every range of a document, reusing the cached repair of the same document"""
+        headings_key = PreprocessCache.make_key(
+            HEADINGS_STAGE, text_sha256(json.dumps(markdowns, ensure_ascii=False)), stage_configs[HEADINGS_STAGE]
+        )
+        normalized = self.cache.get(HEADINGS_STAGE, headings_key) if self.cache else None
+        if normalized is None:
+            normalized = {"markdowns": normalize_headings(markdowns, heading_source)}
+            if self.cache:
+                self.cache.set(HEADINGS_STAGE, headings_key, normalized)
+        return normalized["markdowns"]
+
+    def iter_chunks(self, pdf_paths: List[Path]) -> Iterator[Dict]:
+        """
+        Convert and chunk the PDFs in parallel, yielding chunk records in document order
+
+        Args:
+            pdf_paths: PDFs to ingest; each document is named after its file
+
+        Returns:
+            Iterator over records with chunk_id, document_name, chunk_content, chunk_metadata,
+            token_count (tokens of the chunking tokenizer) and pages
+        """
+        tasks: List[Tuple[str, str, int, int]] = []
+        document_stages: Dict[str, Tuple[Dict[str, Dict], Optional[str]]] = {}
+        for pdf_path in pdf_paths:
+            pdf_hash = file_sha256(pdf_path)
+            ranges = pdf_page_ranges(str(pdf_path), self.pages_per_range)
+            self.logger.info(f"{pdf_path.name}: {ranges[-1][1] if ranges else 0} pages in {len(ranges)} ranges")
+            tasks.extend((str(pdf_path), pdf_hash, page_from, page_to) for page_from, page_to in ranges)
+            heading_source = self.heading_sources.get(pdf_path.stem)
+            stage_configs = dict(self.stage_configs)
+            if heading_source:
+                stage_configs[HEADINGS_STAGE] = headings_config(heading_source)
+            document_stages[str(pdf_path)] = (stage_configs, heading_source)
+
+        num_threads = max(1, (os.cpu_count() or 1) // self.workers)
+        # Spawned rather than forked, the docling models use torch
+        context = multiprocessing.get_context('spawn')
+        with tempfile.TemporaryDirectory(prefix="ingest_") as work_dir, ProcessPoolExecutor(
+            max_workers=self.workers, mp_context=context,
+            initializer=_init_worker,
+            initargs=(self.tokenizer_model, self.max_tokens, num_threads, self.cache_dir)
+        ) as executor:
+            # Worker processes, and the models they load, only start if some range is not cached
+            results: List[Union[List[Dict], Future, None]] = []
+            conversions: Dict[str, List[Tuple[int, Union[str, Future]]]] = {}
+            try:
+                for position, (pdf_path, pdf_hash, page_from, page_to) in enumerate(tasks):
+                    stage_configs, heading_source = document_stages[pdf_path]
+                    markdown = self._cached_markdown(pdf_hash, page_from, page_to, stage_configs)
+                    if heading_source:
+                        # Chunked below, once the headings of the whole document are repaired
+                        if markdown is None:
+                            markdown = executor.submit(
+                                _convert_range, pdf_path, pdf_hash, page_from, page_to, work_dir, stage_configs
+                            )
+                        conversions.setdefault(pdf_path, []).append((position, markdown))
+                        results.append(None)
+                        continue
+                    cached = self._cached_range_chunks(markdown, stage_configs) if markdown is not None else None
+                    results.append(cached if cached is not None else executor.submit(
+                        _process_pages, pdf_path, pdf_hash, page_from, page_to, work_dir, stage_configs
+                    ))
+
+                for pdf_path, converted in conversions.items():
+                    stage_configs, heading_source = document_stages[pdf_path]
+                    markdowns = [
+                        markdown.result() if isinstance(markdown, Future) else markdown for _, markdown in converted
+                    ]
+                    repaired = self._repair_headings(markdowns, stage_configs, heading_source)
+                    for (position, _), markdown in zip(converted, repaired):
+                        _, _, page_from, page_to = tasks[position]
+                        cached = self._cached_range_chunks(markdown, stage_configs)
+                        results[position] = cached if cached is not None else executor.submit(
+                            _chunk_range, markdown, _range_name(pdf_path, page_from, page_to), work_dir, stage_configs
+                        )
+            except Exception as e:
+                self.logger.error(f"Error converting {Path(pdf_path).stem}: {str(e)}")
+                self._cancel(results, conversions)
+                raise
+            submitted = sum(1 for result in results if not isinstance(result, list))
+            self.logger.info(f"{len(tasks) - submitted} page ranges cached, {submitted} to process")
+
+            chunk_counts: Dict[str, int] = {}
+            for (pdf_path, _, page_from, page_to), result in zip(tasks, results):
+                doc_name = Path(pdf_path).stem
+                try:
+                    chunks = result if isinstance(result, list) else result.result()
+                except Exception as e:
+                    self.logger.error(f"Error converting {doc_name} pages {page_from}-{page_to}: {str(e)}")
+                    self._cancel(results, conversions)
+                    raise
+
+                for chunk in chunks:
+                    chunk_index = chunk_counts.get(doc_name, 0)
+                    chunk_counts[doc_name] = chunk_index + 1
+                    yield {
+                        "chunk_id": f"{doc_name}_chunk_{chunk_index}",
+                        "document_name": doc_name,
+                        "chunk_content": chunk["content"],
+                        "chunk_metadata": chunk["metadata"],
+                        "token_count": chunk["token_count"],
+                        "pages": [page_from, page_to],
+                    }
+                self.logger.info(f"{doc_name} pages {page_from}-{page_to}: {len(chunks)} chunks")
+
+    @staticmethod
+    def _cancel(results: List, conversions: Dict[str, List[Tuple[int, Union[str, Future]]]]):
+        """Cancel every task that has not started, after one failed"""
+        pending = results + [markdown for converted in conversions.values() for _, markdown in converted]
+        for task in pending:
+            if isinstance(task, Future):
+                task.cancel()
+
+    def ingest(self, pdf_paths: List[Path], output_path: Path, output_format: str = 'json') -> int:
+        """
+        Stream the chunks of the PDFs to a JSON array or JSONL file
+
+        The file is written next to output_path and renamed into place once
+        complete, so the indexer never reads a partial chunks file.
+
+        Returns:
+            Number of chunks written
+        """
+        output_path = Path(output_path)
+        output_path.parent.mkdir(parents=True, exist_ok=True)
+        partial_path = output_path.with_name(output_path.name + '.partial')
+        total_chunks = 0
+        lengths = []
+
+        try:
+            with open(partial_path, 'w', encoding='utf-8') as f:
+                if output_format == 'json':
+                    f.write("[\n")
+                for record in self.iter_chunks(pdf_paths):
+                    if output_format == 'jsonl':
+                        f.write(json.dumps(record, ensure_ascii=False) + "\n")
+                    else:
+                        f.write((",\n" if total_chunks else "") + json.dumps(record, indent=2, ensure_ascii=False))
+                    total_chunks += 1
+                    lengths.append({"document_name": record["document_name"], "token_count": record["token_count"]})
+                if output_format == 'json':
+                    f.write("\n]\n")
+            partial_path.replace(output_path)
+        except BaseException:
+            partial_path.unlink(missing_ok=True)
+            raise
+
+        self.logger.info(f"Saved {total_chunks} chunks to {output_path}")
+        for doc_name, doc_stats in chunk_statistics(lengths).items():
+            self.logger.info(
+                f"{doc_name}: {doc_stats['total_chunks']} chunks, tokens mean {doc_stats['mean_length']:.1f}, "
+                f"median {doc_stats['median_length']:.0f}, min {doc_stats['min_length']}, "
+                f"max {doc_stats['max_length']}, std {doc_stats['std_dev']:.1f}"
+            )
+        return total_chunks
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Convert PDFs to chunks in parallel and write the chunks file of an experiment'
+    )
+    parser.add_argument('experiment_number', help='Experiment number, the chunks go to Experiments/<number>/')
+    parser.add_argument('--pdfs', nargs='+', default=None,
+                      help=f'PDFs to ingest (default: every PDF in {DOCS_DIR}/)')
+    parser.add_argument('--format', choices=OUTPUT_FORMATS, default='json',
+                      help='Write document_chunks.json or document_chunks.jsonl (default: json); '
+                           'the indexer only reads the JSONL file when there is no JSON file')
+    parser.add_argument('--output', default=None,
+                      help='Chunks file to write instead of the experiment default')
+    parser.add_argument('--workers', type=int, default=None,
+                      help='Worker processes converting page ranges (default: one per CPU core)')
+    parser.add_argument('--pages_per_range', type=int, default=PAGES_PER_RANGE,
+                      help=f'Pages converted per task (default: {PAGES_PER_RANGE}); keep it fixed for stable chunk ids')
+    parser.add_argument('--tokenizer', default=TOKENIZER_MODEL,
+                      help=f'Tokenizer used to size the chunks (default: {TOKENIZER_MODEL})')
+    parser.add_argument('--max_tokens', type=int, default=None,
+                      help="Maximum tokens per chunk (default: the tokenizer's limit)")
+    parser.add_argument('--toc', nargs='+', default=[], metavar='DOC_NAME=TOC_JSON',
+                      help='Repair the headings of a document against its table of contents JSON '
+                           '(Privacy Act parts or CCPA ccpaTOC layout) before chunking')
+    parser.add_argument('--standardize_headings', nargs='+', default=[], metavar='DOC_NAME',
+                      help='Standardize the CHAPTER, SECTION and Article headings of these regulations before chunking')
+    parser.add_argument('--cache_dir', default=DEFAULT_CACHE_DIR,
+                      help=f'Preprocessing cache of converted markdown and chunks (default: {DEFAULT_CACHE_DIR})')
+    parser.add_argument('--no_cache', action='store_true',
+                      help='Rerun every stage instead of reusing cached outputs')
+
+    args = parser.parse_args()
+    pdf_paths = [Path(pdf) for pdf in args.pdfs] if args.pdfs else sorted(Path(DOCS_DIR).glob("*.pdf"))
+    if not pdf_paths:
+        parser.error(f'no PDFs found in {DOCS_DIR}/')
+    heading_sources = {doc_name: STANDARDIZE_HEADINGS for doc_name in args.standardize_headings}
+    for toc_arg in args.toc:
+        doc_name, separator, toc_path = toc_arg.partition('=')
+        if not separator or not Path(toc_path).is_file():
+            parser.error(f'--toc expects DOC_NAME=TOC_JSON with an existing file, got {toc_arg}')
+        heading_sources[doc_name] = toc_path
+    output_path = Path(args.output) if args.output else \
+        Path(BASE_EXPERIMENTS_PATH) / args.experiment_number / f"document_chunks.{args.format}"
+
+    try:
+        ingestor = DocumentIngestor(
+            workers=args.workers,
+            pages_per_range=args.pages_per_range,
+            tokenizer_model=args.tokenizer,
+            max_tokens=args.max_tokens,
+            cache_dir=None if args.no_cache else args.cache_dir,
+            heading_sources=heading_sources
+        )
+        ingestor.ingest(pdf_paths, output_path, args.format)
+
+    except KeyboardInterrupt:
+        print("\n\nIngestion interrupted by user. Exiting...")
+        sys.exit(1)
+    except Exception as e:
+        print(f"\nIngestion failed: {str(e)}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+import json
+import hashlib
+import os
+import tempfile
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+DEFAULT_CACHE_DIR = ".preprocess_cache"
+HASH_READ_SIZE = 1 << 20  # Bytes read per step when hashing input files
+
+def file_sha256(path: Path) -> str:
+    """Content hash of a file, read in pieces so large PDFs are not loaded at once"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(HASH_READ_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def text_sha256(text: str) -> str:
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+class PreprocessCache:
+    """
+    Content-addressed store for the outputs of the preprocessing stages
+
+    An entry is keyed on the hash of the stage input and the stage
+    configuration, so it is reused whenever both are unchanged, whichever
+    file path or run produced it. Chaining stages on the hash of the previous
+    stage's output means a change only reruns the stages downstream of it.
+    Entries are JSON files written atomically, so worker processes can share
+    the cache without locking.
+    """
+
+    def __init__(self, cache_dir: str = DEFAULT_CACHE_DIR):
+        self.cache_dir = Path(cache_dir)
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(stage: str, input_hash: str, config: Optional[Dict] = None) -> str:
+        """Fingerprint a stage run from its name, the hash of its input and its configuration"""
+        payload = json.dumps(
+            {"stage": stage, "input": input_hash, "config": config or {}},
+            sort_keys=True,
+            ensure_ascii=False,
+            default=str
+        )
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def _path(self, stage: str, key: str) -> Path:
+        return self.cache_dir / stage / key[:2] / f"{key}.json"
+
+    def get(self, stage: str, key: str) -> Optional[Any]:
+        """Return the cached output of a stage run, or None if it was never stored"""
+        path = self._path(stage, key)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                value = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return value
+
+    def set(self, stage: str, key: str, value: Any):
+        """Store the output of a stage run"""
+        path = self._path(stage, key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, partial_path = tempfile.mkstemp(dir=path.parent, suffix='.partial')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(value, f, ensure_ascii=False)
+            os.replace(partial_path, path)
+        except BaseException:
+            Path(partial_path).unlink(missing_ok=True)
+            raise
+
+    def stats(self) -> Dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses}
@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# The preprocessing modules live at the repository root and are run as scripts
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
@@ -0,0 +1,134 @@
+import json
+import pytest
+from heading_normalizer import (
+    CcpaHeadingNormalizer, MarkdownPreprocessor, TocHeadingNormalizer, normalize_markdown_file, normalize_ranges
+)
+
+# Expected outputs were produced by the notebook's process_markdown, process_ccpa_markdown and
+# MarkdownPreprocessor._process_content on the same inputs
+PRIVACY_TOC = {'parts': [{
+    'title': 'Part I—Preliminary',
+    'divisions': [{
+        'title': 'Division 1—Interpretation',
+        'sub_divisions': [{'title': 'Subdivision A—General', 'sections': [{'title': '6 Interpretation'}]}],
+        'sections': [{'title': '6A Breach of an Australian Privacy Principle'}],
+    }],
+    'sections': [{'title': '1 Short title'}],
+}]}
+PRIVACY_MARKDOWN = (
+    "## PART I—PRELIMINARY\n"
+    "Some text\n"
+    "# Division 1 - Interpretation\n"
+    "### Subdivision A-General\n"
+    "## 6 Interpretation\n"
+    "(1) In this Act\n"
+    "## Notes\n"
+    "#### 6A Breach of an Australian Privacy Principle"
+)
+PRIVACY_EXPECTED = (
+    "## PART I—PRELIMINARY\n"
+    "Some text\n"
+    "### Division 1 - Interpretation\n"
+    "#### Subdivision A-General\n"
+    "##### 6 Interpretation\n"
+    "(1) In this Act\n"
+    "<extra>## Notes</extra>\n"
+    "##### 6A Breach of an Australian Privacy Principle\n"
+)
+
+CCPA_TOC = {'ccpaTOC': [
+    {'main_heading': 'TITLE 1.81.5. California Consumer Privacy Act of 2018', 'section': [
+        {'title': '1798.100. General Duties of Businesses', 'page_number': 1},
+        {'title': '1798.105. Consumers Right to Delete', 'page_number': 2},
+    ]},
+]}
+CCPA_MARKDOWN = (
+    "## Compliance Recommendations\n"
+    "# TITLE 1.81.5. California Consumer Privacy Act of 2018\n"
+    "## 1798.100. General Duties of Businesses\n"
+    "## Compliance Recommendations\n"
+    "Keep records.\n"
+    "## 1798.105. Consumers Right to Delete\n"
+    "## Compliance Recommendations\n"
+    "Delete on request.\n"
+)
+CCPA_EXPECTED = (
+    "<extra>## Compliance Recommendations</extra>\n"
+    "## TITLE 1.81.5. California Consumer Privacy Act of 2018\n"
+    "### 1798.100. General Duties of Businesses\n"
+    "#### Compliance Recommendations\n"
+    "Keep records.\n"
+    "### 1798.105. Consumers Right to Delete\n"
+    "<extra>## Compliance Recommendations</extra>\n"
+    "Delete on request.\n"
+)
+
+REGULATION_MARKDOWN = (
+    "## CHAPTER I\n"
+    "\n"
+    "GENERAL PROVISIONS\n"
+    "## Article 1\n"
+    "Subject matter\n"
+    "1. The purpose of this Regulation\n"
+    "- 2. first item\n"
+    "## SECTION 2\n"
+    "## Article 2"
+)
+REGULATION_EXPECTED = (
+    "## CHAPTER I: GENERAL PROVISIONS\n"
+    "#### *Article 1: Subject matter\n"
+    "(1) The purpose of this Regulation\n"
+    "- (2) first item\n"
+    "### *SECTION 2\n"
+    "#### *Article 2"
+)
+
+def _split(text, *line_numbers):
+    """Split text into ranges before the given line numbers, dropping the newline each range is joined with"""
+    lines = text.split('\n')
+    bounds = [0, *line_numbers, len(lines)]
+    return ['\n'.join(lines[start:end]) for start, end in zip(bounds, bounds[1:])]
+
+def test_toc_headings(tmp_path):
+    normalizer = TocHeadingNormalizer.from_toc(PRIVACY_TOC)
+    source = tmp_path / "in.md"
+    source.write_text(PRIVACY_MARKDOWN, encoding='utf-8')
+    assert ''.join(normalizer.normalize_lines(source.open(encoding='utf-8'))) == PRIVACY_EXPECTED
+
+def test_ccpa_compliance_recommendations_only_between_sections():
+    normalizer = CcpaHeadingNormalizer.from_toc(CCPA_TOC)
+    assert ''.join(normalizer.normalize_lines(CCPA_MARKDOWN.splitlines(keepends=True))) == CCPA_EXPECTED
+
+def test_normalize_markdown_file_counts(tmp_path):
+    toc_path = tmp_path / "toc.json"
+    toc_path.write_text(json.dumps(CCPA_TOC), encoding='utf-8')
+    source, target = tmp_path / "in.md", tmp_path / "out.md"
+    source.write_text(CCPA_MARKDOWN, encoding='utf-8')
+    counts = normalize_markdown_file(source, target, toc_path)
+    assert target.read_text(encoding='utf-8') == CCPA_EXPECTED
+    assert counts == {'MainHeading': 1, 'Section': 2, 'ComplianceRecommendations': 1, 'extra': 2}
+
+def test_markdown_preprocessor():
+    assert MarkdownPreprocessor().process_text(REGULATION_MARKDOWN) == REGULATION_EXPECTED
+
+@pytest.mark.parametrize("normalizer, text, expected", [
+    (TocHeadingNormalizer.from_toc(PRIVACY_TOC), PRIVACY_MARKDOWN, PRIVACY_EXPECTED),
+    (CcpaHeadingNormalizer.from_toc(CCPA_TOC), CCPA_MARKDOWN, CCPA_EXPECTED),
+    (MarkdownPreprocessor(), REGULATION_MARKDOWN, REGULATION_EXPECTED),
+], ids=['toc', 'ccpa', 'standardize'])
+@pytest.mark.parametrize("line_numbers", [(), (2,), (1, 4), (3, 5, 7)])
+def test_ranges_are_repaired_as_one_document(normalizer, text, expected, line_numbers):
+    ranges = _split(text, *line_numbers)
+    repaired = normalize_ranges(ranges, normalizer)
+    assert len(repaired) == len(ranges)
+    assert '\n'.join(repaired) == expected
+
+def test_title_on_the_next_range_stays_with_its_heading():
+    # The CHAPTER heading ends the first range and its title starts the second
+    repaired = normalize_ranges(["intro\n## CHAPTER I", "GENERAL PROVISIONS\nbody"], MarkdownPreprocessor())
+    assert repaired == ["intro\n## CHAPTER I: GENERAL PROVISIONS", "body"]
+
+def test_compliance_recommendations_across_ranges():
+    normalizer = CcpaHeadingNormalizer.from_toc(CCPA_TOC)
+    repaired = normalize_ranges(_split(CCPA_MARKDOWN, 4), normalizer)
+    assert repaired[0].endswith("#### Compliance Recommendations")
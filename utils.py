@@ -41,6 +41,25 @@ def fix_unicode_characters(json_path: str):
     except Exception as e:
         print(f"Error processing file: {str(e)}")
 
+def pdf_page_ranges(pdf_path, pages_per_range):
+    """
+    Split a PDF into consecutive page ranges for save_pdf_pages.
+    
+    Parameters:
+    pdf_path (str): Path to the input PDF file
+    pages_per_range (int): Number of pages in each range (the last range may be shorter)
+    
+    Returns:
+    list: (page_from, page_to) tuples, 1-based and inclusive like save_pdf_pages
+    """
+    with open(pdf_path, 'rb') as file:
+        total_pages = len(PyPDF2.PdfReader(file).pages)
+    
+    return [
+        (page_from, min(page_from + pages_per_range - 1, total_pages))
+        for page_from in range(1, total_pages + 1, pages_per_range)
+    ]
+
 def save_pdf_pages(pdf_path, page_from, page_to, output_path=None):
     """
     Extract a range of pages from a PDF and save them as a new PDF file.